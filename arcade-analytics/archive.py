@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+OpenArcade page_views archiver.
+Rolls closed months out of the hot page_views table into compressed
+columnar segment files, one per month, and records them in the
+archive_segments catalog. Late rows for a month already archived are folded
+into its segment on the next run. The API reads segments back whenever a
+range reaches past the hot table (see server.py /daily and /export/page_views).
+
+Cron entry (daily; months are only archived once HOT_DAYS have passed):
+  30 4 * * * /usr/bin/python3 /ssd/openarcade/arcade-analytics/archive.py >> /tmp/arcade-archive.log 2>&1
+
+Segment layout:
+  b'OAPVSEG1', u32 header length, JSON header, then one zlib blob per column.
+  ts and id are stored as int64 deltas (rows are in ts order), game_id and
+  visitor_id as plain int32. The header lists each blob's offset, length and
+  crc32 plus the segment's row count and ts/id ranges, as the catalog does.
+"""
+
+import os
+import sys
+import json
+import zlib
+import struct
+import sqlite3
+import time
+import heapq
+from array import array
+from itertools import accumulate
+from datetime import datetime, timezone
+
+from collect import DB_FILE, init_schema, has_legacy_views
+
+ARCHIVE_DIR = os.environ.get('ARCADE_ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'archive'))
+
+HOT_DAYS = 45            # a month is archived once it ended this long ago (> the 30-day API windows)
+DELETE_BATCH = 50000     # hot rows deleted per transaction
+FETCH_ROWS = 100000
+VACUUM_PAGES = 20000     # pages handed back per incremental_vacuum call
+
+MAGIC = b'OAPVSEG1'
+COLUMNS = (              # name, array typecode, delta-encoded
+    ('id', 'q', True),
+    ('ts', 'q', True),
+    ('game_id', 'i', False),
+    ('visitor_id', 'i', False),
+)
+LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def month_bounds(ts: int) -> tuple:
+    """(start_ts, end_ts, 'YYYY-MM') of the UTC month containing ts."""
+    d = datetime.fromtimestamp(ts, timezone.utc)
+    start = datetime(d.year, d.month, 1, tzinfo=timezone.utc)
+    end = datetime(d.year + d.month // 12, d.month % 12 + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp()), int(end.timestamp()), start.strftime('%Y-%m')
+
+
+def hot_floor(db) -> int:
+    """First ts served from the hot table; everything before it is in segments."""
+    return db.execute('SELECT COALESCE(MAX(end_ts), 0) FROM archive_segments').fetchone()[0]
+
+
+# --- Segment files ---
+
+def _encode(values: array, delta: bool) -> bytes:
+    if delta and values:
+        values = array(values.typecode, [values[0]] + [b - a for a, b in zip(values, values[1:])])
+    if not LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return zlib.compress(values.tobytes(), 6)
+
+
+def _decode(blob: bytes, typecode: str, delta: bool) -> array:
+    values = array(typecode)
+    values.frombytes(zlib.decompress(blob))
+    if not LITTLE_ENDIAN:
+        values.byteswap()
+    if delta:
+        values = array(typecode, accumulate(values))
+    return values
+
+
+def write_segment(path: str, month: str, cols: dict) -> dict:
+    """Write the columns atomically (tmp file, fsync, rename); returns the header."""
+    blobs = [_encode(cols[name], delta) for name, _, delta in COLUMNS]
+    header = {
+        'table': 'page_views',
+        'month': month,
+        'rows': len(cols['ts']),
+        'min_ts': cols['ts'][0], 'max_ts': cols['ts'][-1],
+        'min_id': min(cols['id']), 'max_id': max(cols['id']),
+        'columns': [],
+    }
+    offset = 0
+    for (name, typecode, delta), blob in zip(COLUMNS, blobs):
+        header['columns'].append({
+            'name': name, 'type': typecode, 'delta': delta,
+            'offset': offset, 'length': len(blob), 'crc32': zlib.crc32(blob),
+        })
+        offset += len(blob)
+    raw = json.dumps(header, separators=(',', ':')).encode()
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(raw)) + raw)
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return header
+
+
+def read_segment(path: str, names=None) -> dict:
+    """{column name: array} for the requested columns (all by default)."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path}: not a page_views segment')
+        (size,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(size))
+        base = f.tell()
+        out = {}
+        for col in header['columns']:
+            if names and col['name'] not in names:
+                continue
+            f.seek(base + col['offset'])
+            blob = f.read(col['length'])
+            if zlib.crc32(blob) != col['crc32']:
+                raise ValueError(f'{path}: column {col["name"]} fails its checksum')
+            out[col['name']] = _decode(blob, col['type'], col['delta'])
+    return out
+
+
+def segments_between(db, start_ts: int, end_ts: int) -> list:
+    """Catalog rows (month, path, rows, min_ts, max_ts) overlapping [start_ts, end_ts)."""
+    return db.execute(
+        '''SELECT month, path, rows, min_ts, max_ts FROM archive_segments
+           WHERE max_ts >= ? AND min_ts < ? ORDER BY start_ts''',
+        (start_ts, end_ts)
+    ).fetchall()
+
+
+def iter_rows(db, start_ts: int = 0, end_ts: int = 1 << 62, game_id: int = None, chunk: int = 5000):
+    """Yields lists of (id, ts, game_id, visitor_id) from the segments, in ts order."""
+    for seg in segments_between(db, start_ts, end_ts):
+        cols = read_segment(os.path.join(ARCHIVE_DIR, seg[1]))
+        rows = zip(cols['id'], cols['ts'], cols['game_id'], cols['visitor_id'])
+        batch = []
+        for r in rows:
+            if r[1] < start_ts or r[1] >= end_ts or (game_id is not None and r[2] != game_id):
+                continue
+            batch.append(r)
+            if len(batch) >= chunk:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+# --- Archiving ---
+
+def archive_month(db, start_ts: int, end_ts: int, month: str) -> int:
+    """Copy one month to a segment and catalog it. Returns rows archived."""
+    cols = {name: array(typecode) for name, typecode, _ in COLUMNS}
+    days = {}   # day → (views, set of visitor ids)
+    cur = db.execute(
+        'SELECT id, ts, game_id, visitor_id FROM page_views WHERE ts >= ? AND ts < ? ORDER BY ts, id',
+        (start_ts, end_ts)
+    )
+    while True:
+        rows = cur.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        for row_id, ts, game_id, visitor_id in rows:
+            cols['id'].append(row_id)
+            cols['ts'].append(ts)
+            cols['game_id'].append(game_id)
+            cols['visitor_id'].append(visitor_id)
+            day = days.get(ts // 86400)
+            if day is None:
+                day = days[ts // 86400] = [0, set()]
+            day[0] += 1
+            day[1].add(visitor_id)
+    if not cols['ts']:
+        return 0
+
+    name = f'page_views-{month}.seg'
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    header = write_segment(os.path.join(ARCHIVE_DIR, name), month, cols)
+    db.execute(
+        '''INSERT INTO archive_segments
+           (month, path, rows, start_ts, end_ts, min_ts, max_ts, min_id, max_id, bytes, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        (month, name, header['rows'], start_ts, end_ts, header['min_ts'], header['max_ts'],
+         header['min_id'], header['max_id'], os.path.getsize(os.path.join(ARCHIVE_DIR, name)),
+         int(time.time()))
+    )
+    db.executemany(
+        'INSERT OR REPLACE INTO archive_days (day, views, visitors) VALUES (?, ?, ?)',
+        [(day, n, len(v)) for day, (n, v) in days.items()]
+    )
+    db.commit()
+    return header['rows']
+
+
+def fold_stragglers(db, start_ts: int, end_ts: int, month: str) -> int:
+    """Merge late hot rows of an archived month into its segment, refresh
+    the month's archive_days and drop the rows from the hot table. Returns
+    rows folded in.
+
+    Rows already in the segment (a crash after the rewrite) are not added twice."""
+    (path,) = db.execute('SELECT path FROM archive_segments WHERE month = ?', (month,)).fetchone()
+    late = db.execute(
+        'SELECT id, ts, game_id, visitor_id FROM page_views WHERE ts >= ? AND ts < ? ORDER BY ts, id',
+        (start_ts, end_ts)
+    ).fetchall()
+    if not late:
+        return 0
+    pending = {(row_id, ts) for row_id, ts, _, _ in late}
+    old = read_segment(os.path.join(ARCHIVE_DIR, path))
+    pending.difference_update(zip(old['id'], old['ts']))
+    new = [r for r in late if (r[0], r[1]) in pending]
+
+    cols = {name: array(typecode) for name, typecode, _ in COLUMNS}
+    rows = heapq.merge(zip(old['id'], old['ts'], old['game_id'], old['visitor_id']), new,
+                       key=lambda r: (r[1], r[0]))
+    for row_id, ts, game_id, visitor_id in rows:
+        cols['id'].append(row_id)
+        cols['ts'].append(ts)
+        cols['game_id'].append(game_id)
+        cols['visitor_id'].append(visitor_id)
+
+    # Recount the days the late rows touched
+    touched = {ts // 86400 for _, ts, _, _ in late}
+    days = {day: [0, set()] for day in touched}
+    for ts, visitor_id in zip(cols['ts'], cols['visitor_id']):
+        day = days.get(ts // 86400)
+        if day is not None:
+            day[0] += 1
+            day[1].add(visitor_id)
+
+    header = write_segment(os.path.join(ARCHIVE_DIR, path), month, cols)
+    db.execute(
+        '''UPDATE archive_segments SET rows = ?, min_ts = ?, max_ts = ?, min_id = ?, max_id = ?,
+           bytes = ?, cleared = 0 WHERE month = ?''',
+        (header['rows'], header['min_ts'], header['max_ts'], header['min_id'], header['max_id'],
+         os.path.getsize(os.path.join(ARCHIVE_DIR, path)), month)
+    )
+    db.executemany(
+        'INSERT OR REPLACE INTO archive_days (day, views, visitors) VALUES (?, ?, ?)',
+        [(day, n, len(v)) for day, (n, v) in days.items()]
+    )
+    db.commit()
+
+    # Only the late rows are deleted; a crash before this leaves cleared = 0
+    # and the next run's delete_archived sweeps the whole segment instead
+    db.executemany('DELETE FROM page_views WHERE id = ? AND ts = ?', [(r[0], r[1]) for r in late])
+    db.execute('UPDATE archive_segments SET cleared = 1 WHERE month = ?', (month,))
+    db.commit()
+    return len(late)
+
+
+def delete_archived(db, month: str) -> int:
+    """Drop an archived month's rows from the hot table in short transactions.
+
+    Rows are matched on (id, ts) as stored in the segment, never on a range:
+    migrated history has ids above newer rows, so SQLite can hand a freed id
+    to a late straggler, which must stay. Safe to resume after a crash."""
+    (path,) = db.execute('SELECT path FROM archive_segments WHERE month = ?', (month,)).fetchone()
+    cols = read_segment(os.path.join(ARCHIVE_DIR, path), ('id', 'ts'))
+    pairs = list(zip(cols['id'], cols['ts']))
+    deleted = 0
+    for i in range(0, len(pairs), DELETE_BATCH):
+        deleted += db.executemany(
+            'DELETE FROM page_views WHERE id = ? AND ts = ?', pairs[i:i + DELETE_BATCH]
+        ).rowcount
+        db.commit()
+    db.execute('UPDATE archive_segments SET cleared = 1 WHERE month = ?', (month,))
+    db.commit()
+    return deleted
+
+
+def reclaim(db):
+    """Hand freed pages back to the filesystem without a full VACUUM."""
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        # Existing databases only switch to incremental mode through one VACUUM
+        print('Switching arcade.db to auto_vacuum=INCREMENTAL (one-off VACUUM)')
+        db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        db.execute('VACUUM')
+        return
+    while db.execute('PRAGMA freelist_count').fetchone()[0]:
+        db.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES})')
+
+
+def run(db, now: int = None) -> int:
+    """Archive every month that ended HOT_DAYS ago or earlier. Returns rows moved."""
+    if has_legacy_views(db):
+        print('page_views migration still running; not archiving yet')
+        return 0
+    cutoff = (now or int(time.time())) - HOT_DAYS * 86400
+    moved = 0
+
+    # Finish deletions a crash left behind
+    for (month,) in db.execute('SELECT month FROM archive_segments WHERE NOT cleared').fetchall():
+        moved += delete_archived(db, month)
+
+    oldest = db.execute('SELECT MIN(ts) FROM page_views').fetchone()[0]
+    archived = {m for (m,) in db.execute('SELECT month FROM archive_segments')}
+    while oldest is not None:
+        start_ts, end_ts, month = month_bounds(oldest)
+        if end_ts > cutoff:
+            break
+        if month in archived:
+            # Late rows for a month already archived (clients that queued
+            # events offline); they sit below hot_floor, so fold them in
+            gone = fold_stragglers(db, start_ts, end_ts, month)
+            print(f'{month}: {gone} late rows → page_views-{month}.seg')
+            moved += gone
+        elif archive_month(db, start_ts, end_ts, month):
+            gone = delete_archived(db, month)
+            print(f'{month}: {gone} rows → page_views-{month}.seg')
+            moved += gone
+        oldest = db.execute('SELECT MIN(ts) FROM page_views WHERE ts >= ?', (end_ts,)).fetchone()[0]
+
+    if moved:
+        reclaim(db)
+    return moved
+
+
+def main():
+    db = sqlite3.connect(DB_FILE)
+    if not init_schema(db):
+        print('page_views still has the legacy layout; run collect.py first')
+        return
+    moved = run(db)
+    floor = hot_floor(db)
+    if floor:
+        print(f'Archived {moved} page views; page_views holds {datetime.fromtimestamp(floor, timezone.utc):%Y-%m-%d} on')
+    else:
+        print('Nothing to archive yet')
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
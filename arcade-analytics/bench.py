@@ -0,0 +1,939 @@
+#!/usr/bin/env python3
+"""
+OpenArcade analytics benchmarks.
+
+Install: pip install httpx
+Usage:
+  python3 bench.py ingest [--concurrency 16] [--segments 64] [--url http://localhost:8095]
+  python3 bench.py search [--rows 1000000]      (needs numpy)
+  python3 bench.py schema [--rows 1000000]
+  python3 bench.py columnar [--rows 10000000]   (needs numpy)
+  python3 bench.py archive [--rows 5000000]      (numpy for the fill only)
+  python3 bench.py coalesce [--rows 2000000] [--clients 16]
+  python3 bench.py live [--viewers 50] [--commits 10]   (needs uvicorn)
+  python3 bench.py serialize [--repeat 50]   (needs numpy; orjson / brotli when installed)
+  python3 bench.py ship [--lines 100k] [--fail 0.2]   (needs uvicorn)
+  python3 bench.py backup [--rows 2000000] [--interval 2]
+  python3 bench.py suite [--rows 1M|10M|100M] [--db arcade.db] [--out results.json]
+  python3 bench.py compare OLD.json NEW.json
+
+ingest  Upload synthetic 60-second recorder segments (120 frames at 2 fps)
+        concurrently and report segments/s and MB/s. Without --url the
+        ingest app runs in-process against a temporary recordings dir.
+search  Fill a temporary arcade.db with synthetic feedback and time /search
+        queries (FTS5 match + bm25 ranking + snippets) with and without filters.
+        The vocabulary is only ~40 words, so each term matches about a quarter
+        of all rows: a worst case for ranking.
+schema  Build a page_views table in the old text-keyed layout, migrate it to
+        the compact integer layout and compare file size and scan times.
+columnar  /summary, /games and /daily?days=365 through SQLite vs the NumPy
+        column store (columnar.py), plus the store's load time and memory.
+archive  Archive a year of page_views into monthly segments (archive.py) and
+        compare database size, /daily?days=365 latency and a full
+        /export/page_views before and after; results must match.
+coalesce  Several dashboard clients polling /summary and /games at once,
+        each query run per request vs shared through the single-flight layer.
+live    Connect many /live viewers to a local server, commit batches of page
+        views as the collector would and time how long each delta takes to
+        reach every viewer, plus the producer's query count.
+serialize  Encode /list?limit=500, /page-views?limit=5000 and /daily?days=365
+        sized payloads the old way (sqlite3.Row → dict → jsonable_encoder →
+        json.dumps) and the new way (tuples → dict → responses.dumps), then
+        compare gzip and brotli size and time at the middleware's settings.
+ship    Two simulated web nodes run shipper.py against a local API that
+        drops or loses the reply to a share of the batches; one node's log
+        rotates mid-way, the other loses its state file at the end. The
+        collector then counts the stored batches, which must match the game
+        hits in the two logs exactly.
+backup  Copy a WAL-mode arcade.db while a writer commits a page view every
+        few ms: plain file copy, one-shot backup API call and snapshot.py's
+        stepped backup. Reports the writer's commit latency during each and
+        whether the copy is intact (quick_check, and its last page view
+        against the last one committed when the copy started: negative
+        means lost commits).
+suite   Regression suite on gendata.py data (generated once per scale and
+        cached): collect.py ingest lines/s on a generated access log, then
+        p50/p99 of every read endpoint through the full ASGI stack. Writes
+        JSON tagged with the git commit, for `compare` across commits.
+compare  Side-by-side ratios of two suite result files.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+SEGMENT_FRAMES = 120          # 60 s at 2 fps, as recorder.js
+FRAME_BYTES = (18_000, 40_000)  # typical 0.7-quality JPEG of a game canvas
+
+
+def make_segment(game: str, collector: str, session: str, seg_num: int, rng: random.Random):
+    """Build the same multipart fields recorder.js sends for one segment."""
+    sizes = [rng.randint(*FRAME_BYTES) for _ in range(SEGMENT_FRAMES)]
+    frames = os.urandom(sum(sizes))
+    index, offset, t0 = [], 0, int(time.time() * 1000)
+    for i, n in enumerate(sizes):
+        index.append({'offset': offset, 'length': n, 'timestamp_ms': t0 + i * 500})
+        offset += n
+    events = [{'timestamp_ms': t0 + i * 40, 'type': 'keydown', 'key': 'ArrowLeft'}
+              for i in range(600)]
+    metadata = {
+        'game': game, 'session_id': session, 'collector_id': collector,
+        'segment_num': seg_num, 'is_final': False,
+        'canvas_width': 480, 'canvas_height': 640,
+        'duration_ms': (seg_num + 1) * 60000, 'score': seg_num * 100,
+        'user_agent': 'bench', 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+    return {
+        'metadata': (None, json.dumps(metadata)),
+        'frames': ('blob', frames, 'application/octet-stream'),
+        'frame_index': (None, json.dumps(index)),
+        'events': (None, json.dumps(events)),
+    }
+
+
+async def run_ingest(args):
+    import httpx
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+        path = '/api/ingest/browser' if args.nginx else '/ingest/browser'
+        tmp = None
+    else:
+        tmp = tempfile.mkdtemp(prefix='arcade-bench-')
+        os.environ['ARCADE_RECORDINGS_DIR'] = os.path.join(tmp, 'recordings')
+        os.environ['ARCADE_RECORDINGS_DB'] = os.path.join(tmp, 'recordings.db')
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import ingest
+        await ingest.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=ingest.app),
+                                   base_url='http://bench', timeout=60)
+        path = '/ingest/browser'
+
+    rng = random.Random(1)
+    payloads = [make_segment(f'game{i % 8}', f'browser-{i % args.concurrency}',
+                             f'sess{i % args.concurrency}', i // args.concurrency, rng)
+                for i in range(args.segments)]
+    total_bytes = sum(len(p['frames'][1]) for p in payloads)
+
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def upload(files):
+        async with sem:
+            t = time.perf_counter()
+            r = await client.post(path, files=files)
+            r.raise_for_status()
+            latencies.append(time.perf_counter() - t)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(upload(p) for p in payloads))
+    elapsed = time.perf_counter() - t0
+    await client.aclose()
+    if tmp:
+        await ingest.shutdown()
+
+    latencies.sort()
+    print(f'segments:    {args.segments} x ~{total_bytes / args.segments / 1e6:.1f} MB '
+          f'(concurrency {args.concurrency})')
+    print(f'throughput:  {args.segments / elapsed:.1f} segments/s, {total_bytes / elapsed / 1e6:.1f} MB/s')
+    print(f'latency:     p50 {statistics.median(latencies) * 1000:.1f} ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms')
+    # Each real client produces one segment per 60 s
+    print(f'capacity:    ~{int(args.segments / elapsed * 60)} concurrent recording players')
+
+
+def timed_ms(fn, repeat: int = 20) -> list:
+    out = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t) * 1000)
+    return sorted(out)
+
+
+def run_search(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    tmp = tempfile.mkdtemp(prefix='arcade-bench-')
+    import collect
+    import server
+    from gendata import FEEDBACK_WORDS
+    server.DB_FILE = os.path.join(tmp, 'arcade.db')
+
+    db = sqlite3.connect(server.DB_FILE)
+    collect.init_db(db)
+    rng = random.Random(1)
+    games = [f'game{i}' for i in range(150)]
+    cats = ['bug_report', 'feature_suggestion', 'feedback', 'other']
+    now = int(time.time())
+    t0 = time.perf_counter()
+    for start in range(0, args.rows, 50_000):
+        batch = [(now - rng.randint(0, 86400 * 365), rng.choice(games), rng.randint(1, 5),
+                  rng.choice(cats), ' '.join(rng.choices(FEEDBACK_WORDS, k=rng.randint(3, 20))))
+                 for _ in range(min(50_000, args.rows - start))]
+        db.executemany('INSERT INTO ratings (ts, game, stars, category, text) VALUES (?, ?, ?, ?, ?)', batch)
+        db.commit()
+    db.close()
+    print(f'loaded:      {args.rows} ratings in {time.perf_counter() - t0:.1f}s '
+          f'({os.path.getsize(server.DB_FILE) / 1e6:.0f} MB)')
+
+    cases = [
+        ('q=lag', dict(q='lag')),
+        ('q=crash freeze', dict(q='crash freeze')),
+        ('q=collis*', dict(q='collis*')),
+        ('q=lag game=game7', dict(q='lag', game='game7')),
+        ('q=controls stars=1 cat=bug', dict(q='controls mobile', stars=1, category='bug_report')),
+    ]
+    for label, kw in cases:
+        params = dict(game='', stars=0, category='', limit=50)
+        params.update(kw)
+        ms = timed_ms(lambda: server.search_feedback(**params), args.repeat)
+        print(f'{label:30s} p50 {ms[len(ms) // 2]:7.1f} ms   max {ms[-1]:7.1f} ms')
+
+
+LEGACY_PAGE_VIEWS = """
+    CREATE TABLE page_views (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts INTEGER NOT NULL,
+        game TEXT NOT NULL,
+        ip_hash TEXT NOT NULL,
+        date TEXT NOT NULL
+    );
+    CREATE INDEX idx_pv_date ON page_views(date);
+    CREATE INDEX idx_pv_ts ON page_views(ts);
+    CREATE INDEX idx_pv_game_ts ON page_views(game, ts);
+"""
+
+
+def fill_legacy(path: str, rows: int, days: int = 90):
+    """Zipf-ish game mix, repeat visitors, spread over the last `days` days."""
+    db = sqlite3.connect(path)
+    db.executescript(LEGACY_PAGE_VIEWS)
+    rng = random.Random(1)
+    games = [f'game-{i}' for i in range(150)]
+    weights = [1 / (i + 1) for i in range(150)]
+    visitors = [f'{rng.getrandbits(64):016x}' for _ in range(max(1, rows // 8))]
+    now = int(time.time())
+    for start in range(0, rows, 100_000):
+        batch = []
+        for ts in sorted(now - rng.randrange(days * 86400) for _ in range(min(100_000, rows - start))):
+            batch.append((ts, rng.choices(games, weights)[0], rng.choice(visitors),
+                          time.strftime('%Y-%m-%d', time.gmtime(ts))))
+        db.executemany('INSERT INTO page_views (ts, game, ip_hash, date) VALUES (?, ?, ?, ?)', batch)
+    db.commit()
+    db.execute('VACUUM')
+    db.close()
+
+
+def run_schema(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import collect
+    tmp = tempfile.mkdtemp(prefix='arcade-bench-')
+    path = os.path.join(tmp, 'arcade.db')
+    fill_legacy(path, args.rows)
+
+    today = time.strftime('%Y-%m-%d', time.gmtime())
+    month_ago = time.strftime('%Y-%m-%d', time.gmtime(time.time() - 30 * 86400))
+    month_ts = (int(time.time()) // 86400 - 30) * 86400
+    legacy = {
+        'MAU distinct visitors': ('SELECT COUNT(DISTINCT ip_hash) FROM page_views WHERE date >= ?', (month_ago,)),
+        'views per game, 30d': ('SELECT game, COUNT(*) FROM page_views WHERE date >= ? GROUP BY game', (month_ago,)),
+        'DAU per day, 90d': ('SELECT date, COUNT(DISTINCT ip_hash) FROM page_views GROUP BY date', ()),
+        'full scan': ('SELECT COUNT(*), SUM(LENGTH(game)) FROM page_views', ()),
+    }
+    compact = {
+        'MAU distinct visitors': ('SELECT COUNT(DISTINCT visitor_id) FROM page_views WHERE ts >= ?', (month_ts,)),
+        'views per game, 30d': ('SELECT game_id, COUNT(*) FROM page_views WHERE ts >= ? GROUP BY game_id', (month_ts,)),
+        'DAU per day, 90d': ('SELECT ts / 86400 AS d, COUNT(DISTINCT visitor_id) FROM page_views GROUP BY d', ()),
+        'full scan': ('SELECT COUNT(*), SUM(game_id) FROM page_views', ()),
+    }
+
+    def measure(queries):
+        db = sqlite3.connect(path)
+        out = {label: timed_ms(lambda: db.execute(sql, params).fetchall(), args.repeat)[args.repeat // 2]
+               for label, (sql, params) in queries.items()}
+        db.close()
+        return out
+
+    size_before = os.path.getsize(path)
+    before = measure(legacy)
+
+    db = sqlite3.connect(path)
+    t0 = time.perf_counter()
+    collect.init_db(db)
+    collect.migrate_page_views(db, budget_seconds=float('inf'))
+    db.execute('VACUUM')
+    db.close()
+    migrate_s = time.perf_counter() - t0
+    # init_db also builds the bitmap / counter tables; size only what replaces the old table
+    db = sqlite3.connect(path)
+    for t in ('visitor_bitmaps', 'views_minute', 'views_hour'):
+        db.execute(f'DELETE FROM {t}')
+    db.commit()
+    db.execute('VACUUM')
+    db.close()
+    size_after = os.path.getsize(path)
+    after = measure(compact)
+
+    print(f'rows:        {args.rows} (as of {today}), migration + backfills {migrate_s:.1f}s')
+    print(f'db size:     {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB '
+          f'({size_after / size_before:.0%}, incl. games + visitors dimensions)')
+    for label in legacy:
+        print(f'{label:24s} {before[label]:8.1f} ms -> {after[label]:8.1f} ms '
+              f'({before[label] / max(after[label], 1e-6):.1f}x)')
+
+
+def fill_compact(path: str, rows: int, days: int = 365):
+    """page_views in the compact layout, generated with numpy for speed."""
+    import numpy as np
+    import collect
+    db = sqlite3.connect(path)
+    collect.init_db(db)
+    db.executemany('INSERT INTO games (id, name) VALUES (?, ?)', [(i, f'game-{i}') for i in range(1, 151)])
+    db.execute('DROP INDEX idx_pv_ts')
+    db.execute('DROP INDEX idx_pv_game_ts')
+    rng = np.random.default_rng(1)
+    now = int(time.time())
+    zipf = 1 / np.arange(1, 151)
+    for start in range(0, rows, 1_000_000):
+        n = min(1_000_000, rows - start)
+        ts = np.sort(now - rng.integers(0, days * 86400, n))
+        game = rng.choice(np.arange(1, 151), n, p=zipf / zipf.sum())
+        visitor = rng.integers(1, max(2, rows // 8), n)
+        db.executemany('INSERT INTO page_views (ts, game_id, visitor_id) VALUES (?, ?, ?)',
+                       zip(ts.tolist(), game.tolist(), visitor.tolist()))
+        db.commit()
+    db.execute('CREATE INDEX idx_pv_ts ON page_views(ts, visitor_id)')
+    db.execute('CREATE INDEX idx_pv_game_ts ON page_views(game_id, ts)')
+    db.commit()
+    db.close()
+
+
+def run_columnar(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import server
+    from columnar import ColumnStore
+    tmp = tempfile.mkdtemp(prefix='arcade-bench-')
+    server.DB_FILE = os.path.join(tmp, 'arcade.db')
+    t0 = time.perf_counter()
+    fill_compact(server.DB_FILE, args.rows)
+    print(f'rows:        {args.rows} over 365 days, generated in {time.perf_counter() - t0:.0f}s')
+    server.coalescer.fresh_seconds = 0   # time every call, not the reuse window
+
+    endpoints = {
+        '/summary': lambda: json.loads(server.summary().body),
+        '/games': lambda: json.loads(server.games().body),
+        '/daily?days=365': lambda: json.loads(server.daily(days=365).body),
+    }
+    server.column_store = None
+    sql_ms = {k: timed_ms(fn, args.repeat)[args.repeat // 2] for k, fn in endpoints.items()}
+    sql_out = {k: fn() for k, fn in endpoints.items()}
+
+    t0 = time.perf_counter()
+    store = ColumnStore(server.DB_FILE)
+    store.refresh(force=True)
+    load_s = time.perf_counter() - t0
+    print(f'load:        {load_s:.1f}s, arrays {store.ts.nbytes + store.game.nbytes + store.visitor.nbytes >> 20} MB')
+
+    server.column_store = store
+    col_ms = {k: timed_ms(fn, args.repeat)[args.repeat // 2] for k, fn in endpoints.items()}
+    for k, fn in endpoints.items():
+        same = fn() == sql_out[k] if k != '/summary' else \
+            {x: v for x, v in fn().items() if x != 'top_games'} == {x: v for x, v in sql_out[k].items() if x != 'top_games'}
+        print(f'{k:18s} sqlite {sql_ms[k]:8.1f} ms   numpy {col_ms[k]:7.1f} ms   '
+              f'({sql_ms[k] / max(col_ms[k], 1e-6):.0f}x, {"same result" if same else "RESULT DIFFERS"})')
+
+
+def run_archive(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import archive
+    import server
+    tmp = tempfile.mkdtemp(prefix='arcade-bench-')
+    server.DB_FILE = os.path.join(tmp, 'arcade.db')
+    archive.ARCHIVE_DIR = os.path.join(tmp, 'archive')
+    fill_compact(server.DB_FILE, args.rows)
+    server.column_store = None
+
+    async def export_rows():
+        response = server.export('page_views', fmt='ndjson', start='', end='', game='', gzip=False)
+        return sum([chunk.count(b'\n') async for chunk in response.body_iterator])
+
+    def measure(label):
+        size = os.path.getsize(server.DB_FILE)
+        ms = timed_ms(lambda: server.daily(days=365), args.repeat)[args.repeat // 2]
+        t0 = time.perf_counter()
+        n = asyncio.run(export_rows())
+        export_s = time.perf_counter() - t0
+        print(f'{label:8s} arcade.db {size / 1e6:7.1f} MB   /daily?days=365 {ms:7.1f} ms   '
+              f'export {n} rows in {export_s:.1f}s')
+        return server.daily(days=365).body, n
+
+    before = measure('hot')
+    db = sqlite3.connect(server.DB_FILE)
+    t0 = time.perf_counter()
+    moved = archive.run(db)
+    print(f'archived {moved} rows in {time.perf_counter() - t0:.1f}s')
+    segs = db.execute('SELECT COUNT(*), SUM(bytes) FROM archive_segments').fetchone()
+    print(f'segments {segs[0]} files, {segs[1] / 1e6:.1f} MB ({segs[1] / max(moved, 1):.1f} bytes/row)')
+    db.close()
+    after = measure('tiered')
+    print('same /daily and export row count' if after == before else 'RESULT DIFFERS')
+
+
+def run_coalesce(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from concurrent.futures import ThreadPoolExecutor
+    import server
+    tmp = tempfile.mkdtemp(prefix='arcade-bench-')
+    server.DB_FILE = os.path.join(tmp, 'arcade.db')
+    fill_compact(server.DB_FILE, args.rows, days=30)
+    server.column_store = None
+
+    def poll(summary, games):
+        # One dashboard refresh per client per round, all fired together
+        with ThreadPoolExecutor(args.clients) as pool:
+            t0 = time.perf_counter()
+            for _ in range(args.rounds):
+                futures = [pool.submit(fn) for _ in range(args.clients) for fn in (summary, games)]
+                for f in futures:
+                    f.result()
+            return (time.perf_counter() - t0) / args.rounds * 1000
+
+    plain_ms = poll(server._summary, server._games)
+    for fresh in (0, server.COALESCE_FRESH_SECONDS):
+        server.coalescer = server.SingleFlight(fresh)
+        ms = poll(server.summary, server.games)
+        stats = server.coalescing_stats()
+        print(f'{args.clients} clients, fresh window {fresh}s: per round {plain_ms:7.1f} ms uncoalesced, '
+              f'{ms:7.1f} ms coalesced ({plain_ms / ms:.1f}x); {stats["executed"]} of '
+              f'{stats["requests"]} requests ran a query')
+
+
+async def run_live(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import httpx
+    import uvicorn
+    import server
+    tmp = tempfile.mkdtemp(prefix='arcade-bench-')
+    server.DB_FILE = os.path.join(tmp, 'arcade.db')
+    server.LIVE_POLL_SECONDS = 0.2
+    fill_compact(server.DB_FILE, 100_000, days=30)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    config = uvicorn.Config(server.app, host='127.0.0.1', port=args.port, log_level='warning')
+    srv = uvicorn.Server(config)
+    serving = asyncio.create_task(srv.serve())
+    while not srv.started:
+        await asyncio.sleep(0.05)
+
+    received = [[] for _ in range(args.viewers)]
+
+    async def viewer(i, client):
+        async with client.stream('GET', f'http://127.0.0.1:{args.port}/live') as r:
+            async for line in r.aiter_lines():
+                if line.startswith('data: '):
+                    received[i].append((time.perf_counter(), json.loads(line[6:])))
+
+    async with httpx.AsyncClient(timeout=None, limits=httpx.Limits(max_connections=args.viewers + 5)) as client:
+        tasks = [asyncio.create_task(viewer(i, client)) for i in range(args.viewers)]
+        while sum(map(len, received)) < args.viewers:   # everyone has the snapshot
+            await asyncio.sleep(0.05)
+
+        db = sqlite3.connect(server.DB_FILE)
+        lags = []
+        for c in range(args.commits):
+            now = int(time.time())
+            db.executemany('INSERT INTO page_views (ts, game_id, visitor_id) VALUES (?, ?, ?)',
+                           [(now, 1 + j % 5, 1_000_000 + c * 100 + j) for j in range(args.views)])
+            db.commit()
+            committed = time.perf_counter()
+            while min(map(len, received)) < c + 2:
+                await asyncio.sleep(0.01)
+            lags.extend((r[c + 1][0] - committed) * 1000 for r in received)
+        db.close()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    srv.should_exit = True
+    await serving
+    ok = all(r[-1][1]['dau'] == received[0][-1][1]['dau'] for r in received)
+    lags.sort()
+    print(f'{args.viewers} viewers, {args.commits} commits of {args.views} views (producer polls every '
+          f'{server.LIVE_POLL_SECONDS}s)')
+    print(f'commit → every viewer: p50 {lags[len(lags) // 2]:.0f} ms, max {lags[-1]:.0f} ms; '
+          f'{"all viewers agree" if ok else "VIEWERS DISAGREE"}')
+    print(f'producer: {server.live_feed.stats}')
+
+
+def run_serialize(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import gzip
+    from fastapi.encoders import jsonable_encoder
+    import collect
+    import responses
+    from gendata import FEEDBACK_WORDS
+
+    db = sqlite3.connect(':memory:')
+    collect.init_db(db)
+    rng = random.Random(1)
+    now = int(time.time())
+    db.executemany('INSERT INTO ratings (ts, game, stars, category, text) VALUES (?, ?, ?, ?, ?)', [
+        (now - i * 37, f'game{rng.randrange(150)}', rng.randint(1, 5), 'feedback',
+         ' '.join(rng.choices(FEEDBACK_WORDS, k=rng.randint(3, 40)))) for i in range(500)])
+    db.execute('CREATE TABLE pv (id INTEGER PRIMARY KEY, ts INTEGER, game TEXT, visitor_id INTEGER)')
+    db.executemany('INSERT INTO pv (ts, game, visitor_id) VALUES (?, ?, ?)', [
+        (now - i * 3, f'game{rng.randrange(150)}', rng.randrange(50_000)) for i in range(5000)])
+    db.execute('CREATE TABLE daily (day INTEGER, dau INTEGER)')
+    db.executemany('INSERT INTO daily VALUES (?, ?)', [(now // 86400 - i, rng.randrange(5000)) for i in range(365)])
+
+    def fetch(sql, rows):
+        db.row_factory = sqlite3.Row if rows else None
+        return db.execute(sql).fetchall()
+
+    old_ago = lambda ts: f'{(now - ts) // 60}m ago'
+    cases = {
+        '/list?limit=500': (
+            'SELECT id, ts, game, stars, category, text FROM ratings ORDER BY ts DESC',
+            lambda rows: [{'id': r['id'], 'ts': r['ts'], 'game': r['game'], 'stars': r['stars'],
+                           'category': r['category'], 'text': r['text'], 'ago': old_ago(r['ts'])} for r in rows],
+            lambda rows: [{'id': i, 'ts': ts, 'game': g, 'stars': st, 'category': c, 'text': t, 'ago': old_ago(ts)}
+                          for i, ts, g, st, c, t in rows],
+        ),
+        '/page-views?limit=5000': (
+            'SELECT id, ts, game, visitor_id FROM pv ORDER BY ts DESC',
+            lambda rows: [dict(r) for r in rows],
+            lambda rows: [{'id': i, 'ts': ts, 'game': g, 'visitor_id': v} for i, ts, g, v in rows],
+        ),
+        '/daily?days=365': (
+            'SELECT day, dau FROM daily ORDER BY day',
+            lambda rows: [{'date': f'{r["day"]}', 'dau': r['dau'], 'new_referrals': 0} for r in rows],
+            lambda rows: [{'date': f'{d}', 'dau': n, 'new_referrals': 0} for d, n in rows],
+        ),
+    }
+    encoder = 'orjson' if responses.orjson else 'json (orjson not installed)'
+    print(f'new path encoder: {encoder}')
+    for name, (sql, old_build, new_build) in cases.items():
+        old = lambda: json.dumps(jsonable_encoder(old_build(fetch(sql, True))), ensure_ascii=False,
+                                 allow_nan=False, indent=None, separators=(',', ':')).encode()
+        new = lambda: responses.dumps(new_build(fetch(sql, False)))
+        assert json.loads(old()) == json.loads(new())
+        old_ms = timed_ms(old, args.repeat)[args.repeat // 2]
+        new_ms = timed_ms(new, args.repeat)[args.repeat // 2]
+        body = new()
+        line = (f'{name:24s} {len(body) / 1024:7.1f} KB   old {old_ms:6.2f} ms   new {new_ms:6.2f} ms '
+                f'({old_ms / new_ms:.1f}x)   gzip-{responses.GZIP_LEVEL} '
+                f'{len(gzip.compress(body, responses.GZIP_LEVEL)) / 1024:6.1f} KB '
+                f'{timed_ms(lambda: gzip.compress(body, responses.GZIP_LEVEL), args.repeat)[args.repeat // 2]:5.2f} ms')
+        if responses.brotli:
+            br = lambda: responses.brotli.compress(body, quality=responses.BROTLI_QUALITY)
+            line += f'   br-{responses.BROTLI_QUALITY} {len(br()) / 1024:6.1f} KB {timed_ms(br, args.repeat)[args.repeat // 2]:5.2f} ms'
+        print(line)
+
+
+def flaky(app, fail: float, rng):
+    """ASGI wrapper: refuses a share of /ingest/logs calls, and stores another share but loses the reply."""
+    async def reply_503(send):
+        await send({'type': 'http.response.start', 'status': 503, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def wrapped(scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != '/ingest/logs':
+            await app(scope, receive, send)
+            return
+        r = rng.random()
+        if r < fail:
+            await reply_503(send)
+        elif r < 2 * fail:
+            async def drop(message):
+                pass
+            await app(scope, receive, drop)
+            await reply_503(send)
+        else:
+            await app(scope, receive, send)
+    return wrapped
+
+
+def run_ship(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import socket
+    import threading
+    import uvicorn
+    import collect
+    import gendata
+    import server
+    import shipper
+    from games import GameRegistry
+
+    tmp = tempfile.mkdtemp(prefix='arcade-bench-')
+    server.DB_FILE = os.path.join(tmp, 'arcade.db')
+    server.SHIP_TOKEN = 'bench'
+    shipper.RETRY_BASE_SECONDS = 0.01
+    db = sqlite3.connect(server.DB_FILE)
+    collect.init_db(db)
+    db.close()
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    srv = uvicorn.Server(uvicorn.Config(flaky(server.app, args.fail, random.Random(7)),
+                                        host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=srv.run, daemon=True).start()
+    while not srv.started:
+        time.sleep(0.05)
+    url = f'http://127.0.0.1:{port}/ingest/logs'
+
+    lines, now = gendata.parse_count(args.lines), int(time.time())
+    registry = GameRegistry()
+    logs, expected = {}, 0
+    for i, node in enumerate(('edge-1', 'edge-2')):
+        logs[node] = ''.join(gendata.log_lines(lines, hours=1, seed=11 + i, now=now))
+        for line in logs[node].splitlines():
+            hit = collect.parse_line(line)
+            expected += hit is not None and registry.match(hit[2]) is not None
+
+    shippers = {}
+
+    def node(name: str, rotate: bool):
+        # The log grows in 8 pieces cut mid-line, a pass after each; the
+        # rotating node renames its log after piece 4 before shipping it
+        text = logs[name]
+        log = os.path.join(tmp, f'{name}.log')
+        s = shippers[name] = shipper.Shipper(name, log, os.path.join(tmp, f'{name}.state'), url, 'bench')
+        cuts = [len(text) * k // 8 for k in range(9)]
+        if rotate:
+            cuts[4] = text.index('\n', cuts[4]) + 1
+        for k in range(8):
+            with open(log, 'a') as f:
+                f.write(text[cuts[k]:cuts[k + 1]])
+            if rotate and k == 3:
+                os.replace(log, log + '.1')
+                continue
+            s.ship_once()
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=node, args=(n, n == 'edge-2')) for n in logs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    secs = time.perf_counter() - t0
+
+    # edge-1 loses its state file and starts over from offset 0
+    os.remove(os.path.join(tmp, 'edge-1.state'))
+    again = shipper.Shipper('edge-1', os.path.join(tmp, 'edge-1.log'), os.path.join(tmp, 'edge-1.state'), url, 'bench')
+    again.ship_once()
+
+    db = sqlite3.connect(server.DB_FILE)
+    batches, payload = db.execute('SELECT COUNT(*), SUM(LENGTH(payload)) FROM log_batches').fetchone()
+    collect.LOG_FILE = os.path.join(tmp, 'missing.log')   # the analytics box itself serves nothing here
+    collect.STATE_FILE = os.path.join(tmp, 'collect.state')
+    collect.parse_logs(db)
+    counted = (db.execute('SELECT COUNT(*) FROM page_views').fetchone()[0]
+               + db.execute('SELECT COALESCE(SUM(views), 0) FROM filtered_views').fetchone()[0])
+    db.close()
+    srv.should_exit = True
+
+    raw = sum(len(t.encode()) for t in logs.values())
+    print(f'2 nodes x {lines:,} log lines ({raw / 1e6:.1f} MB), {args.fail:.0%} of POSTs refused '
+          f'and {args.fail:.0%} stored with the reply lost')
+    for name, s in shippers.items():
+        print(f'{name}: {s.stats}')
+    print(f'edge-1 again from offset 0: {again.stats}')
+    print(f'shipped in {secs:.1f}s ({2 * lines / secs:,.0f} lines/s); {batches} batches stored, '
+          f'{payload / 1e6:.2f} MB gzip ({raw / payload:.0f}x smaller than the logs)')
+    print(f'game hits in the logs: {expected:,}; counted by the collector: {counted:,} '
+          f'({"exact" if counted == expected else "MISMATCH"})')
+
+
+SUITE_ENDPOINTS = (
+    '/summary', '/games', '/daily?days=30', '/daily?days=365', '/retention?days=30',
+    '/timeseries?hours=24', '/timeseries?hours=720', '/trending', '/ratings',
+    '/list?limit=100', '/page-views?limit=500', '/referrals?limit=500', '/search?q=lag',
+)
+
+
+def run_backup(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import shutil
+    import threading
+    import snapshot
+    tmp = tempfile.mkdtemp(prefix='arcade-bench-')
+    path = os.path.join(tmp, 'arcade.db')
+    fill_compact(path, args.rows)
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.close()
+    print(f'arcade.db   {os.path.getsize(path) / 1e6:.0f} MB, {args.rows} page views')
+
+    # A writer committing one page view every few ms, as ratings and the collector do
+    latencies, stop = [], threading.Event()
+
+    def writer():
+        w = sqlite3.connect(path, timeout=30)
+        while not stop.is_set():
+            t = time.perf_counter()
+            w.execute('INSERT INTO page_views (ts, game_id, visitor_id) VALUES (?, 1, 1)', (int(time.time()),))
+            w.commit()
+            latencies.append((time.perf_counter() - t) * 1000)
+            time.sleep(args.interval / 1000)
+        w.close()
+
+    def rows(p):
+        c = sqlite3.connect(p)
+        try:
+            return c.execute('PRAGMA quick_check').fetchone()[0], c.execute('SELECT MAX(id) FROM page_views').fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            return str(e).splitlines()[-1], None
+        finally:
+            c.close()
+
+    def copy_file(out):
+        shutil.copyfile(path, out)
+
+    def backup_once(out):
+        src, dst = sqlite3.connect(path), sqlite3.connect(out)
+        src.backup(dst)
+        src.close()
+        dst.close()
+
+    methods = {
+        'idle': None,
+        'cp': copy_file,
+        'backup(-1)': backup_once,
+        'snapshot.py': lambda out: snapshot.take(path, os.path.join(tmp, 'snapshots')),
+    }
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    time.sleep(1)
+    for label, fn in methods.items():
+        out = os.path.join(tmp, f'copy-{len(latencies)}.db')
+        c = sqlite3.connect(path)
+        before = c.execute('SELECT MAX(id) FROM page_views').fetchone()[0]
+        c.close()
+        del latencies[:]
+        t0 = time.perf_counter()
+        if fn is None:
+            time.sleep(args.idle)
+        else:
+            fn(out)
+        took = time.perf_counter() - t0
+        lat = sorted(latencies)
+        line = (f'{label:12s} {took:6.2f}s  writer commits {len(lat):5d}  p50 {lat[len(lat) // 2]:6.2f} ms  '
+                f'p99 {lat[int(len(lat) * 0.99)]:7.2f} ms  max {lat[-1]:7.2f} ms')
+        if label == 'snapshot.py':
+            out = snapshot.replica_path(os.path.join(tmp, 'snapshots'))
+        if fn is not None:
+            check, n = rows(out)
+            line += f'  copy {check}' + (f', {n - before:+d} commits vs start' if n is not None else '')
+        print(line)
+    stop.set()
+    thread.join()
+    shutil.rmtree(tmp)
+
+
+def git_commit() -> str:
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here,
+                               capture_output=True, text=True).stdout.strip()
+        return sha + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_suite(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import platform
+    import shutil
+    from fastapi.testclient import TestClient
+    import collect
+    import gendata
+    import server
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    rows = gendata.parse_count(args.rows)
+    db_file = args.db
+    if not db_file:
+        os.makedirs(args.cache_dir, exist_ok=True)
+        db_file = os.path.join(args.cache_dir, f'arcade-{args.rows.upper()}.db')
+        if not os.path.exists(db_file):
+            print(f'generating {db_file} (cached for later runs)')
+            gendata.generate_db(db_file, rows)
+    tmp = tempfile.mkdtemp(prefix='arcade-bench-')
+    result = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'rows': sqlite3.connect(db_file).execute('SELECT COUNT(*) FROM page_views').fetchone()[0],
+        'db_mb': round(os.path.getsize(db_file) / 1e6, 1),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+    }
+
+    # Ingest: the collector's cron run over a fresh log, into a copy of the db
+    lines = gendata.parse_count(args.log_lines)
+    log = os.path.join(tmp, 'access.log')
+    gendata.write_log(log, lines, hours=1)
+    copy = os.path.join(tmp, 'arcade.db')
+    shutil.copyfile(db_file, copy)
+    collect.LOG_FILE, collect.STATE_FILE = log, os.path.join(tmp, 'collect.state')
+    db = sqlite3.connect(copy)
+    before = db.execute('SELECT MAX(id) FROM page_views').fetchone()[0]
+    t0 = time.perf_counter()
+    collect.parse_logs(db)
+    secs = time.perf_counter() - t0
+    added = db.execute('SELECT COUNT(*) FROM page_views WHERE id > ?', (before,)).fetchone()[0]
+    db.close()
+    os.remove(copy)
+    result['ingest'] = {'lines': lines, 'page_views': added, 'seconds': round(secs, 2),
+                        'lines_per_s': round(lines / secs)}
+    print(f'ingest: {lines:,} lines ({added:,} page views) in {secs:.1f}s, {lines / secs:,.0f} lines/s')
+
+    # Endpoints: every request really runs (no single-flight reuse window)
+    server.DB_FILE = db_file
+    server.coalescer = server.SingleFlight(0)
+    client = TestClient(server.app)
+    result['endpoints'] = {}
+    for path in SUITE_ENDPOINTS:
+        client.get(path)   # warm the page cache
+        times = []
+        start = time.perf_counter()
+        while len(times) < args.repeat and (len(times) < 5 or time.perf_counter() - start < args.seconds):
+            t = time.perf_counter()
+            r = client.get(path)
+            times.append((time.perf_counter() - t) * 1000)
+            assert r.status_code == 200, (path, r.status_code)
+        times.sort()
+        stats = {'n': len(times), 'p50_ms': round(times[len(times) // 2], 2),
+                 'p99_ms': round(times[min(len(times) - 1, int(len(times) * 0.99))], 2),
+                 'mean_ms': round(statistics.fmean(times), 2)}
+        result['endpoints'][path] = stats
+        print(f'{path:24s} p50 {stats["p50_ms"]:9.2f} ms   p99 {stats["p99_ms"]:9.2f} ms   (n={len(times)})')
+
+    out = args.out or os.path.join('bench-results', f'{result["commit"]}-{args.rows.upper()}.json')
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'results: {out}')
+
+
+def run_compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f'{old["commit"]} ({old["rows"]:,} rows) → {new["commit"]} ({new["rows"]:,} rows)')
+    a, b = old['ingest']['lines_per_s'], new['ingest']['lines_per_s']
+    print(f'{"ingest lines/s":24s} {a:>10,} → {b:>10,}   {b / a:5.2f}x')
+    for path in sorted(set(old['endpoints']) | set(new['endpoints'])):
+        o, n = old['endpoints'].get(path), new['endpoints'].get(path)
+        if not o or not n:
+            print(f'{path:24s} only in {"new" if n else "old"}')
+            continue
+        print(f'{path:24s} p50 {o["p50_ms"]:8.2f} → {n["p50_ms"]:8.2f} ms ({o["p50_ms"] / n["p50_ms"]:5.2f}x)   '
+              f'p99 {o["p99_ms"]:8.2f} → {n["p99_ms"]:8.2f} ms ({o["p99_ms"] / n["p99_ms"]:5.2f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p = sub.add_parser('ingest', help='recorder segment upload throughput')
+    p.add_argument('--concurrency', type=int, default=16)
+    p.add_argument('--segments', type=int, default=64)
+    p.add_argument('--url', default='', help='benchmark a running ingest server instead')
+    p.add_argument('--nginx', action='store_true', help='use the /api/ingest/ proxy path')
+
+    p = sub.add_parser('search', help='full-text feedback search latency')
+    p.add_argument('--rows', type=int, default=1_000_000)
+    p.add_argument('--repeat', type=int, default=20)
+
+    p = sub.add_parser('schema', help='legacy vs compact page_views size and scans')
+    p.add_argument('--rows', type=int, default=1_000_000)
+    p.add_argument('--repeat', type=int, default=5)
+
+    p = sub.add_parser('columnar', help='SQLite vs NumPy column store endpoint latency')
+    p.add_argument('--rows', type=int, default=10_000_000)
+    p.add_argument('--repeat', type=int, default=5)
+
+    p = sub.add_parser('archive', help='monthly segment archival size and federated reads')
+    p.add_argument('--rows', type=int, default=5_000_000)
+    p.add_argument('--repeat', type=int, default=5)
+
+    p = sub.add_parser('coalesce', help='concurrent identical /summary and /games requests')
+    p.add_argument('--rows', type=int, default=2_000_000)
+    p.add_argument('--clients', type=int, default=16)
+    p.add_argument('--rounds', type=int, default=5)
+
+    p = sub.add_parser('live', help='/live server-sent event fan-out')
+    p.add_argument('--viewers', type=int, default=50)
+    p.add_argument('--commits', type=int, default=10)
+    p.add_argument('--views', type=int, default=200, help='page views per commit')
+    p.add_argument('--port', type=int, default=8193)
+
+    p = sub.add_parser('serialize', help='JSON encoding and compression of large payloads')
+    p.add_argument('--repeat', type=int, default=50)
+
+    p = sub.add_parser('ship', help='log shipping from two simulated nodes')
+    p.add_argument('--lines', default='100k', help='log lines per node')
+    p.add_argument('--fail', type=float, default=0.2)
+
+    p = sub.add_parser('backup', help='writer latency and copy integrity during an online backup')
+    p.add_argument('--rows', type=int, default=2_000_000)
+    p.add_argument('--interval', type=float, default=2, help='ms between writer commits')
+    p.add_argument('--idle', type=float, default=3, help='seconds of baseline without a copy')
+
+    p = sub.add_parser('suite', help='ingest and endpoint regression suite, JSON results')
+    p.add_argument('--rows', default='1M', help='scale: 1M, 10M, 100M page views')
+    p.add_argument('--db', default='', help='use this arcade.db instead of a generated one')
+    p.add_argument('--cache-dir', default=os.path.join(tempfile.gettempdir(), 'arcade-bench-data'))
+    p.add_argument('--log-lines', default='200k')
+    p.add_argument('--repeat', type=int, default=50)
+    p.add_argument('--seconds', type=float, default=20, help='time budget per endpoint (min 5 runs)')
+    p.add_argument('--out', default='', help='default bench-results/<commit>-<rows>.json')
+
+    p = sub.add_parser('compare', help='compare two suite result files')
+    p.add_argument('old')
+    p.add_argument('new')
+
+    args = parser.parse_args()
+    if args.cmd == 'ingest':
+        asyncio.run(run_ingest(args))
+    elif args.cmd == 'search':
+        run_search(args)
+    elif args.cmd == 'schema':
+        run_schema(args)
+    elif args.cmd == 'columnar':
+        run_columnar(args)
+    elif args.cmd == 'archive':
+        run_archive(args)
+    elif args.cmd == 'coalesce':
+        run_coalesce(args)
+    elif args.cmd == 'live':
+        asyncio.run(run_live(args))
+    elif args.cmd == 'serialize':
+        run_serialize(args)
+    elif args.cmd == 'ship':
+        run_ship(args)
+    elif args.cmd == 'backup':
+        run_backup(args)
+    elif args.cmd == 'suite':
+        run_suite(args)
+    elif args.cmd == 'compare':
+        run_compare(args)
+
+
+if __name__ == '__main__':
+    main()
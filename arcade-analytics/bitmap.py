@@ -0,0 +1,129 @@
+"""
+Compressed integer sets for visitor ids (roaring-style).
+
+Values are split into 65536-wide chunks keyed by the high 16 bits. In memory
+each chunk is a Python int used as a bitset, so &, |, - and popcount run in C.
+On disk a chunk is stored the roaring way: a sorted uint16 array while it
+holds at most 4096 values, a fixed 8 KB bitmap once that is smaller.
+
+Serialized layout (little endian):
+  u32 chunk count, then per chunk: u16 key, u8 kind (0 array, 1 bitmap),
+  u32 payload length, payload.
+"""
+
+import struct
+from array import array
+
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+ARRAY_MAX = 4096                  # beyond this a bitmap chunk is smaller
+BITMAP_BYTES = (1 << CHUNK_BITS) // 8
+
+
+class Bitmap:
+    __slots__ = ('chunks',)
+
+    def __init__(self, values=()):
+        self.chunks: dict[int, int] = {}
+        self.update(values)
+
+    def add(self, v: int):
+        key = v >> CHUNK_BITS
+        self.chunks[key] = self.chunks.get(key, 0) | (1 << (v & CHUNK_MASK))
+
+    def update(self, values):
+        for v in values:
+            self.add(v)
+
+    def __contains__(self, v: int) -> bool:
+        return bool(self.chunks.get(v >> CHUNK_BITS, 0) >> (v & CHUNK_MASK) & 1)
+
+    def __len__(self) -> int:
+        return sum(c.bit_count() for c in self.chunks.values())
+
+    def __bool__(self) -> bool:
+        return bool(self.chunks)
+
+    def __iter__(self):
+        for key in sorted(self.chunks):
+            c, base = self.chunks[key], key << CHUNK_BITS
+            while c:
+                low = c & -c
+                yield base + low.bit_length() - 1
+                c ^= low
+
+    def __and__(self, other: 'Bitmap') -> 'Bitmap':
+        out = Bitmap()
+        small, big = sorted((self.chunks, other.chunks), key=len)
+        for key, c in small.items():
+            both = c & big.get(key, 0)
+            if both:
+                out.chunks[key] = both
+        return out
+
+    def __or__(self, other: 'Bitmap') -> 'Bitmap':
+        out = Bitmap()
+        out.chunks = dict(self.chunks)
+        out |= other
+        return out
+
+    def __ior__(self, other: 'Bitmap') -> 'Bitmap':
+        for key, c in other.chunks.items():
+            self.chunks[key] = self.chunks.get(key, 0) | c
+        return self
+
+    def __sub__(self, other: 'Bitmap') -> 'Bitmap':
+        out = Bitmap()
+        for key, c in self.chunks.items():
+            rest = c & ~other.chunks.get(key, 0)
+            if rest:
+                out.chunks[key] = rest
+        return out
+
+    def and_len(self, other: 'Bitmap') -> int:
+        """len(self & other) without building the intersection."""
+        small, big = sorted((self.chunks, other.chunks), key=len)
+        return sum((c & big.get(key, 0)).bit_count() for key, c in small.items())
+
+    def to_bytes(self) -> bytes:
+        parts = [struct.pack('<I', len(self.chunks))]
+        for key in sorted(self.chunks):
+            c = self.chunks[key]
+            if c.bit_count() <= ARRAY_MAX:
+                low = array('H')
+                while c:
+                    bit = c & -c
+                    low.append(bit.bit_length() - 1)
+                    c ^= bit
+                if array('H', [1]).tobytes() != b'\x01\x00':
+                    low.byteswap()
+                payload, kind = low.tobytes(), 0
+            else:
+                payload, kind = c.to_bytes(BITMAP_BYTES, 'little'), 1
+            parts.append(struct.pack('<HBI', key, kind, len(payload)))
+            parts.append(payload)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Bitmap':
+        out = cls()
+        if not data:
+            return out
+        (n,), pos = struct.unpack_from('<I', data), 4
+        for _ in range(n):
+            key, kind, size = struct.unpack_from('<HBI', data, pos)
+            pos += 7
+            payload = data[pos:pos + size]
+            pos += size
+            if kind == 1:
+                out.chunks[key] = int.from_bytes(payload, 'little')
+            else:
+                low = array('H')
+                low.frombytes(payload)
+                if array('H', [1]).tobytes() != b'\x01\x00':
+                    low.byteswap()
+                c = 0
+                for v in low:
+                    c |= 1 << v
+                out.chunks[key] = c
+        return out
@@ -0,0 +1,109 @@
+"""
+Crawler and bot filter for the collector.
+
+Game page hits are judged before they reach page_views, the visitor bitmaps
+or any counter:
+
+- ua:      empty user agent, a non-browser client (no 'Mozilla/' prefix:
+           curl, python-requests, Go-http-client, ...) or a browser-shaped
+           UA carrying a BOT_SIGNATURES token (Googlebot, HeadlessChrome,
+           facebookexternalhit, ...). Verdicts are cached per UA string.
+- rate:    an IP fetching more than RATE_MAX_VIEWS game pages within one
+           RATE_WINDOW; no person opens a new game every two seconds.
+- flagged: later hits from an IP the rate check caught, for FLAG_SECONDS.
+           Flags are kept in bot_ips, so the next cron run drops them at once.
+
+Filtered hits are counted per (day, reason) in filtered_views. Mode
+(ARCADE_BOT_FILTER): 'drop' (default), 'tag' (the hits go to bot_views
+instead of page_views, for auditing) or 'off'. Log lines without a UA field
+(the plain log format) are never judged on UA.
+"""
+
+import os
+import re
+from collections import Counter
+
+MODE = os.environ.get('ARCADE_BOT_FILTER', 'drop')
+
+RATE_WINDOW = 60          # seconds
+RATE_MAX_VIEWS = 30       # game page views per IP per window before it is flagged
+FLAG_SECONDS = 86400
+UA_CACHE_SIZE = 20000     # distinct UA strings remembered; cleared when full
+RATE_TRACKED_IPS = 200000 # per-window IP counters kept before stale windows are dropped
+
+BOT_SIGNATURES = (
+    'bot', 'crawl', 'spider', 'slurp', 'scrape', 'archiver', 'headless', 'phantomjs',
+    'lighthouse', 'pagespeed', 'pingdom', 'uptime', 'facebookexternalhit', 'embedly',
+    'whatsapp', 'telegram', 'discord', 'skypeuripreview', 'bytespider', 'ahrefs',
+    'semrush', 'mj12', 'yandex', 'baidu', 'petalbot', 'gptbot', 'ccbot', 'validator',
+)
+BOT_UA_RE = re.compile('|'.join(map(re.escape, BOT_SIGNATURES)), re.IGNORECASE)
+REASONS = ('ua', 'rate', 'flagged')
+
+
+def ua_is_bot(ua: str) -> bool:
+    return not ua.startswith('Mozilla/') or BOT_UA_RE.search(ua) is not None
+
+
+class BotFilter:
+
+    def __init__(self, db, now: int = 0):
+        self.db = db
+        self.ua_cache: dict[str, bool] = {}
+        self.windows: dict[str, list] = {}     # ip_hash → [window number, views in it]
+        self.flagged: dict[str, int] = dict(   # ip_hash → flagged until
+            db.execute('SELECT ip_hash, until_ts FROM bot_ips WHERE until_ts > ?', (now,)).fetchall()
+        )
+        self.new_flags: dict[str, int] = {}
+        self.counts = Counter()                # (day, reason) → hits since the last flush
+        self.totals = Counter()                # reason → hits this run
+
+    def check(self, ts: int, ip_hash: str, ua) -> str:
+        """'' for a person, else the reason the hit is a bot's. `ua` None: not logged."""
+        if ua is not None:
+            bot = self.ua_cache.get(ua)
+            if bot is None:
+                bot = ua_is_bot(ua)
+                if len(self.ua_cache) >= UA_CACHE_SIZE:
+                    self.ua_cache.clear()
+                self.ua_cache[ua] = bot
+            if bot:
+                return self._count(ts, 'ua')
+
+        if self.flagged.get(ip_hash, 0) > ts:
+            return self._count(ts, 'flagged')
+        window = ts // RATE_WINDOW
+        w = self.windows.get(ip_hash)
+        if w is None or w[0] != window:
+            if len(self.windows) >= RATE_TRACKED_IPS:
+                self.windows = {ip: v for ip, v in self.windows.items() if v[0] >= window - 1}
+            w = self.windows[ip_hash] = [window, 0]
+        w[1] += 1
+        if w[1] > RATE_MAX_VIEWS:
+            self.flagged[ip_hash] = self.new_flags[ip_hash] = ts + FLAG_SECONDS
+            return self._count(ts, 'rate')
+        return ''
+
+    def _count(self, ts: int, reason: str) -> str:
+        self.counts[(ts // 86400, reason)] += 1
+        self.totals[reason] += 1
+        return reason
+
+    def flush(self, now: int):
+        """Persist new IP flags and the run's filtered counts (caller commits)."""
+        self.db.executemany(
+            '''INSERT INTO bot_ips (ip_hash, until_ts) VALUES (?, ?)
+               ON CONFLICT (ip_hash) DO UPDATE SET until_ts = MAX(until_ts, excluded.until_ts)''',
+            self.new_flags.items()
+        )
+        self.db.execute('DELETE FROM bot_ips WHERE until_ts <= ?', (now,))
+        self.db.executemany(
+            '''INSERT INTO filtered_views (day, reason, views) VALUES (?, ?, ?)
+               ON CONFLICT (day, reason) DO UPDATE SET views = views + excluded.views''',
+            [(day, reason, n) for (day, reason), n in self.counts.items()]
+        )
+        self.new_flags = {}
+        self.counts.clear()
+
+    def summary(self) -> str:
+        return ', '.join(f'{r} {self.totals[r]}' for r in REASONS if self.totals[r]) or 'none'
@@ -6,20 +6,52 @@ Run via cron every 15 minutes on the Jetson.
 
 Cron entry:
   */15 * * * * /usr/bin/python3 /ssd/openarcade/arcade-analytics/collect.py >> /tmp/arcade-collect.log 2>&1
+
+Other web nodes ship their access logs with shipper.py; the batches the API
+stores (POST /ingest/logs) are merged with the local log by timestamp.
+
+Databases from before the compact page_views schema are migrated online, a
+minute per cron run; `collect.py --migrate` finishes it in one go and VACUUMs.
 """
 
 import re
 import os
+import gzip
+import heapq
+import math
+import sys
 import json
 import sqlite3
 import hashlib
 import time
+from collections import Counter, OrderedDict
+from operator import itemgetter
 from datetime import datetime, timezone
 
+import bots
+from bitmap import Bitmap
+from games import GameRegistry
+from sketch import SpaceSaving
+
 LOG_FILE = '/var/log/nginx/access.log'
 STATE_FILE = os.path.join(os.path.dirname(__file__), 'collect.state')
 DB_FILE = os.path.join(os.path.dirname(__file__), 'arcade.db')
 
+MINUTE_COUNTS_DAYS = 35   # per-minute counters kept this long; hourly ones forever
+MIGRATE_BATCH = 50000     # legacy page_views rows per migration transaction
+
+# Trending: decayed view counts per game at these half-lives (seconds). The
+# longest is each game's baseline; the others are scored against it.
+TREND_HALF_LIVES = (('1h', 3600), ('6h', 6 * 3600), ('24h', 86400), ('7d', 7 * 86400))
+TREND_MIN_VARIANCE = 1.0  # z-score denominator floor, keeps a few views on a quiet game from topping the list
+
+SESSION_GAP = 30 * 60     # inactivity that ends a visit
+OPEN_SESSIONS_MAX = 50000 # open visits held in memory; the least recently active are closed early
+SESSION_BACKFILL_DAYS = 28
+
+TOPK_CAPACITY = 256       # counters per Space-Saving sketch; exact up to that many distinct keys
+TOPK_HOUR_DAYS = 35       # hourly top-k sketches kept this long; daily ones forever
+
 # Match game page hits (e.g. GET /snake/ or GET /tetris/index.html)
 # Exclude assets: .js .css .webp .mp4 etc.
 GAME_RE = re.compile(
@@ -27,33 +59,43 @@ GAME_RE = re.compile(
 )
 
 # Log format: ip - - [timestamp] "METHOD /path HTTP/x.x" status size "ref" "ua"
+# (ref and ua are absent from the plain format; ua is then None)
 FULL_RE = re.compile(
-    r'^(\S+) - \S+ \[([^\]]+)\] "(\w+) ([^\s"]+) HTTP/[^"]*" (\d+)'
+    r'^(\S+) - \S+ \[([^\]]+)\] "(\w+) ([^\s"]+) HTTP/[^"]*" (\d+)(?: \S+ "[^"]*" "([^"]*)")?'
 )
 
-# Games known to exist (subdirectories that are games, not infrastructure)
-GAME_DIRS = {
-    'tetris', 'snake', 'breakout', 'flappy', 'space-invaders', 'pong', 'asteroids',
-    'pac-man', 'galaga', 'bubble-bobble', 'frogger', 'donkey-kong', 'centipede',
-    'tempest', '1942', 'asteroids', 'battleship-evolved', 'bejeweled', 'battlezone',
-    'bomberman', 'boulder-dash', 'canabalt', 'capture-the-flag', '2048', 'agar',
-    'air-hockey', 'arkanoid', 'base-builder-blitz', 'battle-royale-2d', 'blokus',
-    'boxing-ring', 'brick-breaker', 'browser-mmo-rpg', 'burger-time', 'centipede',
-    'bike-trials-mp', 'advance-wars-online', 'auction-house', 'amidar',
-}
-
 
-def init_db(db):
+def init_schema(db) -> bool:
+    """
+    Create missing tables, indexes and triggers. Every step is idempotent, so
+    the API and archive.py run this alongside the collector; migrations and
+    backfills are init_db's alone. Returns False, touching nothing, while
+    page_views still has the legacy layout (init_db sets it aside first).
+    """
+    if 'ip_hash' in {r[1] for r in db.execute('PRAGMA table_info(page_views)')}:
+        return False
+    # New databases start in incremental mode; archive.py converts older ones
+    db.execute('PRAGMA auto_vacuum = INCREMENTAL')
     db.executescript("""
+        -- Compact page views: game and visitor as integer keys, day = ts / 86400
         CREATE TABLE IF NOT EXISTS page_views (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER PRIMARY KEY,
             ts INTEGER NOT NULL,
-            game TEXT NOT NULL,
-            ip_hash TEXT NOT NULL,
-            date TEXT NOT NULL
+            game_id INTEGER NOT NULL,
+            visitor_id INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_pv_ts ON page_views(ts, visitor_id);
+        CREATE INDEX IF NOT EXISTS idx_pv_game_ts ON page_views(game_id, ts);
+
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
         );
-        CREATE INDEX IF NOT EXISTS idx_pv_date ON page_views(date);
-        CREATE INDEX IF NOT EXISTS idx_pv_game ON page_views(game);
+
+        -- page_views with the game name, for listings and exports
+        CREATE VIEW IF NOT EXISTS page_views_named AS
+            SELECT p.id, p.ts, g.name AS game, p.visitor_id
+            FROM page_views p JOIN games g ON g.id = p.game_id;
 
         CREATE TABLE IF NOT EXISTS ratings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -61,9 +103,24 @@ def init_db(db):
             game TEXT NOT NULL,
             stars INTEGER,
             category TEXT,
-            text TEXT
+            text TEXT,
+            rating_key TEXT  -- visitor + widget showing: later posts for it update the row
+        );
+        DROP INDEX IF EXISTS idx_rat_game;
+        CREATE INDEX IF NOT EXISTS idx_rat_ts ON ratings(ts);
+        CREATE INDEX IF NOT EXISTS idx_rat_game_ts ON ratings(game, ts);
+
+        -- Running per-game rating totals, updated with every ratings batch
+        CREATE TABLE IF NOT EXISTS rating_aggregates (
+            game TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            sum INTEGER NOT NULL DEFAULT 0,
+            s1 INTEGER NOT NULL DEFAULT 0,
+            s2 INTEGER NOT NULL DEFAULT 0,
+            s3 INTEGER NOT NULL DEFAULT 0,
+            s4 INTEGER NOT NULL DEFAULT 0,
+            s5 INTEGER NOT NULL DEFAULT 0
         );
-        CREATE INDEX IF NOT EXISTS idx_rat_game ON ratings(game);
 
         CREATE TABLE IF NOT EXISTS referrals (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -71,10 +128,613 @@ def init_db(db):
             room_code TEXT,
             date TEXT
         );
+        CREATE INDEX IF NOT EXISTS idx_ref_ts ON referrals(ts);
+
+        -- Dense integer ids for ip_hash, assigned in order of first sighting
+        CREATE TABLE IF NOT EXISTS visitors (
+            id INTEGER PRIMARY KEY,
+            ip_hash TEXT NOT NULL UNIQUE,
+            first_ts INTEGER NOT NULL
+        );
+
+        -- Visitor-id bitmap per UTC day number (ts // 86400); game '' = all games
+        CREATE TABLE IF NOT EXISTS visitor_bitmaps (
+            day INTEGER NOT NULL,
+            game TEXT NOT NULL,
+            bitmap BLOB NOT NULL,
+            PRIMARY KEY (day, game)
+        );
+
+        -- Page views per minute / hour bucket (ts // 60, ts // 3600); game '' = all games
+        CREATE TABLE IF NOT EXISTS views_minute (
+            bucket INTEGER NOT NULL,
+            game TEXT NOT NULL,
+            views INTEGER NOT NULL,
+            PRIMARY KEY (game, bucket)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS views_hour (
+            bucket INTEGER NOT NULL,
+            game TEXT NOT NULL,
+            views INTEGER NOT NULL,
+            PRIMARY KEY (game, bucket)
+        ) WITHOUT ROWID;
+
+        -- Exponentially decayed view counts per game as of ts (TrendRates)
+        CREATE TABLE IF NOT EXISTS trend_rates (
+            game TEXT PRIMARY KEY,
+            ts INTEGER NOT NULL,
+            first_ts INTEGER NOT NULL,  -- start of the game's history (or of the backfill)
+            c_1h REAL NOT NULL,
+            c_6h REAL NOT NULL,
+            c_24h REAL NOT NULL,
+            c_7d REAL NOT NULL
+        );
+        -- Trending scores, rewritten by every collector run; rates in views/hour
+        CREATE TABLE IF NOT EXISTS trending (
+            game TEXT PRIMARY KEY,
+            z_1h REAL NOT NULL,
+            z_6h REAL NOT NULL,
+            z_24h REAL NOT NULL,
+            rate_1h REAL NOT NULL,
+            rate_6h REAL NOT NULL,
+            rate_24h REAL NOT NULL,
+            rate_7d REAL NOT NULL,
+            updated_at INTEGER NOT NULL
+        );
+
+        -- Space-Saving top-k sketches (sketch.py) per dimension ('game') and
+        -- res 'h' (bucket = ts // 3600) or 'd' (bucket = ts // 86400)
+        CREATE TABLE IF NOT EXISTS topk (
+            dim TEXT NOT NULL,
+            res TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            sketch BLOB NOT NULL,
+            PRIMARY KEY (dim, res, bucket)
+        );
+
+        -- Visits: one visitor's page views with no gap over SESSION_GAP (Sessionizer)
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY,
+            visitor_id INTEGER NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            views INTEGER NOT NULL,
+            games INTEGER NOT NULL,          -- distinct games played
+            entry_game_id INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_start ON sessions(start_ts);
+        -- Visits still open when the collector last ran; games = comma-separated ids
+        CREATE TABLE IF NOT EXISTS open_sessions (
+            visitor_id INTEGER PRIMARY KEY,
+            start_ts INTEGER NOT NULL,
+            last_ts INTEGER NOT NULL,
+            views INTEGER NOT NULL,
+            entry_game_id INTEGER NOT NULL,
+            games TEXT NOT NULL
+        );
+
+        -- Access log batches POSTed by shipper.py on other web nodes, keyed by
+        -- (node, byte offset in the node's log); payload (gzip JSON rows) is
+        -- dropped once counted, the key stays for idempotency
+        CREATE TABLE IF NOT EXISTS log_batches (
+            node TEXT NOT NULL,
+            start_offset INTEGER NOT NULL,
+            end_offset INTEGER NOT NULL,
+            rows INTEGER NOT NULL,
+            received_at INTEGER NOT NULL,
+            processed_at INTEGER,
+            payload BLOB,
+            PRIMARY KEY (node, start_offset)
+        );
+
+        -- Game page hits the bot filter kept out of page_views (bots.py)
+        CREATE TABLE IF NOT EXISTS filtered_views (
+            day INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            views INTEGER NOT NULL,
+            PRIMARY KEY (day, reason)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS bot_ips (
+            ip_hash TEXT PRIMARY KEY,
+            until_ts INTEGER NOT NULL
+        );
+        -- Filtered hits themselves, only with ARCADE_BOT_FILTER=tag
+        CREATE TABLE IF NOT EXISTS bot_views (
+            ts INTEGER NOT NULL,
+            game_id INTEGER NOT NULL,
+            reason TEXT NOT NULL
+        );
+
+        -- Closed months moved out of page_views into segment files (archive.py)
+        CREATE TABLE IF NOT EXISTS archive_segments (
+            month TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            min_ts INTEGER NOT NULL,
+            max_ts INTEGER NOT NULL,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            cleared INTEGER NOT NULL DEFAULT 0  -- 1 once its rows are gone from page_views
+        );
+        -- Views and distinct visitors per archived day, written with its segment
+        CREATE TABLE IF NOT EXISTS archive_days (
+            day INTEGER PRIMARY KEY,
+            views INTEGER NOT NULL,
+            visitors INTEGER NOT NULL
+        );
     """)
+    db.execute('BEGIN IMMEDIATE')   # column check and ALTER as one
+    with db:
+        if 'rating_key' not in {r[1] for r in db.execute('PRAGMA table_info(ratings)')}:
+            db.execute('ALTER TABLE ratings ADD COLUMN rating_key TEXT')
+        db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_rat_key ON ratings(rating_key) WHERE rating_key IS NOT NULL')
+    init_fts(db)
+    return True
+
+
+def init_db(db):
+    """
+    The collector's setup: the legacy page_views set aside, the schema, then
+    the one-time backfills of derived tables. Each backfill only runs on an
+    empty table, and the checks and fills share one write transaction, so a
+    second run waits and then finds them filled.
+    """
+    # Persistent: readers (the API, snapshot.py) and the writers stop blocking each other
+    db.execute('PRAGMA journal_mode=WAL')
+    retire_legacy_page_views(db)
+    init_schema(db)
+    db.execute('BEGIN IMMEDIATE')
+    # One-time backfill for databases that had ratings before the aggregates
+    if db.execute('SELECT 1 FROM rating_aggregates LIMIT 1').fetchone() is None:
+        db.execute('''
+            INSERT INTO rating_aggregates (game, count, sum, s1, s2, s3, s4, s5)
+            SELECT game, COUNT(stars), COALESCE(SUM(stars), 0),
+                   SUM(stars = 1), SUM(stars = 2), SUM(stars = 3), SUM(stars = 4), SUM(stars = 5)
+            FROM ratings WHERE stars BETWEEN 1 AND 5 GROUP BY game
+        ''')
+    init_bitmaps(db)
+    if db.execute('SELECT 1 FROM views_hour LIMIT 1').fetchone() is None:
+        counters = ViewCounters(db)
+        for ts, game, _ in db.execute(all_views_sql(db)):
+            counters.add(ts, game)
+        counters.flush()
+    if db.execute('SELECT 1 FROM topk LIMIT 1').fetchone() is None:
+        topk = TopK(db)
+        for hour, game, views in db.execute("SELECT bucket, game, views FROM views_hour WHERE game != ''"):
+            topk.add(hour * 3600, 'game', game, views)
+        topk.flush()
+    if db.execute('SELECT 1 FROM trend_rates LIMIT 1').fetchone() is None:
+        # Four baseline half-lives back is enough: older views weigh < 7%
+        since = int(time.time()) - 4 * TREND_HALF_LIVES[-1][1]
+        trend = TrendRates(db, history_from=since)
+        for ts, game, _ in db.execute(f'SELECT * FROM ({all_views_sql(db)}) WHERE ts >= ?', (since,)):
+            trend.add(ts, game)
+        trend.flush()
+    # With a legacy table, migrate_page_views backfills once it has drained it
+    if (not has_legacy_views(db) and db.execute('SELECT 1 FROM sessions LIMIT 1').fetchone() is None
+            and db.execute('SELECT 1 FROM open_sessions LIMIT 1').fetchone() is None):
+        backfill_sessions(db)
     db.commit()
 
 
+def backfill_sessions(db):
+    """
+    Rebuild sessions from page_views over the last SESSION_BACKFILL_DAYS, or
+    from the earliest visit already recorded if that is older: those are
+    replaced, not added to. Runs once page_views holds every view: on a
+    database new to sessions, and when the legacy table is dropped (runs
+    during the migration only sessionized their own new hits). Caller commits.
+    """
+    now = int(time.time())
+    earliest = db.execute(
+        'SELECT MIN(start_ts) FROM (SELECT start_ts FROM sessions UNION ALL SELECT start_ts FROM open_sessions)'
+    ).fetchone()[0]
+    since = min(now - SESSION_BACKFILL_DAYS * 86400, earliest if earliest is not None else now)
+    db.execute('DELETE FROM sessions')
+    db.execute('DELETE FROM open_sessions')
+    sessions = Sessionizer(db)
+    for ts, game_id, visitor_id in db.execute(
+            'SELECT ts, game_id, visitor_id FROM page_views WHERE ts >= ? ORDER BY ts', (since,)):
+        sessions.add(ts, visitor_id, game_id)
+    sessions.flush(now)
+
+
+def has_legacy_views(db) -> bool:
+    return db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'page_views_legacy'"
+    ).fetchone() is not None
+
+
+def all_views_sql(db) -> str:
+    """(ts, game, ip_hash) of every page view, including rows not yet migrated."""
+    sql = '''SELECT p.ts, g.name, v.ip_hash FROM page_views p
+             JOIN games g ON g.id = p.game_id JOIN visitors v ON v.id = p.visitor_id'''
+    if has_legacy_views(db):
+        sql += ' UNION ALL SELECT ts, game, ip_hash FROM page_views_legacy'
+    return f'SELECT * FROM ({sql}) ORDER BY 1'
+
+
+def retire_legacy_page_views(db):
+    """
+    Step one of the move to the compact schema: set the old text-keyed table
+    aside as page_views_legacy (a rename, instant) so the collector can write
+    the new layout straight away. migrate_page_views() drains it afterwards.
+    """
+    cols = {r[1] for r in db.execute('PRAGMA table_info(page_views)')}
+    if 'ip_hash' not in cols:
+        return
+    with db:
+        for name in ('idx_pv_date', 'idx_pv_ts', 'idx_pv_game', 'idx_pv_game_ts'):
+            db.execute(f'DROP INDEX IF EXISTS {name}')
+        db.execute('ALTER TABLE page_views RENAME TO page_views_legacy')
+    print('page_views: legacy table set aside for migration')
+
+
+def migrate_page_views(db, budget_seconds: float = 60, batch: int = MIGRATE_BATCH) -> bool:
+    """
+    Copy legacy rows into the compact table, newest first so the dashboard's
+    recent windows are complete soonest. Each batch is its own short
+    transaction (copy + delete), so the API and the collector keep running and
+    an interrupted run simply resumes. Returns True once nothing is left.
+    """
+    if not has_legacy_views(db):
+        return True
+    deadline = time.monotonic() + budget_seconds
+    moved = 0
+    while time.monotonic() < deadline:
+        row = db.execute(
+            'SELECT id FROM page_views_legacy ORDER BY id DESC LIMIT 1 OFFSET ?', (batch - 1,)
+        ).fetchone()
+        low = row[0] if row else 0
+        with db:
+            db.execute(
+                'INSERT OR IGNORE INTO games (name) SELECT DISTINCT game FROM page_views_legacy WHERE id >= ?',
+                (low,)
+            )
+            db.execute(
+                '''INSERT OR IGNORE INTO visitors (ip_hash, first_ts)
+                   SELECT ip_hash, MIN(ts) FROM page_views_legacy WHERE id >= ? GROUP BY ip_hash''',
+                (low,)
+            )
+            n = db.execute(
+                '''INSERT INTO page_views (ts, game_id, visitor_id)
+                   SELECT l.ts, g.id, v.id FROM page_views_legacy l
+                   JOIN games g ON g.name = l.game JOIN visitors v ON v.ip_hash = l.ip_hash
+                   WHERE l.id >= ?''',
+                (low,)
+            ).rowcount
+            db.execute('DELETE FROM page_views_legacy WHERE id >= ?', (low,))
+        moved += n
+        if not row:
+            db.execute('BEGIN IMMEDIATE')   # the drop and the sessions backfill as one
+            with db:
+                db.execute('DROP TABLE page_views_legacy')
+                backfill_sessions(db)
+            print(f'page_views: migrated {moved} rows, legacy table dropped, sessions backfilled')
+            return True
+    print(f'page_views: migrated {moved} rows this run, more remain')
+    return False
+
+
+def init_fts(db):
+    """Full-text index over ratings.text, kept in sync by triggers."""
+    db.execute('BEGIN IMMEDIATE')   # the trigger check, the triggers and the rebuild as one
+    with db:
+        had_index = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'ratings_fts_ai'"
+        ).fetchone()
+        for sql in ("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS ratings_fts USING fts5(
+                text, content='ratings', content_rowid='id', tokenize='porter unicode61'
+            )""", """
+            CREATE TRIGGER IF NOT EXISTS ratings_fts_ai AFTER INSERT ON ratings BEGIN
+                INSERT INTO ratings_fts (rowid, text) VALUES (new.id, new.text);
+            END""", """
+            CREATE TRIGGER IF NOT EXISTS ratings_fts_ad AFTER DELETE ON ratings BEGIN
+                INSERT INTO ratings_fts (ratings_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END""", """
+            CREATE TRIGGER IF NOT EXISTS ratings_fts_au AFTER UPDATE OF text ON ratings BEGIN
+                INSERT INTO ratings_fts (ratings_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                INSERT INTO ratings_fts (rowid, text) VALUES (new.id, new.text);
+            END"""):
+            db.execute(sql)
+        if not had_index:
+            db.execute("INSERT INTO ratings_fts (ratings_fts) VALUES ('rebuild')")
+
+
+def init_bitmaps(db):
+    """Build visitor ids and day bitmaps from page_views the first time round."""
+    if db.execute('SELECT 1 FROM visitor_bitmaps LIMIT 1').fetchone():
+        return
+    index = VisitorIndex(db)
+    for ts, game, ip_hash in db.execute(all_views_sql(db)).fetchall():
+        index.add(ts, game, ip_hash)
+    index.flush()
+
+
+class VisitorIndex:
+    """
+    Maps ip_hash → dense visitor id and ORs ids into per-(day, game) bitmaps.
+    Bitmaps touched in a run are loaded once, updated in memory and written
+    back by flush() in the collector's transaction.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.ids: dict[str, int] = {}
+        self.bitmaps: dict[tuple, Bitmap] = {}
+
+    def visitor_id(self, ip_hash: str, ts: int) -> int:
+        vid = self.ids.get(ip_hash)
+        if vid is None:
+            row = self.db.execute('SELECT id FROM visitors WHERE ip_hash = ?', (ip_hash,)).fetchone()
+            if row:
+                vid = row[0]
+            else:
+                vid = self.db.execute(
+                    'INSERT INTO visitors (ip_hash, first_ts) VALUES (?, ?)', (ip_hash, ts)
+                ).lastrowid
+            self.ids[ip_hash] = vid
+        return vid
+
+    def bitmap(self, day: int, game: str) -> Bitmap:
+        bm = self.bitmaps.get((day, game))
+        if bm is None:
+            row = self.db.execute(
+                'SELECT bitmap FROM visitor_bitmaps WHERE day = ? AND game = ?', (day, game)
+            ).fetchone()
+            bm = Bitmap.from_bytes(row[0]) if row else Bitmap()
+            self.bitmaps[(day, game)] = bm
+        return bm
+
+    def add(self, ts: int, game: str, ip_hash: str) -> int:
+        vid = self.visitor_id(ip_hash, ts)
+        day = ts // 86400
+        self.bitmap(day, game).add(vid)
+        self.bitmap(day, '').add(vid)
+        return vid
+
+    def flush(self):
+        self.db.executemany(
+            'INSERT OR REPLACE INTO visitor_bitmaps (day, game, bitmap) VALUES (?, ?, ?)',
+            [(day, game, bm.to_bytes()) for (day, game), bm in self.bitmaps.items()]
+        )
+        self.bitmaps.clear()
+
+
+class GameIndex:
+    """Maps game name → id in the games dimension table, inserting new names."""
+
+    def __init__(self, db):
+        self.db = db
+        self.ids = dict((name, gid) for gid, name in db.execute('SELECT id, name FROM games'))
+
+    def id(self, name: str) -> int:
+        gid = self.ids.get(name)
+        if gid is None:
+            self.db.execute('INSERT OR IGNORE INTO games (name) VALUES (?)', (name,))
+            gid = self.db.execute('SELECT id FROM games WHERE name = ?', (name,)).fetchone()[0]
+            self.ids[name] = gid
+        return gid
+
+
+class ViewCounters:
+    """Per-minute and per-hour view counts for a run, upserted by flush()."""
+
+    def __init__(self, db):
+        self.db = db
+        self.minute = Counter()
+        self.hour = Counter()
+
+    def add(self, ts: int, game: str):
+        m, h = ts // 60, ts // 3600
+        self.minute[(m, game)] += 1
+        self.minute[(m, '')] += 1
+        self.hour[(h, game)] += 1
+        self.hour[(h, '')] += 1
+
+    def flush(self):
+        for table, counts in (('views_minute', self.minute), ('views_hour', self.hour)):
+            self.db.executemany(
+                f'''INSERT INTO {table} (bucket, game, views) VALUES (?, ?, ?)
+                    ON CONFLICT (game, bucket) DO UPDATE SET views = views + excluded.views''',
+                [(b, g, n) for (b, g), n in counts.items()]
+            )
+            counts.clear()
+        cutoff = (int(time.time()) - MINUTE_COUNTS_DAYS * 86400) // 60
+        self.db.execute('DELETE FROM views_minute WHERE bucket < ?', (cutoff,))
+
+
+class TopK:
+    """
+    A run's hits as Space-Saving sketches per (dimension, hour) and
+    (dimension, day); flush() merges them into the stored ones. Only 'game'
+    is fed today; referrers or paths need nothing but add() calls.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.sketches: dict[tuple, SpaceSaving] = {}   # (dim, res, bucket) → sketch
+        self.hour_floor = int(time.time()) - TOPK_HOUR_DAYS * 86400
+
+    def add(self, ts: int, dim: str, key: str, n: int = 1):
+        for res, bucket in (('h', ts // 3600), ('d', ts // 86400)):
+            if res == 'h' and ts < self.hour_floor:
+                continue
+            s = self.sketches.get((dim, res, bucket))
+            if s is None:
+                s = self.sketches[(dim, res, bucket)] = SpaceSaving(TOPK_CAPACITY)
+            s.add(key, n)
+
+    def flush(self):
+        for (dim, res, bucket), s in self.sketches.items():
+            row = self.db.execute(
+                'SELECT sketch FROM topk WHERE dim = ? AND res = ? AND bucket = ?', (dim, res, bucket)
+            ).fetchone()
+            if row:
+                s = SpaceSaving.from_bytes(row[0]).merge(s)
+            self.db.execute(
+                'INSERT OR REPLACE INTO topk (dim, res, bucket, sketch) VALUES (?, ?, ?, ?)',
+                (dim, res, bucket, s.to_bytes())
+            )
+        self.sketches.clear()
+        self.db.execute("DELETE FROM topk WHERE res = 'h' AND bucket < ?", (self.hour_floor // 3600,))
+
+
+class TrendRates:
+    """
+    Per-game view counts decayed at each TREND_HALF_LIVES half-life.
+
+    A count c as of time t is worth c * 2^(-dt/half_life) at t + dt, so one
+    row per game is enough: add() decays to the new row's ts and adds 1 (a
+    late row adds its own decayed weight instead). flush() stores the counts
+    and rewrites the trending table.
+
+    history_from: when replaying a recent slice of page_views, its start, so
+    games seen in it are not mistaken for new ones.
+    """
+
+    def __init__(self, db, history_from: int = None):
+        self.db = db
+        self.history_from = history_from
+        self.decay = [math.log(2) / h for _, h in TREND_HALF_LIVES]
+        self.state = {r[0]: list(r[1:]) for r in db.execute(
+            'SELECT game, ts, first_ts, c_1h, c_6h, c_24h, c_7d FROM trend_rates')}
+        self.dirty = set()
+
+    def add(self, ts: int, game: str):
+        s = self.state.get(game)
+        if s is None:
+            first = ts if self.history_from is None else min(ts, self.history_from)
+            s = self.state[game] = [ts, first, 0.0, 0.0, 0.0, 0.0]
+        dt = ts - s[0]
+        if dt > 0:
+            for i, k in enumerate(self.decay, 2):
+                s[i] = s[i] * math.exp(-k * dt) + 1.0
+            s[0] = ts
+        else:
+            for i, k in enumerate(self.decay, 2):
+                s[i] += math.exp(k * dt)
+            s[1] = min(s[1], ts)
+        self.dirty.add(game)
+
+    def scores(self, now: int) -> list:
+        """
+        (game, z per short half-life, views/hour per half-life) as of now.
+
+        Over T seconds of history a decayed count with rate k = ln 2 / h
+        weighs the views it has seen by e^(-k age), so a steady rate r fills
+        it to r * (1 - e^(-kT)) / k, with Poisson variance
+        r * (1 - e^(-2kT)) / 2k. The baseline rate comes from the longest
+        count the same way; z is each shorter count's excess over it.
+        """
+        out = []
+        for game, (ts, first, *counts) in self.state.items():
+            dt, span = max(0, now - ts), max(1, now - first)
+            counts = [c * math.exp(-k * dt) for c, k in zip(counts, self.decay)]
+            expo = [(1 - math.exp(-k * span)) / k for k in self.decay]
+            rates = [c / e for c, e in zip(counts, expo)]
+            baseline = rates[-1]
+            z = [(c - baseline * e) / math.sqrt(max(baseline * (1 - math.exp(-2 * k * span)) / (2 * k),
+                                                    TREND_MIN_VARIANCE))
+                 for c, e, k in zip(counts[:-1], expo[:-1], self.decay[:-1])]
+            out.append((game, *z, *(r * 3600 for r in rates)))
+        return out
+
+    def flush(self, now: int = None):
+        self.db.executemany(
+            '''INSERT OR REPLACE INTO trend_rates (game, ts, first_ts, c_1h, c_6h, c_24h, c_7d)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            [(g, *self.state[g]) for g in self.dirty]
+        )
+        self.dirty.clear()
+        now = now or int(time.time())
+        self.db.execute('DELETE FROM trending')
+        self.db.executemany(
+            '''INSERT INTO trending (game, z_1h, z_6h, z_24h, rate_1h, rate_6h, rate_24h, rate_7d, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            [(*row, now) for row in self.scores(now)]
+        )
+
+
+class Sessionizer:
+    """
+    Groups page views into visits as they stream in.
+
+    Open visits sit in a map ordered by last activity, so add() closes the
+    ones idle for SESSION_GAP from the front as the log's clock advances, and
+    at OPEN_SESSIONS_MAX closes the least recently active early (a visitor
+    returning after that starts a new visit). flush() appends closed visits
+    to sessions and carries open ones to the next run in open_sessions.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.open = OrderedDict()   # visitor_id → [start_ts, last_ts, views, entry game_id, {game_id}]
+        for vid, start, last, views, entry, games in db.execute(
+                'SELECT visitor_id, start_ts, last_ts, views, entry_game_id, games FROM open_sessions ORDER BY last_ts'):
+            self.open[vid] = [start, last, views, entry, {int(g) for g in games.split(',')}]
+        self.clock = max((s[1] for s in self.open.values()), default=0)
+        self.closed = []
+        self.evicted = 0
+
+    def add(self, ts: int, visitor_id: int, game_id: int):
+        s = self.open.get(visitor_id)
+        if s is not None and ts - s[1] > SESSION_GAP:
+            self._close(visitor_id)
+            s = None
+        if s is None:
+            if len(self.open) >= OPEN_SESSIONS_MAX:
+                self._close(next(iter(self.open)))
+                self.evicted += 1
+            self.open[visitor_id] = [ts, ts, 1, game_id, {game_id}]
+        else:
+            if ts < s[0]:
+                s[0] = ts
+            elif ts > s[1]:
+                s[1] = ts
+            s[2] += 1
+            s[4].add(game_id)
+            self.open.move_to_end(visitor_id)
+        if ts > self.clock:
+            self.clock = ts
+            self._expire(ts)
+
+    def _expire(self, now: int):
+        # Front = least recently active; log order keeps that close to oldest last_ts
+        while self.open:
+            vid, s = next(iter(self.open.items()))
+            if now - s[1] <= SESSION_GAP:
+                break
+            self._close(vid)
+
+    def _close(self, visitor_id: int):
+        start, last, views, entry, games = self.open.pop(visitor_id)
+        self.closed.append((visitor_id, start, last, views, len(games), entry))
+
+    def flush(self, now: int = None):
+        """Write closed visits (those idle at `now` too) and replace open_sessions (caller commits)."""
+        self._expire(max(now or 0, self.clock))
+        self.db.executemany(
+            '''INSERT INTO sessions (visitor_id, start_ts, end_ts, views, games, entry_game_id)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            self.closed
+        )
+        self.db.execute('DELETE FROM open_sessions')
+        self.db.executemany(
+            '''INSERT INTO open_sessions (visitor_id, start_ts, last_ts, views, entry_game_id, games)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            [(vid, start, last, views, entry, ','.join(map(str, games)))
+             for vid, (start, last, views, entry, games) in self.open.items()]
+        )
+        closed, self.closed = len(self.closed), []
+        return closed
+
+
 def hash_ip(ip: str) -> str:
     return hashlib.sha256(ip.encode()).hexdigest()[:16]
 
@@ -96,11 +756,29 @@ def save_state(offset: int):
         json.dump({'offset': offset}, f)
 
 
-def parse_logs(db):
-    if not os.path.exists(LOG_FILE):
-        print(f'Log file not found: {LOG_FILE}')
-        return
+def parse_line(line: str):
+    """(ip, nginx timestamp, path, ua) of a GET answered 200/304, else None."""
+    m = FULL_RE.match(line)
+    if not m:
+        return None
+    ip, ts_str, method, path, status, ua = m.groups()
+    if method != 'GET' or status not in ('200', '304'):
+        return None
+    return ip, ts_str, path, ua
 
+
+def parse_ts(ts_str: str):
+    """Unix time of an nginx timestamp (19/Feb/2026:12:34:56 +0000), None if malformed."""
+    try:
+        dt = datetime.strptime(ts_str.split(' ')[0], '%d/%b/%Y:%H:%M:%S')
+    except ValueError:
+        return None
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+def local_hits(registry, state: dict):
+    """Game page hits (ts, ip_hash, game, ua) in LOG_FILE past the saved offset.
+    state['start'] and state['offset'] follow the reads."""
     offset = load_state()
     file_size = os.path.getsize(LOG_FILE)
 
@@ -108,67 +786,122 @@ def parse_logs(db):
     if file_size < offset:
         print(f'Log rotated, resetting offset (was {offset}, now {file_size})')
         offset = 0
-
-    inserted = 0
-    new_offset = offset
+    state['start'] = state['offset'] = offset
 
     with open(LOG_FILE, 'r', errors='replace') as f:
         f.seek(offset)
         for line in f:
-            new_offset += len(line.encode('utf-8', errors='replace'))
-            line = line.strip()
-            if not line:
+            state['offset'] += len(line.encode('utf-8', errors='replace'))
+            hit = parse_line(line.strip())
+            if hit is None:
                 continue
+            ip, ts_str, path, ua = hit
 
-            m = FULL_RE.match(line)
-            if not m:
+            # Game page hits only: /snake/, /snake/index.html, /tetris/v2.html
+            game = registry.match(path)
+            if game is None:
                 continue
-
-            ip, ts_str, method, path, status = m.groups()
-            if method != 'GET':
-                continue
-            if status not in ('200', '304'):
+            ts_unix = parse_ts(ts_str)
+            if ts_unix is None:
                 continue
+            yield ts_unix, hash_ip(ip), game, ua
 
-            # Extract game name from path: /snake/ or /snake/index.html
-            parts = path.strip('/').split('/')
-            if not parts or not parts[0]:
-                continue
-            game = parts[0].lower()
-            if game not in GAME_DIRS:
-                continue
 
-            # Only count page-level hits (no deep asset paths)
-            if len(parts) > 1 and parts[1] and not parts[1].endswith('.html'):
-                continue
+def shipped_hits(db, registry, node: str, batches: list):
+    """Game page hits from one node's stored batches (see shipper.py), in offset order."""
+    for (start,) in batches:
+        (payload,) = db.execute(
+            'SELECT payload FROM log_batches WHERE node = ? AND start_offset = ?', (node, start)
+        ).fetchone()
+        for ts, ip_hash, path, ua in json.loads(gzip.decompress(payload))['rows']:
+            game = registry.match(path)
+            if game is not None:
+                yield ts, ip_hash, game, ua
 
-            # Parse timestamp
-            try:
-                # nginx format: 19/Feb/2026:12:34:56 +0000
-                ts_clean = ts_str.split(' ')[0]
-                dt = datetime.strptime(ts_clean, '%d/%b/%Y:%H:%M:%S')
-                ts_unix = int(dt.replace(tzinfo=timezone.utc).timestamp())
-                date_str = dt.strftime('%Y-%m-%d')
-            except Exception:
-                continue
 
-            ip_hash = hash_ip(ip)
-            db.execute(
-                'INSERT INTO page_views (ts, game, ip_hash, date) VALUES (?, ?, ?, ?)',
-                (ts_unix, game, ip_hash, date_str)
-            )
-            inserted += 1
+def parse_logs(db):
+    """Count game page views from the local access log and from batches other
+    nodes shipped, merged into one time-ordered stream."""
+    registry = GameRegistry()
+    sources = []
+    local = {}
+    if os.path.exists(LOG_FILE):
+        sources.append(local_hits(registry, local))
+    else:
+        print(f'Log file not found: {LOG_FILE}')
+    pending = {}
+    for node, start in db.execute(
+            'SELECT node, start_offset FROM log_batches WHERE processed_at IS NULL ORDER BY node, start_offset'):
+        pending.setdefault(node, []).append((start,))
+    for node, batches in pending.items():
+        sources.append(shipped_hits(db, registry, node, batches))
+    if not sources:
+        return
+
+    inserted = 0
+    visitors = VisitorIndex(db)
+    games = GameIndex(db)
+    counters = ViewCounters(db)
+    trend = TrendRates(db)
+    topk = TopK(db)
+    sessions = Sessionizer(db)
+    bot_filter = bots.BotFilter(db, int(time.time())) if bots.MODE != 'off' else None
+
+    for ts_unix, ip_hash, game, ua in heapq.merge(*sources, key=itemgetter(0)):
+        if bot_filter is not None:
+            reason = bot_filter.check(ts_unix, ip_hash, ua)
+            if reason:
+                if bots.MODE == 'tag':
+                    db.execute('INSERT INTO bot_views (ts, game_id, reason) VALUES (?, ?, ?)',
+                               (ts_unix, games.id(game), reason))
+                continue
 
+        visitor_id = visitors.add(ts_unix, game, ip_hash)
+        game_id = games.id(game)
+        db.execute(
+            'INSERT INTO page_views (ts, game_id, visitor_id) VALUES (?, ?, ?)',
+            (ts_unix, game_id, visitor_id)
+        )
+        sessions.add(ts_unix, visitor_id, game_id)
+        counters.add(ts_unix, game)
+        trend.add(ts_unix, game)
+        topk.add(ts_unix, 'game', game)
+        inserted += 1
+
+    visitors.flush()
+    counters.flush()
+    trend.flush()
+    topk.flush()
+    closed = sessions.flush(int(time.time()))
+    if bot_filter is not None:
+        bot_filter.flush(int(time.time()))
+    for node, batches in pending.items():
+        db.executemany(
+            'UPDATE log_batches SET payload = NULL, processed_at = ? WHERE node = ? AND start_offset = ?',
+            [(int(time.time()), node, start) for (start,) in batches]
+        )
     db.commit()
-    save_state(new_offset)
-    print(f'[{datetime.now().isoformat()}] Parsed {inserted} new page views (offset {offset}→{new_offset})')
+    if local:
+        save_state(local['offset'])
+    shipped = f', {sum(map(len, pending.values()))} shipped batches from {len(pending)} nodes' if pending else ''
+    offsets = f' (offset {local["start"]}→{local["offset"]})' if local else ''
+    print(f'[{datetime.now().isoformat()}] Parsed {inserted} new page views{offsets}{shipped}, '
+          f'{closed} sessions closed, {len(sessions.open)} open'
+          + (f' ({sessions.evicted} closed early)' if sessions.evicted else '')
+          + (f', filtered bots: {bot_filter.summary()}' if bot_filter is not None else ''))
 
 
 def main():
     db = sqlite3.connect(DB_FILE)
     db.row_factory = sqlite3.Row
     init_db(db)
-    parse_logs(db)
+    if '--migrate' in sys.argv:
+        # Manual: finish the page_views migration, then give the space back
+        if migrate_page_views(db, budget_seconds=float('inf')):
+            db.execute('VACUUM')
+    else:
+        migrate_page_views(db)
+        parse_logs(db)
     db.close()
 
 
@@ -0,0 +1,126 @@
+"""
+In-process columnar copy of page_views for the analytics API.
+
+Enabled with ARCADE_COLUMNAR=1 (needs numpy). The store loads ts, game_id and
+visitor_id into NumPy arrays kept sorted by ts, then tops them up from the
+collector's high-water mark (the largest page_views.id seen) at most once per
+REFRESH_SECONDS. Window aggregates become searchsorted() slices plus
+bincount()/unique(), instead of a SQLite scan per request.
+
+Install: pip install numpy
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from itertools import chain
+
+import numpy as np
+
+REFRESH_SECONDS = 5   # collect.py commits every 15 min; this only bounds staleness
+FETCH_ROWS = 250_000
+
+
+class ColumnStore:
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.lock = threading.RLock()
+        self.size = 0
+        self.high_water = 0
+        self.loaded_at = 0.0
+        self.ts = np.empty(0, np.int64)
+        self.game = np.empty(0, np.int32)
+        self.visitor = np.empty(0, np.int32)
+        self.daily_cache: dict[int, int] = {}   # day → distinct visitors, dropped when the day gets rows
+
+    def refresh(self, force: bool = False):
+        """Append rows with id above the high-water mark (cheap rowid seek)."""
+        if not force and time.monotonic() - self.loaded_at < REFRESH_SECONDS:
+            return
+        with self.lock:
+            if not force and time.monotonic() - self.loaded_at < REFRESH_SECONDS:
+                return
+            db = sqlite3.connect('file:' + urllib.parse.quote(os.path.abspath(self.db_file)) + '?mode=ro', uri=True)
+            try:
+                cur = db.execute(
+                    'SELECT id, ts, game_id, visitor_id FROM page_views WHERE id > ? ORDER BY id',
+                    (self.high_water,)
+                )
+                chunks = []
+                while True:
+                    rows = cur.fetchmany(FETCH_ROWS)
+                    if not rows:
+                        break
+                    chunks.append(np.fromiter(chain.from_iterable(rows), np.int64, len(rows) * 4).reshape(-1, 4))
+            finally:
+                db.close()
+            if chunks:
+                new = np.concatenate(chunks)
+                self._append(new[:, 1], new[:, 2], new[:, 3])
+                self.high_water = int(new[-1, 0])
+                for day in np.unique(new[:, 1] // 86400).tolist():
+                    self.daily_cache.pop(day, None)
+            self.loaded_at = time.monotonic()
+
+    def _append(self, ts, game, visitor):
+        if self.size + len(ts) > len(self.ts):
+            cap = max(len(self.ts) * 2, self.size + len(ts), 1024)
+            for name in ('ts', 'game', 'visitor'):
+                old = getattr(self, name)
+                grown = np.empty(cap, old.dtype)
+                grown[:self.size] = old[:self.size]
+                setattr(self, name, grown)
+        end = self.size + len(ts)
+        self.ts[self.size:end] = ts
+        self.game[self.size:end] = game
+        self.visitor[self.size:end] = visitor
+        # New rows are nearly always later than what is loaded; only when they
+        # are not (late log lines, migrated history) is a re-sort needed.
+        out_of_order = self.size and ts.size and ts.min() < self.ts[self.size - 1]
+        if out_of_order or not np.all(ts[1:] >= ts[:-1]):
+            order = np.argsort(self.ts[:end], kind='stable')
+            for name in ('ts', 'game', 'visitor'):
+                arr = getattr(self, name)
+                arr[:end] = arr[:end][order]
+        self.size = end
+
+    def _since(self, start_ts: int) -> slice:
+        return slice(int(np.searchsorted(self.ts[:self.size], start_ts, 'left')), self.size)
+
+    def distinct_visitors(self, start_ts: int) -> int:
+        self.refresh()
+        with self.lock:
+            # Visitor ids are dense, so a bincount is cheaper than sorting
+            return int(np.count_nonzero(np.bincount(self.visitor[self._since(start_ts)])))
+
+    def views_by_game(self, start_ts: int) -> dict:
+        """{game_id: views} for rows at or after start_ts."""
+        self.refresh()
+        with self.lock:
+            counts = np.bincount(self.game[self._since(start_ts)])
+        ids = np.flatnonzero(counts)
+        return dict(zip(ids.tolist(), counts[ids].tolist()))
+
+    def daily_visitors(self, start_ts: int) -> list:
+        """[(day number, distinct visitors)] for each day with views since start_ts."""
+        self.refresh()
+        with self.lock:
+            window = self._since(start_ts)
+            days = self.ts[window] // 86400
+            if not days.size:
+                return []
+            # ts-sorted, so each day is one contiguous run; only days that got
+            # rows since the last call are counted again
+            bounds = np.flatnonzero(np.diff(days)) + 1
+            starts = np.concatenate(([0], bounds)) + window.start
+            ends = np.concatenate((bounds, [days.size])) + window.start
+            out = []
+            for s, e in zip(starts.tolist(), ends.tolist()):
+                day = int(self.ts[s] // 86400)
+                if day not in self.daily_cache:
+                    self.daily_cache[day] = int(np.unique(self.visitor[s:e]).size)
+                out.append((day, self.daily_cache[day]))
+            return out
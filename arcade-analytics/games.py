@@ -0,0 +1,130 @@
+"""
+Game registry for the collector: which request paths are game page views.
+
+Games come from games-manifest.json (including the ones the game builder
+generates) and from the repo's top-level directories, less the site's own
+infrastructure (NON_GAME_DIRS). The list is compiled into a dict keyed by the
+first path segment, so classifying a path is a partition and one lookup, and
+verdicts for paths already seen are cached.
+
+A page view is a hit on the game directory itself, index.html, keypad.html,
+a versioned entry page (v2.html, v3.html, ...) or the page the manifest links
+to. Query strings are ignored.
+
+The registry re-reads its sources when the manifest or the repo directory
+changes (mtime, checked at most every RELOAD_SECONDS), so a new game is
+counted without restarting anything that holds one.
+"""
+
+import os
+import re
+import json
+import time
+
+REPO_DIR = os.environ.get('ARCADE_REPO_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MANIFEST_NAME = 'games-manifest.json'
+
+RELOAD_SECONDS = 30
+MATCH_CACHE_SIZE = 100000   # distinct paths remembered; cleared when full and on reload
+
+# Top-level directories that are part of the site, not games
+NON_GAME_DIRS = frozenset({
+    'agent-ontology', 'arcade-analytics', 'audit', 'deploy', 'engine', 'feedback',
+    'game-builder', 'game-builder-server', 'game-design', 'game-generation-prompts',
+    'game-types', 'genre-explorer', 'how-it-works', 'level-design', 'library-ontology',
+    'node_modules', 'pipeline', 'scripts', 'stats', 'visual-design',
+})
+
+ENTRY_PAGE_RE = re.compile(r'(?:index|keypad|v\d+)\.html')
+
+
+class GameRegistry:
+
+    def __init__(self, repo_dir: str = REPO_DIR):
+        self.repo_dir = repo_dir
+        self.manifest_file = os.path.join(repo_dir, MANIFEST_NAME)
+        self.prefixes: dict[str, tuple] = {}   # first path segment → (game, extra entry pages)
+        self.cache: dict[str, str] = {}        # path → game, or '' for not a page view
+        self.stamp = None
+        self.checked_at = 0.0
+        self.reload()
+
+    def _stamp(self) -> tuple:
+        out = []
+        for path in (self.manifest_file, self.repo_dir):
+            try:
+                out.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+    def reload(self):
+        """Rebuild from the manifest and directory tree (a bad manifest keeps the last good one)."""
+        self.stamp = self._stamp()
+        self.checked_at = time.monotonic()
+        pages: dict[str, set] = {}
+        try:
+            with os.scandir(self.repo_dir) as it:
+                for entry in it:
+                    if entry.is_dir() and not entry.name.startswith('.') and entry.name not in NON_GAME_DIRS:
+                        pages[entry.name.lower()] = set()
+        except OSError:
+            pass
+
+        try:
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+            for game in manifest.get('games', []):
+                # The url names the directory and its entry page: /tetris/v2.html
+                head, _, page = (game.get('url') or f'/{game["id"]}/').lstrip('/').partition('/')
+                extra = pages.setdefault(head.lower(), set())
+                page = page.partition('?')[0]
+                if page and not ENTRY_PAGE_RE.fullmatch(page):
+                    extra.add(page)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            if self.prefixes:
+                print(f'games: {self.manifest_file} unreadable ({e}), keeping {len(self.prefixes)} games')
+                return
+            print(f'games: {self.manifest_file} unreadable ({e}), using the directory tree only')
+
+        self.prefixes = {name: (name, frozenset(extra)) for name, extra in pages.items()}
+        self.cache = {}
+
+    def check(self):
+        """Reload if the manifest or the set of directories changed."""
+        self.checked_at = time.monotonic()
+        if self._stamp() != self.stamp:
+            self.reload()
+
+    def names(self) -> list:
+        return sorted(self.prefixes)
+
+    def __contains__(self, game: str) -> bool:
+        return game in self.prefixes
+
+    def __len__(self) -> int:
+        return len(self.prefixes)
+
+    def match(self, path: str):
+        """Game name if `path` is a page view of a game, else None."""
+        if time.monotonic() - self.checked_at >= RELOAD_SECONDS:
+            self.check()
+        game = self.cache.get(path)
+        if game is None:
+            game = self._classify(path)
+            if len(self.cache) >= MATCH_CACHE_SIZE:
+                self.cache.clear()
+            self.cache[path] = game
+        return game or None
+
+    def _classify(self, path: str) -> str:
+        head, _, page = path.partition('?')[0].lstrip('/').partition('/')
+        hit = self.prefixes.get(head.lower())
+        if hit is None:
+            return ''
+        page = page.rstrip('/')
+        if page and not ENTRY_PAGE_RE.fullmatch(page) and page not in hit[1]:
+            return ''   # assets, sub-pages, API calls under the game's directory
+        return hit[0]
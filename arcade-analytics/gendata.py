@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Synthetic OpenArcade traffic for benchmarks.
+
+Install: pip install numpy
+Usage:
+  python3 gendata.py db --rows 10M [--days 365] [--out arcade-10M.db]
+  python3 gendata.py log --lines 1M [--hours 24] [--out access.log]
+
+db   A ready-to-serve arcade.db: page_views plus everything collect.py
+     derives from it (visitors, visitor_bitmaps, per-minute/hour counters,
+     trending), and some ratings and referrals. Derived tables are built
+     with numpy a day at a time, so init_db() finds nothing to backfill
+     and 100M rows fit in memory.
+log  An nginx access log in the collector's format ending now: game page
+     hits mixed with asset requests, API calls, non-GETs and 404s, plus
+     crawler and script traffic and a ten-minute scraper burst from one IP.
+
+Both draw games from a Zipf distribution over the game registry (a few
+games get most of the traffic) and visitors from a skewed pool (about one
+visitor per 8 page views, regulars return daily), with a diurnal cycle.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import collect
+from bitmap import Bitmap, CHUNK_BITS, CHUNK_MASK
+from games import GameRegistry
+
+ZIPF_S = 1.1                # game popularity exponent
+VIEWS_PER_VISITOR = 8
+VISITOR_SKEW = 2.5          # visitor = pool * u^skew: low ids are the regulars
+RATINGS_PER_VIEWS = 200     # one rating per this many page views
+# Share of the day's traffic per UTC hour (evening peak, quiet early morning)
+DIURNAL = np.array([3, 2, 1.5, 1, 1, 1.2, 1.8, 2.5, 3, 3.5, 4, 4.5,
+                    5, 5, 5, 5.5, 6, 6.5, 7, 7.5, 7, 6, 5, 4])
+DIURNAL = DIURNAL / DIURNAL.sum()
+
+ASSETS = ('game.js', 'style.css', 'cover.webp', 'sprites.png', 'music.mp3')
+BOT_AGENTS = (
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)',
+    'Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)',
+    'curl/8.5.0',
+    'python-requests/2.31.0',
+    '-',
+)
+BOT_SHARE = 0.03            # lines from self-declared crawlers and scripts
+CRAWL_SECONDS = 600         # plus one scraper with a browser UA, mid-log, for this long
+CRAWL_SHARE = 0.3           # ... sending this share of the lines meanwhile
+CRAWLER_IP = '203.0.113.7'
+FEEDBACK_WORDS = (          # rating texts; bench.py search and serialize draw from these too
+    'lag controls crash love fun hard easy boring music sound jump shoot level boss '
+    'mobile touch keyboard slow fast freeze bug score restart pause great awesome too '
+    'short long more levels enemies speed physics collision graphics colors please add'
+).split()
+USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_2) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:122.0) Gecko/20100101 Firefox/122.0',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0 Mobile Safari/537.36',
+)
+
+
+def parse_count(text: str) -> int:
+    """'10M', '250k' or '1000000' → int."""
+    text = text.strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000, 'g': 1_000_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('kmg')) * scale)
+
+
+def game_names() -> list:
+    return GameRegistry().names()
+
+
+def zipf_weights(n: int) -> np.ndarray:
+    w = 1 / np.arange(1, n + 1) ** ZIPF_S
+    return w / w.sum()
+
+
+def hour_shares(day: int, until: int = None) -> np.ndarray:
+    """DIURNAL, with each hour cut to the part of it before `until`."""
+    if until is None:
+        return DIURNAL
+    return DIURNAL * np.clip((until - day * 86400) / 3600 - np.arange(24), 0, 1)
+
+
+def day_timestamps(rng, day: int, n: int, until: int = None) -> np.ndarray:
+    """n sorted timestamps within UTC day number `day` (and before `until`), following DIURNAL."""
+    shares = hour_shares(day, until)
+    hours = rng.choice(24, n, p=shares / shares.sum())
+    span = 3600 if until is None else np.clip(until - day * 86400 - hours * 3600, 1, 3600)
+    return np.sort(day * 86400 + hours * 3600 + (rng.random(n) * span).astype(np.int64))
+
+
+def visitor_ip(v: int) -> str:
+    """Stable fake IPv4 address per visitor id."""
+    return f'{11 + (v >> 24) % 200}.{(v >> 16) & 255}.{(v >> 8) & 255}.{v & 255}'
+
+
+def bitmap_of(sorted_ids: np.ndarray) -> Bitmap:
+    """Bitmap from sorted unique ids, one packbits() per 65536-wide chunk."""
+    bm = Bitmap()
+    keys = sorted_ids >> CHUNK_BITS
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    for part in np.split(sorted_ids, bounds):
+        bits = np.zeros(1 << CHUNK_BITS, np.bool_)
+        bits[part & CHUNK_MASK] = True
+        bm.chunks[int(part[0] >> CHUNK_BITS)] = int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+    return bm
+
+
+# --- arcade.db ---
+
+def generate_db(path: str, rows: int, days: int = 365, seed: int = 1, now: int = None):
+    """Write a populated arcade.db with `rows` page views over the last `days` days."""
+    if os.path.exists(path):
+        os.remove(path)
+    rng = np.random.default_rng(seed)
+    now = now or int(time.time())
+    today = now // 86400
+    names = game_names()
+    probs = zipf_weights(len(names))
+    pool = max(2, rows // VIEWS_PER_VISITOR)
+    first_seen = np.full(pool + 1, np.iinfo(np.int64).max, np.int64)
+    trend_since = now - 4 * collect.TREND_HALF_LIVES[-1][1]
+    decay = np.array([np.log(2) / h for _, h in collect.TREND_HALF_LIVES])
+    trend = np.zeros((len(names) + 1, len(decay)))
+
+    db = sqlite3.connect(path)
+    collect.init_db(db)
+    db.executemany('INSERT INTO games (id, name) VALUES (?, ?)', [(i, n) for i, n in enumerate(names, 1)])
+    db.execute('DROP INDEX idx_pv_ts')
+    db.execute('DROP INDEX idx_pv_game_ts')
+
+    # Day sizes: weekly swing plus noise, scaled to add up to `rows`
+    day_nums = np.arange(today - days + 1, today + 1)
+    weights = (1 + 0.15 * np.sin(day_nums * 2 * np.pi / 7)) * rng.uniform(0.9, 1.1, days)
+    weights[-1] *= max(hour_shares(today, now).sum(), 1e-3)   # today is only partly over
+    sizes = np.floor(weights / weights.sum() * rows).astype(np.int64)
+    sizes[-1] += rows - sizes.sum()
+
+    t0 = time.perf_counter()
+    for i, (day, n) in enumerate(zip(day_nums.tolist(), sizes.tolist())):
+        ts = day_timestamps(rng, day, n, now if day == today else None)
+        game = rng.choice(len(names), n, p=probs) + 1
+        visitor = (pool * rng.random(n) ** VISITOR_SKEW).astype(np.int64) + 1
+        np.minimum.at(first_seen, visitor, ts)
+
+        db.executemany('INSERT INTO page_views (ts, game_id, visitor_id) VALUES (?, ?, ?)',
+                       zip(ts.tolist(), game.tolist(), visitor.tolist()))
+        _derive_day(db, day, ts, game, visitor, names, now)
+
+        recent = ts >= trend_since
+        if recent.any():
+            w = np.exp(-np.outer(now - ts[recent], decay))
+            for j in range(len(decay)):
+                trend[:, j] += np.bincount(game[recent], w[:, j], len(names) + 1)
+        _ratings_and_referrals(db, rng, ts, game, names)
+        db.commit()
+        if (i + 1) % 30 == 0 or i + 1 == days:
+            print(f'  {i + 1}/{days} days, {sizes[:i + 1].sum():,} rows, {time.perf_counter() - t0:.0f}s')
+
+    seen = np.flatnonzero(first_seen != np.iinfo(np.int64).max)
+    db.executemany('INSERT INTO visitors (id, ip_hash, first_ts) VALUES (?, ?, ?)',
+                   ((v, collect.hash_ip(visitor_ip(v)), t) for v, t in zip(seen.tolist(), first_seen[seen].tolist())))
+    db.executemany('INSERT INTO trend_rates (game, ts, first_ts, c_1h, c_6h, c_24h, c_7d) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   [(name, now, trend_since, *trend[gid].tolist()) for gid, name in enumerate(names, 1)
+                    if trend[gid].any()])
+    collect.TrendRates(db).flush(now)
+    print('  indexing page_views')
+    db.execute('CREATE INDEX idx_pv_ts ON page_views(ts, visitor_id)')
+    db.execute('CREATE INDEX idx_pv_game_ts ON page_views(game_id, ts)')
+    db.commit()
+    collect.init_db(db)   # fills rating_aggregates; every other derived table is already there
+    db.execute('ANALYZE')
+    db.commit()
+    db.close()
+
+
+def _derive_day(db, day, ts, game, visitor, names, now):
+    """visitor_bitmaps, views_hour and (recent days) views_minute for one day."""
+    rows = []
+    for gid in np.unique(game).tolist():
+        rows.append((day, names[gid - 1], bitmap_of(np.unique(visitor[game == gid])).to_bytes()))
+    rows.append((day, '', bitmap_of(np.unique(visitor)).to_bytes()))
+    db.executemany('INSERT INTO visitor_bitmaps (day, game, bitmap) VALUES (?, ?, ?)', rows)
+
+    buckets = [('views_hour', ts // 3600)]
+    if day * 86400 >= now - collect.MINUTE_COUNTS_DAYS * 86400:
+        buckets.append(('views_minute', ts // 60))
+    for table, b in buckets:
+        for label, mask in [('', None)] + [(names[g - 1], game == g) for g in np.unique(game).tolist()]:
+            keys, counts = np.unique(b if mask is None else b[mask], return_counts=True)
+            db.executemany(f'INSERT INTO {table} (bucket, game, views) VALUES (?, ?, ?)',
+                           zip(keys.tolist(), [label] * len(keys), counts.tolist()))
+
+
+def _ratings_and_referrals(db, rng, ts, game, names):
+    n = max(1, len(ts) // RATINGS_PER_VIEWS)
+    pick = rng.choice(len(ts), n, replace=False)
+    cats = ['bug_report', 'feature_suggestion', 'feedback', 'other']
+    db.executemany(
+        'INSERT INTO ratings (ts, game, stars, category, text) VALUES (?, ?, ?, ?, ?)',
+        [(int(ts[i]), names[game[i] - 1], int(rng.integers(1, 6)), cats[int(rng.integers(4))],
+          ' '.join(rng.choice(FEEDBACK_WORDS, int(rng.integers(3, 25)))))
+         for i in pick.tolist()]
+    )
+    db.executemany(
+        'INSERT INTO referrals (ts, room_code, date) VALUES (?, ?, ?)',
+        [(int(ts[i]), f'R{int(rng.integers(1 << 20)):05X}',
+          datetime.fromtimestamp(int(ts[i]), timezone.utc).strftime('%Y-%m-%d'))
+         for i in pick[:max(1, n // 4)].tolist()]
+    )
+
+
+# --- nginx access log ---
+
+def log_lines(lines: int, hours: float = 24, seed: int = 2, now: int = None):
+    """Yields access log lines in time order, ending at `now`."""
+    rng = np.random.default_rng(seed)
+    now = now or int(time.time())
+    names = game_names()
+    probs = zipf_weights(len(names))
+    pool = max(2, lines // VIEWS_PER_VISITOR)
+    start = now - int(hours * 3600)
+    crawl_start = (start + now - CRAWL_SECONDS) // 2
+    for base in range(0, lines, 100_000):
+        n = min(100_000, lines - base)
+        # Each chunk covers its share of the window, so the log stays sorted
+        lo = start + (now - start) * base // lines
+        hi = start + (now - start) * (base + n) // lines
+        ts = np.sort(rng.integers(lo, max(lo + 1, hi), n))
+        game = rng.choice(len(names), n, p=probs)
+        visitor = (pool * rng.random(n) ** VISITOR_SKEW).astype(np.int64) + 1
+        kind = rng.random(n)
+        bot = rng.random(n)
+        sizes = rng.integers(200, 90_000, n)
+        for t, g, v, k, b, size in zip(ts.tolist(), game.tolist(), visitor.tolist(), kind.tolist(),
+                                       bot.tolist(), sizes.tolist()):
+            stamp = datetime.fromtimestamp(t, timezone.utc).strftime('%d/%b/%Y:%H:%M:%S +0000')
+            name = names[g]
+            method, status = 'GET', 200
+            ip, agent = visitor_ip(v), USER_AGENTS[v % len(USER_AGENTS)]
+            if b < BOT_SHARE:
+                agent = BOT_AGENTS[v % len(BOT_AGENTS)]
+            elif b < BOT_SHARE + CRAWL_SHARE and 0 <= t - crawl_start < CRAWL_SECONDS:
+                ip = CRAWLER_IP
+                k = 0.2   # page hits only
+            if k < 0.45:
+                path = f'/{name}/' if k < 0.15 else f'/{name}/v2.html' if k < 0.3 else f'/{name}/index.html'
+                status = 304 if k < 0.03 else 200
+            elif k < 0.85:
+                path = f'/{name}/{ASSETS[v % len(ASSETS)]}'
+            elif k < 0.93:
+                path = '/stats-api/summary' if k < 0.9 else '/'
+            elif k < 0.97:
+                method, path = 'POST', '/api/events/rating'
+            else:
+                path, status = f'/{name}/missing-{v % 97}.png', 404
+            yield (f'{ip} - - [{stamp}] "{method} {path} HTTP/1.1" {status} {size} '
+                   f'"https://arcade.example/" "{agent}"\n')
+
+
+def write_log(path: str, lines: int, hours: float = 24, seed: int = 2, now: int = None):
+    with open(path, 'w') as f:
+        f.writelines(log_lines(lines, hours, seed, now))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('db', help='populated arcade.db')
+    p.add_argument('--rows', default='1M', help='page views, e.g. 1M, 10M, 100M')
+    p.add_argument('--days', type=int, default=365)
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--out', default='')
+    p = sub.add_parser('log', help='nginx access log')
+    p.add_argument('--lines', default='1M')
+    p.add_argument('--hours', type=float, default=24)
+    p.add_argument('--seed', type=int, default=2)
+    p.add_argument('--out', default='access.log')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.cmd == 'db':
+        rows = parse_count(args.rows)
+        out = args.out or f'arcade-{args.rows.upper()}.db'
+        generate_db(out, rows, args.days, args.seed)
+        print(f'{out}: {rows:,} page views, {os.path.getsize(out) / 1e6:.0f} MB in {time.perf_counter() - t0:.0f}s')
+    else:
+        lines = parse_count(args.lines)
+        write_log(args.out, lines, args.hours, args.seed)
+        print(f'{args.out}: {lines:,} lines, {os.path.getsize(args.out) / 1e6:.0f} MB in {time.perf_counter() - t0:.0f}s')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
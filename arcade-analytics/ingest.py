@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+"""
+OpenArcade gameplay recording ingest hub.
+FastAPI server on port 8095.
+
+Receives the 60-second segments uploaded by recorder.js / engine/recorder.js:
+multipart form with `metadata`, `frames` (concatenated JPEGs), `frame_index`
+and `events`. The frames blob is streamed straight to disk as it arrives;
+only the small JSON fields are held in memory. Each segment is appended to
+the session catalog (recordings.db) and acknowledged immediately. A small
+worker pool compacts finished sessions into one file pair and enforces the
+storage quota.
+
+Install: pip install fastapi uvicorn python-multipart
+Run:     uvicorn ingest:app --host 0.0.0.0 --port 8095
+
+Systemd service: arcade-ingest
+Nginx proxy:
+  location /api/ingest/ {
+      proxy_pass http://localhost:8095/ingest/;
+      proxy_request_buffering off;
+      client_max_body_size 64m;
+  }
+
+Layout:
+  recordings/<game>/<collector_id>/<session_id>/seg-0000.frames  raw JPEG concat
+  recordings/<game>/<collector_id>/<session_id>/seg-0000.json    index + events + metadata
+After compaction a session holds a single session.frames / session.json pair
+with frame offsets rebased onto the merged blob.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+
+try:
+    from python_multipart import MultipartParser
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart import MultipartParser
+    from multipart.multipart import parse_options_header
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+log = logging.getLogger('ingest')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RECORDINGS_DIR = os.environ.get('ARCADE_RECORDINGS_DIR', os.path.join(BASE_DIR, 'recordings'))
+CATALOG_FILE = os.environ.get('ARCADE_RECORDINGS_DB', os.path.join(BASE_DIR, 'recordings.db'))
+
+QUOTA_BYTES = int(os.environ.get('ARCADE_RECORDINGS_QUOTA', 50 * 1024 ** 3))  # 50 GB
+MAX_FRAMES_BYTES = 64 * 1024 * 1024   # one segment is ~2-4 MB at 2 fps
+MAX_FIELD_BYTES = 4 * 1024 * 1024     # metadata / frame_index / events JSON
+SESSION_IDLE_SECONDS = 600            # compact sessions with no final segment after 10 min
+SWEEP_INTERVAL = 300                  # seconds between idle/quota sweeps
+COMPACT_CLAIM_SECONDS = 3600          # a compaction claim this old is taken to be from a dead worker
+PARSE_BATCH_BYTES = 256 * 1024        # request body handed to the multipart parser per thread hop
+WORKERS = 2
+
+SAFE_RE = re.compile(r'[^A-Za-z0-9_.-]')
+
+app = FastAPI(title='OpenArcade Ingest')
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=['*'],
+    allow_methods=['POST', 'GET'],
+    allow_headers=['*'],
+)
+
+
+def safe_name(value, default: str = 'unknown') -> str:
+    """Reduce an untrusted metadata value to a single safe path component."""
+    s = SAFE_RE.sub('_', str(value or ''))[:64].strip('.')
+    return s or default
+
+
+# ── Catalog ──────────────────────────────────────────────────────────────
+
+def get_catalog():
+    db = sqlite3.connect(CATALOG_FILE, timeout=10)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    return db
+
+
+def init_catalog(db):
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game TEXT NOT NULL,
+            collector_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            path TEXT NOT NULL,
+            first_ts INTEGER NOT NULL,
+            last_ts INTEGER NOT NULL,
+            segments INTEGER NOT NULL DEFAULT 0,
+            frames INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            duration_ms INTEGER,
+            score INTEGER,
+            is_final INTEGER NOT NULL DEFAULT 0,
+            compacted INTEGER NOT NULL DEFAULT 0,
+            compacting INTEGER NOT NULL DEFAULT 0,  -- time a worker claimed it, 0 = none
+            UNIQUE (game, collector_id, session_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_sess_game ON sessions(game, last_ts);
+        CREATE INDEX IF NOT EXISTS idx_sess_last ON sessions(last_ts);
+
+        CREATE TABLE IF NOT EXISTS segments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_pk INTEGER NOT NULL,
+            segment_num INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            frames INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            events INTEGER NOT NULL,
+            UNIQUE (session_pk, segment_num)
+        );
+    """)
+    db.execute('BEGIN IMMEDIATE')   # column check and ALTER as one
+    with db:
+        if 'compacting' not in {r[1] for r in db.execute('PRAGMA table_info(sessions)')}:
+            db.execute('ALTER TABLE sessions ADD COLUMN compacting INTEGER NOT NULL DEFAULT 0')
+
+
+def catalog_append(db, meta: dict, session: str, rel_path: str, seg_num: int,
+                   n_frames: int, n_bytes: int, n_events: int) -> int:
+    """Record one segment and roll its counters into the session row."""
+    now = int(time.time())
+    game = safe_name(meta.get('game'))
+    collector = safe_name(meta.get('collector_id'), 'anon')
+    db.execute(
+        '''INSERT INTO sessions (game, collector_id, session_id, path, first_ts, last_ts)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT (game, collector_id, session_id) DO NOTHING''',
+        (game, collector, session, rel_path, now, now)
+    )
+    pk = db.execute(
+        'SELECT id FROM sessions WHERE game = ? AND collector_id = ? AND session_id = ?',
+        (game, collector, session)
+    ).fetchone()[0]
+    cur = db.execute(
+        '''INSERT OR IGNORE INTO segments (session_pk, segment_num, ts, frames, bytes, events)
+           VALUES (?, ?, ?, ?, ?, ?)''',
+        (pk, seg_num, now, n_frames, n_bytes, n_events)
+    )
+    if cur.rowcount:
+        db.execute(
+            '''UPDATE sessions SET last_ts = ?, segments = segments + 1,
+                   frames = frames + ?, bytes = bytes + ?,
+                   duration_ms = ?, score = ?, is_final = MAX(is_final, ?),
+                   compacted = 0
+               WHERE id = ?''',
+            (now, n_frames, n_bytes, _int_or_none(meta.get('duration_ms')),
+             _int_or_none(meta.get('score')), 1 if meta.get('is_final') else 0, pk)
+        )
+    db.commit()
+    return pk
+
+
+def _int_or_none(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+# ── Streaming multipart ──────────────────────────────────────────────────
+
+class SegmentUpload:
+    """
+    Callback sink for python-multipart. The `frames` part is written to
+    `frames_path` chunk by chunk; every other part is kept as (small) bytes.
+    """
+
+    def __init__(self, frames_path: str):
+        self.frames_path = frames_path
+        self.frames_file = None
+        self.frames_bytes = 0
+        self.fields: dict[str, bytearray] = {}
+        self._name = None
+        self._header_field = b''
+        self._header_value = b''
+        self._headers: dict[bytes, bytes] = {}
+        self.error = None
+
+    def callbacks(self) -> dict:
+        return {
+            'on_part_begin': self.on_part_begin,
+            'on_header_field': self.on_header_field,
+            'on_header_value': self.on_header_value,
+            'on_header_end': self.on_header_end,
+            'on_headers_finished': self.on_headers_finished,
+            'on_part_data': self.on_part_data,
+            'on_part_end': self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._name = None
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b''
+        self._header_value = b''
+
+    def on_headers_finished(self):
+        _, opts = parse_options_header(self._headers.get(b'content-disposition', b''))
+        name = opts.get(b'name', b'').decode('latin-1')
+        self._name = name
+        if name == 'frames':
+            os.makedirs(os.path.dirname(self.frames_path), exist_ok=True)
+            self.frames_file = open(self.frames_path + '.part', 'wb')
+        else:
+            self.fields[name] = bytearray()
+
+    def on_part_data(self, data, start, end):
+        if self.error:
+            return
+        if self._name == 'frames':
+            self.frames_bytes += end - start
+            if self.frames_bytes > MAX_FRAMES_BYTES:
+                self.error = 'frames too large'
+                return
+            self.frames_file.write(data[start:end])
+        elif self._name in self.fields:
+            buf = self.fields[self._name]
+            if len(buf) + (end - start) > MAX_FIELD_BYTES:
+                self.error = f'{self._name} too large'
+                return
+            buf += data[start:end]
+
+    def on_part_end(self):
+        if self._name == 'frames' and self.frames_file is not None:
+            self.frames_file.close()
+
+    def json_field(self, name: str, default):
+        raw = self.fields.get(name)
+        if not raw:
+            return default
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return default
+
+    def discard(self):
+        if self.frames_file is not None and not self.frames_file.closed:
+            self.frames_file.close()
+        try:
+            os.remove(self.frames_path + '.part')
+        except OSError:
+            pass
+
+
+def session_name(meta: dict) -> str:
+    """The upload's session id; without one, the current second (taken once per upload)."""
+    return safe_name(meta.get('session_id'), str(int(time.time())))
+
+
+def segment_dir(meta: dict, session: str) -> str:
+    return os.path.join(
+        safe_name(meta.get('game')),
+        safe_name(meta.get('collector_id'), 'anon'),
+        session,
+    )
+
+
+# ── Endpoints ────────────────────────────────────────────────────────────
+
+@app.post('/ingest/browser')
+async def ingest_browser(request: Request):
+    """Accept one recorder segment. Frames are streamed to disk, never buffered."""
+    ctype, opts = parse_options_header(request.headers.get('content-type', ''))
+    boundary = opts.get(b'boundary')
+    if ctype != b'multipart/form-data' or not boundary:
+        raise HTTPException(400, 'expected multipart/form-data')
+
+    # The session directory comes from `metadata`, which a client may send
+    # after `frames`. Stream frames into .incoming (same filesystem) and
+    # rename into place once the whole form has been parsed: no second copy.
+    spool_dir = os.path.join(RECORDINGS_DIR, '.incoming')
+    spool = os.path.join(spool_dir, f'{os.getpid()}-{id(request)}-{time.monotonic_ns()}')
+    upload = SegmentUpload(spool)
+    parser = MultipartParser(boundary, upload.callbacks())
+    # The parser writes frames to disk from its callbacks: run it in a thread,
+    # a few chunks at a time, so other uploads are not held up behind the disk
+    try:
+        pending = bytearray()
+        async for chunk in request.stream():
+            pending += chunk
+            if len(pending) >= PARSE_BATCH_BYTES:
+                await asyncio.to_thread(parser.write, bytes(pending))
+                pending.clear()
+                if upload.error:
+                    raise HTTPException(413, upload.error)
+        if pending:
+            await asyncio.to_thread(parser.write, bytes(pending))
+        if upload.error:
+            raise HTTPException(413, upload.error)
+        await asyncio.to_thread(parser.finalize)
+    except HTTPException:
+        await asyncio.to_thread(upload.discard)
+        raise
+    except Exception as e:
+        await asyncio.to_thread(upload.discard)
+        log.warning(f'Bad upload: {e}')
+        raise HTTPException(400, 'malformed upload')
+
+    meta = upload.json_field('metadata', {})
+    if not isinstance(meta, dict):
+        meta = {}
+    frame_index = upload.json_field('frame_index', [])
+    events = upload.json_field('events', [])
+    seg_num = _int_or_none(meta.get('segment_num')) or 0
+
+    session = session_name(meta)   # the directory and the catalog row must agree
+    rel = segment_dir(meta, session)
+    await asyncio.to_thread(
+        _store_segment, rel, seg_num, spool if upload.frames_file is not None else None,
+        {'metadata': meta, 'frame_index': frame_index, 'events': events},
+    )
+    pk = await asyncio.to_thread(
+        _catalog_write, meta, session, rel, seg_num,
+        len(frame_index) if isinstance(frame_index, list) else 0,
+        upload.frames_bytes,
+        len(events) if isinstance(events, list) else 0,
+    )
+    if meta.get('is_final'):
+        workers.submit(('compact', pk))
+    return {'ok': True, 'session': pk, 'segment': seg_num, 'bytes': upload.frames_bytes}
+
+
+def _store_segment(rel: str, seg_num: int, spool, record: dict):
+    """
+    Move the spooled frames into the session directory, then write the segment
+    JSON beside them (atomically: compaction merges any seg-*.json it sees).
+    """
+    dest = os.path.join(RECORDINGS_DIR, rel)
+    stem = os.path.join(dest, f'seg-{seg_num:04d}')
+    os.makedirs(dest, exist_ok=True)
+    if spool is not None:
+        os.replace(spool + '.part', stem + '.frames')
+    with open(stem + '.json.tmp', 'w') as f:
+        json.dump(record, f)
+    os.replace(stem + '.json.tmp', stem + '.json')
+
+
+def _catalog_write(*args) -> int:
+    db = get_catalog()
+    try:
+        return catalog_append(db, *args)
+    finally:
+        db.close()
+
+
+@app.get('/ingest/sessions')
+def list_sessions(game: str = '', limit: int = 50):
+    """Most recent recorded sessions from the catalog."""
+    db = get_catalog()
+    limit = max(1, min(limit, 500))
+    if game:
+        rows = db.execute(
+            'SELECT * FROM sessions WHERE game = ? ORDER BY last_ts DESC LIMIT ?',
+            (game, limit)
+        ).fetchall()
+    else:
+        rows = db.execute(
+            'SELECT * FROM sessions ORDER BY last_ts DESC LIMIT ?', (limit,)
+        ).fetchall()
+    db.close()
+    return [dict(r) for r in rows]
+
+
+@app.get('/ingest/stats')
+def ingest_stats():
+    db = get_catalog()
+    row = db.execute(
+        '''SELECT COUNT(*) AS sessions, COALESCE(SUM(segments), 0) AS segments,
+                  COALESCE(SUM(frames), 0) AS frames, COALESCE(SUM(bytes), 0) AS bytes
+           FROM sessions'''
+    ).fetchone()
+    db.close()
+    return {**dict(row), 'quota_bytes': QUOTA_BYTES, 'queue': workers.queue.qsize()}
+
+
+# ── Background workers ───────────────────────────────────────────────────
+
+def compact_session(pk: int):
+    """
+    Merge a session's segments into session.frames / session.json.
+    The row is claimed first (compacting = claim time), so the idle sweep and
+    an is_final job never merge the same session at once; a claim older than
+    COMPACT_CLAIM_SECONDS is taken over. The session is marked compacted only
+    if no segment was cataloged while it ran; otherwise a later sweep merges
+    the newcomer.
+    """
+    db = get_catalog()
+    try:
+        now = int(time.time())
+        claimed = db.execute(
+            'UPDATE sessions SET compacting = ? WHERE id = ? AND compacted = 0 AND compacting < ?',
+            (now, pk, now - COMPACT_CLAIM_SECONDS)
+        ).rowcount
+        row = db.execute('SELECT path, segments, bytes FROM sessions WHERE id = ?', (pk,)).fetchone()
+        db.commit()
+        if not claimed:
+            return
+        try:
+            base, merged = merge_segments(os.path.join(RECORDINGS_DIR, row['path']))
+        except BaseException:
+            db.execute('UPDATE sessions SET compacting = 0 WHERE id = ?', (pk,))
+            db.commit()
+            raise
+        # bytes: the merged blob, plus whatever segments were cataloged meanwhile
+        db.execute(
+            '''UPDATE sessions SET bytes = ? + bytes - ?, compacted = (segments = ?), compacting = 0
+               WHERE id = ?''',
+            (base, row['bytes'], row['segments'], pk)
+        )
+        db.commit()
+        log.info(f'Compacted session {pk} ({merged} segments, {base} bytes)')
+    finally:
+        db.close()
+
+
+def merge_segments(path: str) -> tuple:
+    """Fold the seg-* files in path into session.*; returns (frames bytes, segments merged)."""
+    segs = sorted(n for n in os.listdir(path) if n.startswith('seg-') and n.endswith('.json')) \
+        if os.path.isdir(path) else []
+
+    merged_index, merged_events, segments_meta = [], [], []
+    base = 0
+    tmp_frames = os.path.join(path, 'session.frames.tmp')
+    with open(tmp_frames, 'wb') as out:
+        # Late segments after an earlier compaction append to what is there
+        prev = os.path.join(path, 'session')
+        if os.path.exists(prev + '.json'):
+            with open(prev + '.json') as f:
+                done = json.load(f)
+            merged_index = done.get('frame_index', [])
+            merged_events = done.get('events', [])
+            segments_meta = done.get('segments', [])
+            if os.path.exists(prev + '.frames'):
+                with open(prev + '.frames', 'rb') as src:
+                    shutil.copyfileobj(src, out, 1024 * 1024)
+                base = os.path.getsize(prev + '.frames')
+        for name in segs:
+            stem = os.path.join(path, name[:-5])
+            with open(stem + '.json') as f:
+                seg = json.load(f)
+            if os.path.exists(stem + '.frames'):
+                with open(stem + '.frames', 'rb') as src:
+                    shutil.copyfileobj(src, out, 1024 * 1024)
+                size = os.path.getsize(stem + '.frames')
+            else:
+                size = 0
+            for fr in seg.get('frame_index') or []:
+                if isinstance(fr, dict):
+                    merged_index.append({**fr, 'offset': base + int(fr.get('offset', 0))})
+            merged_events.extend(seg.get('events') or [])
+            segments_meta.append(seg.get('metadata') or {})
+            base += size
+
+    with open(os.path.join(path, 'session.json.tmp'), 'w') as f:
+        json.dump({
+            'segments': segments_meta,
+            'frame_index': merged_index,
+            'events': merged_events,
+        }, f)
+    os.replace(tmp_frames, os.path.join(path, 'session.frames'))
+    os.replace(os.path.join(path, 'session.json.tmp'), os.path.join(path, 'session.json'))
+    for name in segs:
+        stem = os.path.join(path, name[:-5])
+        for ext in ('.json', '.frames'):
+            try:
+                os.remove(stem + ext)
+            except OSError:
+                pass
+    return base, len(segs)
+
+
+def sweep():
+    """Compact idle sessions and delete the oldest ones beyond the quota."""
+    db = get_catalog()
+    try:
+        cutoff = int(time.time()) - SESSION_IDLE_SECONDS
+        idle = [r[0] for r in db.execute(
+            'SELECT id FROM sessions WHERE compacted = 0 AND last_ts < ?', (cutoff,)
+        )]
+        for pk in idle:
+            compact_session(pk)
+
+        total = db.execute('SELECT COALESCE(SUM(bytes), 0) FROM sessions').fetchone()[0]
+        if total <= QUOTA_BYTES:
+            return
+        for row in db.execute('SELECT id, path, bytes FROM sessions ORDER BY last_ts ASC').fetchall():
+            if total <= QUOTA_BYTES:
+                break
+            shutil.rmtree(os.path.join(RECORDINGS_DIR, row['path']), ignore_errors=True)
+            db.execute('DELETE FROM segments WHERE session_pk = ?', (row['id'],))
+            db.execute('DELETE FROM sessions WHERE id = ?', (row['id'],))
+            total -= row['bytes']
+            log.info(f'Quota: removed session {row["id"]} ({row["bytes"]} bytes)')
+        db.commit()
+    finally:
+        db.close()
+
+
+class WorkerPool:
+    """asyncio queue drained by a few workers that run blocking jobs in threads."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.tasks: list[asyncio.Task] = []
+
+    def submit(self, job: tuple):
+        self.queue.put_nowait(job)
+
+    async def _run(self):
+        while True:
+            kind, arg = await self.queue.get()
+            try:
+                if kind == 'compact':
+                    await asyncio.to_thread(compact_session, arg)
+                elif kind == 'sweep':
+                    await asyncio.to_thread(sweep)
+            except Exception as e:
+                log.exception(f'Worker {kind} failed: {e}')
+            finally:
+                self.queue.task_done()
+
+    async def _ticker(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.submit(('sweep', None))
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._run()) for _ in range(self.size)]
+        self.tasks.append(asyncio.create_task(self._ticker()))
+
+    async def stop(self):
+        await self.queue.join()
+        for t in self.tasks:
+            t.cancel()
+
+
+workers = WorkerPool(WORKERS)
+
+
+@app.on_event('startup')
+async def startup():
+    os.makedirs(os.path.join(RECORDINGS_DIR, '.incoming'), exist_ok=True)
+    db = get_catalog()
+    init_catalog(db)
+    db.close()
+    workers.start()
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    await workers.stop()
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=8095)
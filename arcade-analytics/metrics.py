@@ -0,0 +1,254 @@
+"""
+Request and SQL instrumentation for the analytics API.
+
+Enabled with ARCADE_METRICS=1; when it is unset server.py neither installs
+the middleware nor the traced connection class, so nothing here runs.
+
+- MetricsMiddleware: per-route latency histograms (route template, e.g.
+  /export/{table}, not the raw path), counted from request to last body byte.
+- TracedConnection: sqlite3.Connection whose execute() times each statement
+  through to its last fetched row and counts the rows. Statements slower than
+  ARCADE_SLOW_QUERY_MS are printed with their EXPLAIN QUERY PLAN and kept in
+  a short log.
+
+Both feed one Metrics registry, served as JSON on /metrics.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+SLOW_QUERY_MS = float(os.environ.get('ARCADE_SLOW_QUERY_MS', '100'))
+SLOW_LOG_SIZE = 100
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Latency counts in fixed BUCKETS_MS upper bounds (last bucket: above all)."""
+
+    __slots__ = ('counts', 'total', 'sum_ms', 'max_ms')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.total += 1
+        self.sum_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation (max for the last one)."""
+        rank = q * self.total
+        seen = 0
+        for bound, n in zip(BUCKETS_MS, self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.total,
+            'mean_ms': round(self.sum_ms / self.total, 2) if self.total else 0,
+            'p50_ms': round(self.quantile(0.5), 2),
+            'p90_ms': round(self.quantile(0.9), 2),
+            'p99_ms': round(self.quantile(0.99), 2),
+            'max_ms': round(self.max_ms, 2),
+            'buckets': {f'le_{b}': n for b, n in zip(BUCKETS_MS, self.counts) if n}
+                       | ({'inf': self.counts[-1]} if self.counts[-1] else {}),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes: dict = {}        # 'GET /summary' → Histogram
+        self.statuses: dict = {}      # 'GET /summary' → {status: count}
+        self.statements: dict = {}    # normalized SQL → [count, total ms, max ms, rows]
+        self.slow = deque(maxlen=SLOW_LOG_SIZE)
+        self.started = time.time()
+
+    def observe_request(self, route: str, status: int, ms: float):
+        with self.lock:
+            h = self.routes.get(route)
+            if h is None:
+                h = self.routes[route] = Histogram()
+                self.statuses[route] = {}
+            h.observe(ms)
+            self.statuses[route][status] = self.statuses[route].get(status, 0) + 1
+
+    def observe_statement(self, sql: str, ms: float, rows: int):
+        with self.lock:
+            s = self.statements.get(sql)
+            if s is None:
+                s = self.statements[sql] = [0, 0.0, 0.0, 0]
+            s[0] += 1
+            s[1] += ms
+            s[2] = max(s[2], ms)
+            s[3] += rows
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            routes = {r: dict(h.to_dict(), statuses=dict(self.statuses[r])) for r, h in self.routes.items()}
+            statements = sorted(self.statements.items(), key=lambda x: x[1][1], reverse=True)
+            slow = list(self.slow)
+        return {
+            'uptime_s': int(time.time() - self.started),
+            'routes': routes,
+            'sql': [{
+                'sql': sql, 'count': n, 'total_ms': round(total, 1), 'mean_ms': round(total / n, 2),
+                'max_ms': round(mx, 2), 'rows': rows,
+            } for sql, (n, total, mx, rows) in statements],
+            'slow_queries': slow,
+            'slow_query_ms': SLOW_QUERY_MS,
+        }
+
+
+registry = Metrics()
+
+
+class MetricsMiddleware:
+    """Pure ASGI; event streams are left out (their duration is the connection's)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        status = [500, False]   # status code, is an event stream
+
+        async def send_timed(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                status[1] = any(k == b'content-type' and v.startswith(b'text/event-stream')
+                                for k, v in message['headers'])
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body') and not status[1]:
+                route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+                registry.observe_request(f'{scope["method"]} {route}', status[0],
+                                         (time.perf_counter() - t0) * 1000)
+
+        await self.app(scope, receive, send_timed)
+
+
+_WS = re.compile(r'\s+')
+
+
+class TracedCursor:
+    """Times its statement until the rows run out (or it is closed) and records it once."""
+
+    def __init__(self, conn, cursor, sql: str, params, elapsed: float):
+        self._conn = conn
+        self._cursor = cursor
+        self._sql = sql
+        self._params = params
+        self._elapsed = elapsed
+        self._rows = 0
+        self._done = cursor.description is None   # INSERT/UPDATE/DDL: finished on execute
+
+        if self._done:
+            self._rows = max(cursor.rowcount, 0)
+            self._record()
+
+    def _timed(self, fn, *args):
+        t = time.perf_counter()
+        out = fn(*args)
+        self._elapsed += time.perf_counter() - t
+        return out
+
+    def _record(self):
+        self._done = True
+        ms = self._elapsed * 1000
+        sql = _WS.sub(' ', self._sql).strip()
+        registry.observe_statement(sql, ms, self._rows)
+        if ms >= SLOW_QUERY_MS:
+            plan = self._conn.query_plan(self._sql, self._params)
+            registry.slow.append({'ts': int(time.time()), 'ms': round(ms, 1), 'rows': self._rows,
+                                  'sql': sql, 'plan': plan})
+            print(f'slow query {ms:.0f} ms, {self._rows} rows: {sql}\n  ' + ('\n  '.join(plan) or '(no plan)'))
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is None:
+            if not self._done:
+                self._record()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size: int = None):
+        rows = self._timed(self._cursor.fetchmany, size or self._cursor.arraysize)
+        self._rows += len(rows)
+        if len(rows) < (size or self._cursor.arraysize) and not self._done:
+            self._record()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._rows += len(rows)
+        if not self._done:
+            self._record()
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        if not self._done:
+            self._record()
+        self._cursor.close()
+
+    def __del__(self):
+        # The usual `db.execute(...).fetchone()` never exhausts its cursor
+        if not self._done:
+            try:
+                self._record()
+            except sqlite3.Error:
+                pass
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TracedConnection(sqlite3.Connection):
+    """sqlite3.connect(..., factory=TracedConnection) records every statement run through execute()."""
+
+    def execute(self, sql: str, params=()):
+        t = time.perf_counter()
+        cursor = super().execute(sql, params)
+        return TracedCursor(self, cursor, sql, params, time.perf_counter() - t)
+
+    def executemany(self, sql: str, seq):
+        t = time.perf_counter()
+        cursor = super().executemany(sql, seq)
+        registry.observe_statement(_WS.sub(' ', sql).strip(), (time.perf_counter() - t) * 1000,
+                                   max(cursor.rowcount, 0))
+        return cursor
+
+    def query_plan(self, sql: str, params) -> list:
+        try:
+            rows = super().execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        except sqlite3.Error as e:
+            return [f'(no plan: {e})']
+        depth = {0: 0}
+        out = []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, 0) + 1
+            out.append('  ' * (depth[node] - 1) + detail)
+        return out
@@ -7,21 +7,79 @@ Install: pip install fastapi uvicorn
 Run:     uvicorn server:app --host 0.0.0.0 --port 8093
 
 Systemd service: arcade-analytics
-Nginx proxy:
+Nginx proxy (/live streams events; the X-Accel-Buffering header keeps
+nginx from buffering them, proxy_read_timeout must exceed the keepalive):
   location /stats-api/ {
       proxy_pass http://localhost:8093/;
   }
+  location = /api/events/rating {
+      proxy_pass http://localhost:8093/events/rating;
+  }
 """
 
 import sqlite3
 import os
+import re
+import io
+import csv
+import json
+import asyncio
+import zlib
+import base64
+import hmac
 import time
+import queue
+import threading
+import urllib.parse
+from itertools import chain
 from datetime import datetime, timedelta, timezone
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+
+from bitmap import Bitmap
+from responses import CompressionMiddleware, dumps, json_response, raw_json
+from collect import init_schema, MINUTE_COUNTS_DAYS, TOPK_CAPACITY, TOPK_HOUR_DAYS
+from sketch import SpaceSaving
+from archive import hot_floor, iter_rows as archived_rows
+from snapshot import replica_path
 
 DB_FILE = os.path.join(os.path.dirname(__file__), 'arcade.db')
 
+# Optional NumPy column cache for /summary, /games and /daily (see columnar.py)
+COLUMNAR = os.environ.get('ARCADE_COLUMNAR', '') == '1'
+# Route latency histograms, SQL timings and slow-query plans on /metrics (see metrics.py)
+METRICS = os.environ.get('ARCADE_METRICS', '') == '1'
+# Long reads (/daily, /retention, exports) from the latest snapshot (see snapshot.py)
+REPLICA = os.environ.get('ARCADE_REPLICA', '') == '1'
+
+RATING_BATCH_SIZE = 500      # rows per INSERT transaction
+RATING_FLUSH_SECONDS = 0.5   # max time a rating waits in memory
+RATING_RETRY_SECONDS = 1.0   # first wait after a failed batch, doubling ...
+RATING_RETRY_MAX_SECONDS = 60.0  # ... up to this
+RATING_STOP_ATTEMPTS = 3     # tries for the last batch at shutdown
+RATING_STOP_SECONDS = 10     # shutdown waits this long for the writer, then leaves it
+RATING_QUEUE_MAX = 50000     # ratings held while the database refuses writes; then 503
+SCHEMA_RECHECK_SECONDS = 30  # how often a legacy page_views layout is looked at again
+RATING_CATEGORIES = {'bug_report', 'feature_suggestion', 'feedback', 'other'}
+SEARCH_RANK_WINDOW = 10000   # newest matches scored by bm25 per /search
+EXPORT_CHUNK_ROWS = 5000     # rows per fetchmany() while streaming an export
+COALESCE_FRESH_SECONDS = 2.0  # a finished /summary or /games result is reused this long
+LIVE_POLL_SECONDS = 2.0      # how often the /live producer checks for a collector commit
+LIVE_KEEPALIVE_SECONDS = 15  # comment line sent to idle /live streams
+LIVE_QUEUE_EVENTS = 32       # events a slow viewer may fall behind before it is dropped
+SHIP_TOKEN = os.environ.get('ARCADE_SHIP_TOKEN', '')   # shared secret for shipper.py agents
+SHIP_MAX_BYTES = 8 * 1024 * 1024        # compressed log batch
+SHIP_MAX_RAW_BYTES = 64 * 1024 * 1024   # the same batch decompressed
+NODE_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+# Exportable tables → (source, columns); game filter only where there is one
+EXPORT_TABLES = {
+    'page_views': ('page_views_named', ('id', 'ts', 'game', 'visitor_id')),
+    'referrals': ('referrals', ('id', 'ts', 'room_code', 'date')),
+    'ratings': ('ratings', ('id', 'ts', 'game', 'stars', 'category', 'text')),
+}
+
 app = FastAPI(title='OpenArcade Analytics')
 
 app.add_middleware(
@@ -30,11 +88,28 @@ app.add_middleware(
     allow_methods=['GET'],
     allow_headers=['*'],
 )
+app.add_middleware(CompressionMiddleware)
+
+if METRICS:
+    from metrics import MetricsMiddleware, TracedConnection, registry as metrics_registry
+    app.add_middleware(MetricsMiddleware)   # outermost: the timing includes compression
 
 
-def get_db():
-    db = sqlite3.connect(DB_FILE)
-    db.row_factory = sqlite3.Row
+def get_db(row_factory=sqlite3.Row, replica=False, any_thread=False):
+    """row_factory=None gives plain tuples, the cheapest rows to turn into JSON.
+
+    replica=True reads the latest snapshot instead when ARCADE_REPLICA is on
+    and one is fresh: up to a cron interval behind, never in the writers' way.
+    any_thread=True for connections driven from a streaming generator, whose
+    steps Starlette runs on whichever threadpool worker is free (one at a time)."""
+    factory = TracedConnection if METRICS else sqlite3.Connection
+    path = replica_path() if replica and REPLICA else None
+    if path:
+        db = sqlite3.connect(f'file:{urllib.parse.quote(path)}?mode=ro&immutable=1', uri=True,
+                             factory=factory, check_same_thread=not any_thread)
+    else:
+        db = sqlite3.connect(DB_FILE, factory=factory, check_same_thread=not any_thread)
+    db.row_factory = row_factory
     return db
 
 
@@ -46,34 +121,35 @@ def days_ago_str(n: int) -> str:
     return (datetime.now(timezone.utc) - timedelta(days=n)).strftime('%Y-%m-%d')
 
 
+def days_ago_ts(n: int) -> int:
+    """Unix time of 00:00 UTC n days ago (page_views has no date column)."""
+    return (int(time.time()) // 86400 - n) * 86400
+
+
+def day_str(day: int) -> str:
+    return datetime.fromtimestamp(day * 86400, timezone.utc).strftime('%Y-%m-%d')
+
+
 @app.get('/summary')
 def summary():
     """DAU, WAU, MAU, top 10 games, K-factor today."""
-    db = get_db()
-    today = today_str()
-    week_ago = days_ago_str(7)
-    month_ago = days_ago_str(30)
+    return raw_json(coalescer.do('summary', lambda: dumps(_summary())))
 
-    # Unique daily active users (distinct ip_hash per day)
-    dau = db.execute(
-        'SELECT COUNT(DISTINCT ip_hash) FROM page_views WHERE date = ?', (today,)
-    ).fetchone()[0]
 
-    wau = db.execute(
-        'SELECT COUNT(DISTINCT ip_hash) FROM page_views WHERE date >= ?', (week_ago,)
-    ).fetchone()[0]
-
-    mau = db.execute(
-        'SELECT COUNT(DISTINCT ip_hash) FROM page_views WHERE date >= ?', (month_ago,)
-    ).fetchone()[0]
+def _summary():
+    db = get_db()
+    today = today_str()
+    today_ts = days_ago_ts(0)
 
-    # Top 10 games by views today
-    top_rows = db.execute(
-        '''SELECT game, COUNT(*) as views
-           FROM page_views WHERE date = ?
-           GROUP BY game ORDER BY views DESC LIMIT 10''',
-        (today,)
-    ).fetchall()
+    if column_store is not None:
+        dau = column_store.distinct_visitors(today_ts)
+        wau = column_store.distinct_visitors(days_ago_ts(7))
+        mau = column_store.distinct_visitors(days_ago_ts(30))
+        names = dict(db.execute('SELECT id, name FROM games').fetchall())
+        top = sorted(column_store.views_by_game(today_ts).items(), key=lambda x: x[1], reverse=True)
+        top_rows = [{'game': names.get(gid), 'views': n} for gid, n in top[:10]]
+    else:
+        dau, wau, mau, top_rows = _summary_sql(db, today_ts)
     top_games = [{'game': r['game'], 'views': r['views']} for r in top_rows]
 
     # K-factor: referrals (co-op room joins) / DAU today
@@ -94,75 +170,265 @@ def summary():
     }
 
 
+def _summary_sql(db, today_ts: int) -> tuple:
+    # Unique daily active users (distinct visitors per day)
+    dau = db.execute(
+        'SELECT COUNT(DISTINCT visitor_id) FROM page_views WHERE ts >= ?', (today_ts,)
+    ).fetchone()[0]
+
+    wau = db.execute(
+        'SELECT COUNT(DISTINCT visitor_id) FROM page_views WHERE ts >= ?', (days_ago_ts(7),)
+    ).fetchone()[0]
+
+    mau = db.execute(
+        'SELECT COUNT(DISTINCT visitor_id) FROM page_views WHERE ts >= ?', (days_ago_ts(30),)
+    ).fetchone()[0]
+
+    # Top 10 games by views today: the collector's sketch for the day
+    sketch = top_sketch(db, 'game', today_ts, today_ts + 86400)
+    top_rows = [{'game': game, 'views': views} for game, views, _ in sketch.top(10)]
+    return dau, wau, mau, top_rows
+
+
+def top_sketch(db, dim: str, start_ts: int, end_ts: int) -> SpaceSaving:
+    """
+    Merged top-k sketch for [start_ts, end_ts): daily sketches for the whole
+    days inside, hourly ones for the ragged ends (whole days again where the
+    hourly ones have been pruned).
+    """
+    first_day, end_day = -(-start_ts // 86400), end_ts // 86400
+    hour_floor = (int(time.time()) - TOPK_HOUR_DAYS * 86400) // 3600 + 1
+    if start_ts // 3600 < hour_floor:
+        first_day = start_ts // 86400
+    spans = []   # (res, first bucket, end bucket)
+    if first_day < end_day:
+        spans.append(('d', first_day, end_day))
+        spans.append(('h', start_ts // 3600, first_day * 24))
+        spans.append(('h', end_day * 24, -(-end_ts // 3600)))
+    else:
+        spans.append(('h', start_ts // 3600, -(-end_ts // 3600)))
+    blobs = chain.from_iterable(db.execute(
+        'SELECT sketch FROM topk WHERE dim = ? AND res = ? AND bucket >= ? AND bucket < ?', (dim, *span)
+    ) for span in spans if span[1] < span[2])
+    return SpaceSaving.merge_all((SpaceSaving.from_bytes(b) for (b,) in blobs), TOPK_CAPACITY)
+
+
+@app.get('/top')
+def top(
+    dim: str = Query(default='game', pattern='^game$'),
+    hours: int = Query(default=24, ge=1, le=24 * 366, description='Window ending now'),
+    start: str = Query(default='', description='Or: first day, YYYY-MM-DD (UTC, inclusive)'),
+    end: str = Query(default='', description='Last day, YYYY-MM-DD (UTC, inclusive; default today)'),
+    limit: int = Query(default=10, ge=1, le=100),
+):
+    """
+    Most viewed keys over any window (rounded out to whole hours), from the
+    collector's mergeable top-k sketches. Counts are exact while the window
+    has no more than TOPK_CAPACITY distinct keys; otherwise each is an
+    overcount by at most its `error`.
+    """
+    now = int(time.time())
+    if start:
+        start_ts = _day_ts(start)
+        end_ts = _day_ts(end) + 86400 if end else now
+    else:
+        start_ts, end_ts = now - hours * 3600, now
+    db = get_db(None)
+    sketch = top_sketch(db, dim, start_ts, end_ts)
+    db.close()
+    return {
+        'dim': dim,
+        'start': start_ts,
+        'end': end_ts,
+        'total': sketch.total,
+        'top': [{dim: key, 'views': views, 'error': error} for key, views, error in sketch.top(limit)],
+    }
+
+
 @app.get('/daily')
 def daily(days: int = Query(default=30, ge=1, le=365)):
     """DAU per day for the last N days."""
-    db = get_db()
+    db = get_db(row_factory=None, replica=True)
     start = days_ago_str(days)
 
+    # Days before the hot floor were archived (archive.py); their counts
+    # were kept in archive_days when the segment was written
+    floor_day = hot_floor(db) // 86400
     rows = db.execute(
-        '''SELECT date, COUNT(DISTINCT ip_hash) as dau
-           FROM page_views WHERE date >= ?
-           GROUP BY date ORDER BY date ASC''',
-        (start,)
+        'SELECT day, visitors FROM archive_days WHERE day >= ? AND day < ? ORDER BY day',
+        (days_ago_ts(days) // 86400, floor_day)
     ).fetchall()
+    hot_start = max(days_ago_ts(days), floor_day * 86400)
+    if column_store is not None:
+        rows += column_store.daily_visitors(hot_start)
+    else:
+        rows += db.execute(
+            '''SELECT ts / 86400 AS day, COUNT(DISTINCT visitor_id)
+               FROM page_views WHERE ts >= ?
+               GROUP BY day ORDER BY day ASC''',
+            (hot_start,)
+        ).fetchall()
 
-    referral_rows = db.execute(
+    referral_map = dict(db.execute(
         '''SELECT date, COUNT(*) as count
            FROM referrals WHERE date >= ?
            GROUP BY date ORDER BY date ASC''',
         (start,)
-    ).fetchall()
-    referral_map = {r['date']: r['count'] for r in referral_rows}
+    ).fetchall())
+    db.close()
 
     result = []
-    for r in rows:
-        result.append({
-            'date': r['date'],
-            'dau': r['dau'],
-            'new_referrals': referral_map.get(r['date'], 0),
+    for day, dau in rows:
+        date = day_str(day)
+        result.append({'date': date, 'dau': dau, 'new_referrals': referral_map.get(date, 0)})
+    return json_response(result)
+
+
+@app.get('/retention')
+def retention(
+    days: int = Query(default=30, ge=1, le=365, description='Cohorts for the last N days'),
+    game: str = Query(default='', description='Single game (empty = whole site)'),
+    offsets: str = Query(default='1,7,30', description='Comma-separated day offsets'),
+):
+    """
+    Cohort retention: of visitors first seen on day D (on `game`, if given),
+    how many came back on D+k. Answered from the per-day visitor bitmaps.
+    """
+    try:
+        ks = sorted({int(k) for k in offsets.split(',') if k.strip()})
+    except ValueError:
+        raise HTTPException(400, 'offsets must be integers')
+    if not ks or ks[0] < 1 or ks[-1] > 365:
+        raise HTTPException(400, 'offsets must be between 1 and 365')
+
+    db = get_db(replica=True)
+    maps = {r['day']: Bitmap.from_bytes(r['bitmap']) for r in db.execute(
+        'SELECT day, bitmap FROM visitor_bitmaps WHERE game = ? ORDER BY day', (game,)
+    )}
+    db.close()
+
+    today = int(time.time()) // 86400
+    first = today - days + 1
+    seen = Bitmap()
+    cohorts = []
+    # "New" needs every earlier day, so walk the full history once
+    for day in sorted(d for d in maps if d <= today):
+        cohort = maps[day] - seen
+        seen |= maps[day]
+        if day < first:
+            continue
+        retained = {}
+        rate = {}
+        for k in ks:
+            if day + k > today:
+                retained[k] = rate[k] = None
+                continue
+            back = maps.get(day + k)
+            retained[k] = cohort.and_len(back) if back else 0
+            rate[k] = round(retained[k] / len(cohort), 4) if cohort else 0.0
+        cohorts.append({
+            'date': day_str(day),
+            'new_visitors': len(cohort),
+            'retained': retained,
+            'rate': rate,
         })
 
+    return {'game': game, 'offsets': ks, 'cohorts': cohorts}
+
+
+@app.get('/timeseries')
+def timeseries(
+    hours: int = Query(default=24, ge=1, le=24 * 365, description='Window ending now'),
+    game: str = Query(default='', description='Single game (empty = all)'),
+    resolution: str = Query(default='auto', pattern='^(auto|minute|hour)$'),
+    max_points: int = Query(default=500, ge=10, le=5000),
+):
+    """
+    Page views over time from the per-minute / per-hour counters.
+    Buckets are widened to whole multiples of the base resolution so that at
+    most `max_points` come back; empty buckets are returned as 0.
+    """
+    end = int(time.time())
+    start = end - hours * 3600
+    if resolution == 'auto':
+        # Minute counters while buckets would be under an hour anyway
+        resolution = 'minute' if hours < max_points else 'hour'
+    if hours > MINUTE_COUNTS_DAYS * 24:
+        resolution = 'hour'
+    base = 60 if resolution == 'minute' else 3600
+    table = 'views_minute' if resolution == 'minute' else 'views_hour'
+
+    first, last = start // base, end // base
+    factor = max(1, -(-(last - first + 1) // max_points))  # ceil division
+    first -= first % factor
+
+    db = get_db()
+    rows = db.execute(
+        f'''SELECT bucket / ? AS b, SUM(views) FROM {table}
+            WHERE game = ? AND bucket BETWEEN ? AND ?
+            GROUP BY b''',
+        (factor, game, first, last)
+    ).fetchall()
     db.close()
-    return result
+
+    counts = {r[0]: r[1] for r in rows}
+    points = [[b * factor * base, counts.get(b, 0)]
+              for b in range(first // factor, last // factor + 1)]
+    return {
+        'game': game,
+        'resolution': resolution,
+        'bucket_seconds': factor * base,
+        'points': points,
+    }
 
 
 @app.get('/games')
 def games():
     """Per-game views: today, 7d, 30d."""
+    return raw_json(coalescer.do('games', lambda: dumps(_games())))
+
+
+def _games():
     db = get_db()
-    today = today_str()
-    week_ago = days_ago_str(7)
-    month_ago = days_ago_str(30)
-
-    rows_30 = db.execute(
-        '''SELECT game, COUNT(*) as views
-           FROM page_views WHERE date >= ?
-           GROUP BY game ORDER BY views DESC''',
-        (month_ago,)
-    ).fetchall()
+    names = dict(db.execute('SELECT id, name FROM games').fetchall())
+
+    if column_store is not None:
+        counts = [column_store.views_by_game(days_ago_ts(n)) for n in (30, 7, 0)]
+        db.close()
+        return sorted((
+            {'game': names.get(gid), 'views_today': counts[2].get(gid, 0),
+             'views_7d': counts[1].get(gid, 0), 'views_30d': n}
+            for gid, n in counts[0].items()
+        ), key=lambda x: x['views_30d'], reverse=True)
+
+    rows_30 = [{'game': names.get(gid), 'views': n} for gid, n in db.execute(
+        '''SELECT game_id, COUNT(*) as views
+           FROM page_views WHERE ts >= ?
+           GROUP BY game_id ORDER BY views DESC''',
+        (days_ago_ts(30),)
+    )]
 
     # Build per-game dicts
     game_map = {}
     for r in rows_30:
         game_map[r['game']] = {'game': r['game'], 'views_today': 0, 'views_7d': 0, 'views_30d': r['views']}
 
-    rows_7 = db.execute(
-        '''SELECT game, COUNT(*) as views
-           FROM page_views WHERE date >= ?
-           GROUP BY game''',
-        (week_ago,)
-    ).fetchall()
+    rows_7 = [{'game': names.get(gid), 'views': n} for gid, n in db.execute(
+        '''SELECT game_id, COUNT(*) as views
+           FROM page_views WHERE ts >= ?
+           GROUP BY game_id''',
+        (days_ago_ts(7),)
+    )]
     for r in rows_7:
         if r['game'] in game_map:
             game_map[r['game']]['views_7d'] = r['views']
 
-    rows_1 = db.execute(
-        '''SELECT game, COUNT(*) as views
-           FROM page_views WHERE date = ?
-           GROUP BY game''',
-        (today,)
-    ).fetchall()
+    rows_1 = [{'game': names.get(gid), 'views': n} for gid, n in db.execute(
+        '''SELECT game_id, COUNT(*) as views
+           FROM page_views WHERE ts >= ?
+           GROUP BY game_id''',
+        (days_ago_ts(0),)
+    )]
     for r in rows_1:
         if r['game'] in game_map:
             game_map[r['game']]['views_today'] = r['views']
@@ -171,14 +437,82 @@ def games():
     return sorted(game_map.values(), key=lambda x: x['views_30d'], reverse=True)
 
 
+@app.get('/trending')
+def trending(
+    window: str = Query(default='1h', pattern='^(1h|6h|24h)$', description='Half-life of the recent rate'),
+    limit: int = Query(default=20, ge=1, le=200),
+):
+    """
+    Games ranked by how far their recent view rate runs above their own 7-day
+    baseline (z-score). Precomputed by the collector on every run.
+    """
+    db = get_db()
+    rows = db.execute(
+        f'''SELECT game, z_{window} AS z, rate_{window} AS rate, rate_7d, updated_at
+            FROM trending ORDER BY z_{window} DESC LIMIT ?''',
+        (limit,)
+    ).fetchall()
+    db.close()
+    return [{
+        'game': r['game'],
+        'z': round(r['z'], 2),
+        'views_per_hour': round(r['rate'], 2),
+        'baseline_per_hour': round(r['rate_7d'], 2),
+        'updated_at': r['updated_at'],
+    } for r in rows]
+
+
+@app.get('/sessions')
+def sessions(days: int = Query(default=30, ge=1, le=365)):
+    """
+    Visits per day (by start), as closed by the collector's sessionizer:
+    games and page views per visit, mean length, and the single-page share.
+    """
+    db = get_db(None)
+    rows = db.execute(
+        '''SELECT start_ts / 86400, COUNT(*), AVG(views), AVG(games), AVG(end_ts - start_ts), SUM(views = 1)
+           FROM sessions WHERE start_ts >= ? GROUP BY 1 ORDER BY 1''',
+        (days_ago_ts(days - 1),)
+    ).fetchall()
+    db.close()
+    return json_response([{
+        'date': day_str(day),
+        'sessions': n,
+        'views_per_session': round(views, 2),
+        'games_per_session': round(games, 2),
+        'avg_length_s': round(length),
+        'single_page_share': round(single / n, 3),
+    } for day, n, views, games, length, single in rows])
+
+
+@app.get('/bots')
+def bots(days: int = Query(default=30, ge=1, le=365)):
+    """Game page hits the collector's bot filter kept out of page_views, per day and reason."""
+    db = get_db(None)
+    rows = db.execute(
+        'SELECT day, reason, views FROM filtered_views WHERE day >= ? ORDER BY day',
+        (days_ago_ts(days - 1) // 86400,)
+    ).fetchall()
+    db.close()
+    out = {}
+    for day, reason, views in rows:
+        d = out.setdefault(day, {'date': day_str(day), 'ua': 0, 'rate': 0, 'flagged': 0})
+        d[reason] = views
+    return list(out.values())
+
+
 @app.get('/feedback')
+@app.get('/list')
 def feedback(
+    request: Request,
+    response: Response,
     game: str = Query(default='', description='Filter by game (empty = all)'),
     stars: int = Query(default=0, ge=0, le=5, description='Filter by stars (0 = all)'),
-    limit: int = Query(default=100, ge=1, le=500)
+    limit: int = Query(default=100, ge=1, le=500),
+    cursor: str = Query(default='', description='Next-page cursor from the Link header'),
 ):
-    """Recent feedback/ratings."""
-    db = get_db()
+    """Recent feedback/ratings, newest first. Further pages via the Link header."""
+    db = get_db(row_factory=None)
     conditions = []
     params = []
 
@@ -189,32 +523,316 @@ def feedback(
         conditions.append('stars = ?')
         params.append(stars)
 
+    rows = keyset_page(
+        db, 'SELECT id, ts, game, stars, category, text FROM ratings',
+        conditions, params, cursor, limit, request, response
+    )
+    db.close()
+
+    now = int(time.time())
+    return json_response([
+        {'id': i, 'ts': ts, 'game': g, 'stars': st, 'category': c, 'text': t, 'ago': _time_ago(ts, now)}
+        for i, ts, g, st, c, t in rows
+    ], response)
+
+
+@app.get('/page-views')
+def page_views(
+    request: Request,
+    response: Response,
+    game: str = Query(default='', description='Filter by game (empty = all)'),
+    limit: int = Query(default=500, ge=1, le=5000),
+    cursor: str = Query(default='', description='Next-page cursor from the Link header'),
+):
+    """Raw page view rows, newest first (hot table; archived months via /export)."""
+    db = get_db(row_factory=None)
+    conditions, params = (['game = ?'], [game]) if game else ([], [])
+    rows = keyset_page(
+        db, 'SELECT id, ts, game, visitor_id FROM page_views_named',
+        conditions, params, cursor, limit, request, response
+    )
+    db.close()
+    return json_response([
+        {'id': i, 'ts': ts, 'game': g, 'visitor_id': v} for i, ts, g, v in rows
+    ], response)
+
+
+@app.get('/referrals')
+def referrals(
+    request: Request,
+    response: Response,
+    limit: int = Query(default=500, ge=1, le=5000),
+    cursor: str = Query(default='', description='Next-page cursor from the Link header'),
+):
+    """Raw referral (co-op room join) rows, newest first."""
+    db = get_db(row_factory=None)
+    rows = keyset_page(
+        db, 'SELECT id, ts, room_code, date FROM referrals',
+        [], [], cursor, limit, request, response
+    )
+    db.close()
+    return json_response([
+        {'id': i, 'ts': ts, 'room_code': rc, 'date': d} for i, ts, rc, d in rows
+    ], response)
+
+
+def encode_cursor(ts: int, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f'{ts}.{row_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        ts, row_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('.')
+        return int(ts), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(400, 'invalid cursor')
+
+
+def keyset_page(db, select: str, conditions: list, params: list, cursor: str,
+                limit: int, request: Request, response: Response) -> list:
+    """
+    One page of `select` (whose first two columns must be id, ts) ordered by
+    (ts, id) DESC, starting after `cursor`.
+    The (ts, id) row-value bound is an index range seek, so every page costs
+    the same however deep it is. If more rows follow, the next cursor goes out
+    in `Link: <...>; rel="next"` and `X-Next-Cursor` (the body stays a list).
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if cursor:
+        conditions.append('(ts, id) < (?, ?)')
+        params.extend(decode_cursor(cursor))
     where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+    rows = db.execute(
+        f'{select} {where} ORDER BY ts DESC, id DESC LIMIT ?', params + [limit + 1]
+    ).fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        nxt = encode_cursor(rows[-1][1], rows[-1][0])
+        url = request.url.include_query_params(cursor=nxt)
+        response.headers['Link'] = f'<?{url.query}>; rel="next"'  # relative: works behind /stats-api/
+        response.headers['X-Next-Cursor'] = nxt
+    return rows
+
+
+@app.get('/search')
+def search_feedback(
+    q: str = Query(..., min_length=1, description='Words to find; a trailing * matches prefixes'),
+    game: str = Query(default='', description='Filter by game (empty = all)'),
+    stars: int = Query(default=0, ge=0, le=5, description='Filter by stars (0 = all)'),
+    category: str = Query(default='', description='Filter by category (empty = all)'),
+    limit: int = Query(default=50, ge=1, le=500)
+):
+    """Full-text feedback search, best matches first, with highlighted snippets."""
+    terms = _fts_terms(q)
+    if not terms:
+        return []
+    match = ' '.join(f'"{t[:-1]}"*' if t.endswith('*') else f'"{t}"' for t in terms)
+
+    db = get_db(row_factory=None)
+    conditions = ['ratings_fts MATCH ?']
+    params = [match]
+    if game:
+        conditions.append('r.game = ?')
+        params.append(game)
+    if stars > 0:
+        conditions.append('r.stars = ?')
+        params.append(stars)
+    if category:
+        conditions.append('r.category = ?')
+        params.append(category)
+
+    # Ranking costs one bm25() per matching row. For very common words only
+    # the newest SEARCH_RANK_WINDOW matches are ranked: walking the doclist
+    # backwards to find the cut-off rowid is cheap, scoring all of it is not.
+    # The window is taken after the filters, so it never hides a filtered match.
+    floor = db.execute(
+        f'''SELECT ratings_fts.rowid FROM ratings_fts JOIN ratings r ON r.id = ratings_fts.rowid
+           WHERE {' AND '.join(conditions)}
+           ORDER BY ratings_fts.rowid DESC LIMIT 1 OFFSET ?''',
+        params + [SEARCH_RANK_WINDOW]
+    ).fetchone()
+    if floor:
+        conditions.append('ratings_fts.rowid > ?')
+        params.append(floor[0])
     params.append(limit)
 
     rows = db.execute(
-        f'SELECT ts, game, stars, category, text FROM ratings {where} ORDER BY ts DESC LIMIT ?',
+        f'''SELECT r.id, r.ts, r.game, r.stars, r.category, r.text, bm25(ratings_fts) AS score
+           FROM ratings_fts JOIN ratings r ON r.id = ratings_fts.rowid
+           WHERE {' AND '.join(conditions)}
+           ORDER BY score LIMIT ?''',
         params
     ).fetchall()
+    db.close()
 
-    result = []
-    for r in rows:
-        result.append({
-            'ts': r['ts'],
-            'game': r['game'],
-            'stars': r['stars'],
-            'category': r['category'],
-            'text': r['text'],
-            'ago': _time_ago(r['ts']),
-        })
+    now = int(time.time())
+    return json_response([{
+        'id': i, 'ts': ts, 'game': g, 'stars': st, 'category': c, 'text': t,
+        'snippet': _snippet(t, terms),
+        'score': round(-score, 3),
+        'ago': _time_ago(ts, now),
+    } for i, ts, g, st, c, t, score in rows])
+
+
+def _fts_terms(q: str) -> list:
+    """Words of a free-text query, quoted later so FTS5 syntax can never error."""
+    return re.findall(r'\w+\*?', q.lower())[:16]
+
+
+def _snippet(text: str, terms: list, width: int = 16) -> str:
+    """
+    Window of `width` words around the first hit, hits wrapped in [ ].
+    Done here rather than with FTS5 snippet(), which would have to re-run
+    the MATCH per returned row (slow for prefix queries).
+    """
+    words = (text or '').split()
+    stems = tuple(t.rstrip('*') for t in terms)
+    hits = [i for i, w in enumerate(words) if w.lower().strip('.,!?;:"\'()').startswith(stems)]
+    start = max(0, min(hits[0] - width // 4, len(words) - width)) if hits else 0
+    out = [f'[{w}]' if i in hits else w for i, w in enumerate(words[start:start + width], start)]
+    return ('…' if start > 0 else '') + ' '.join(out) + ('…' if start + width < len(words) else '')
 
+
+@app.get('/ratings')
+def ratings_summary(game: str = Query(default='', description='Single game (empty = all)')):
+    """Per-game star averages and histograms from the running aggregates."""
+    db = get_db()
+    if game:
+        rows = db.execute('SELECT * FROM rating_aggregates WHERE game = ?', (game,)).fetchall()
+    else:
+        rows = db.execute('SELECT * FROM rating_aggregates ORDER BY count DESC').fetchall()
     db.close()
-    return result
+    return [{
+        'game': r['game'],
+        'count': r['count'],
+        'avg_stars': round(r['sum'] / r['count'], 2) if r['count'] else None,
+        'histogram': [r['s1'], r['s2'], r['s3'], r['s4'], r['s5']],
+    } for r in rows]
 
 
-def _time_ago(ts: int) -> str:
-    now = int(time.time())
-    diff = now - ts
+@app.get('/export/{table}')
+def export(
+    table: str,
+    fmt: str = Query(default='ndjson', pattern='^(ndjson|csv)$'),
+    start: str = Query(default='', description='First day, YYYY-MM-DD (UTC, inclusive)'),
+    end: str = Query(default='', description='Last day, YYYY-MM-DD (UTC, inclusive)'),
+    game: str = Query(default='', description='Filter by game (empty = all)'),
+    gzip: bool = Query(default=False, description='Compress the stream on the fly'),
+):
+    """Stream a raw table as NDJSON or CSV. Memory use is flat in the row count.
+
+    page_views ranges older than the hot table are read from the archived
+    month segments first (one segment in memory at a time). With
+    ARCADE_REPLICA=1 the export comes from the latest snapshot."""
+    if table not in EXPORT_TABLES:
+        raise HTTPException(404, f'unknown table {table!r}')
+    source, columns = EXPORT_TABLES[table]
+
+    conditions = []
+    params = []
+    if start:
+        conditions.append('ts >= ?')
+        params.append(_day_ts(start))
+    if end:
+        conditions.append('ts < ?')
+        params.append(_day_ts(end) + 86400)
+    if game:
+        if 'game' not in columns:
+            raise HTTPException(400, f'{table} has no game column')
+        conditions.append('game = ?')
+        params.append(game)
+    where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    sql = f'SELECT {", ".join(columns)} FROM {source} {where} ORDER BY ts, id'
+
+    chunks = _sql_chunks(sql, params)
+    if table == 'page_views':
+        chunks = chain(_archived_chunks(start, end, game), chunks)
+    body = _export_rows(chunks, columns, fmt)
+    if gzip:
+        body = _gzip_stream(body)
+
+    name = f'{table}-{start or "all"}-{end or today_str()}.{fmt}' + ('.gz' if gzip else '')
+    media = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+    return StreamingResponse(
+        body,
+        media_type='application/gzip' if gzip else media,
+        headers={'Content-Disposition': f'attachment; filename="{name}"'},
+    )
+
+
+def _day_ts(day: str) -> int:
+    try:
+        return int(datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
+    except ValueError:
+        raise HTTPException(400, f'bad date {day!r}, expected YYYY-MM-DD')
+
+
+def _sql_chunks(sql: str, params: list):
+    """Generator: lists of up to EXPORT_CHUNK_ROWS rows, straight off the cursor."""
+    db = get_db(row_factory=None, replica=True, any_thread=True)
+    try:
+        cur = db.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            yield rows
+    finally:
+        db.close()
+
+
+def _archived_chunks(start: str, end: str, game: str):
+    """Archived page_views in [start, end] as (id, ts, game, visitor_id) chunks."""
+    db = get_db(row_factory=None, replica=True, any_thread=True)
+    try:
+        floor = hot_floor(db)
+        start_ts = _day_ts(start) if start else 0
+        end_ts = min(_day_ts(end) + 86400, floor) if end else floor
+        if start_ts >= end_ts:
+            return
+        names = dict(db.execute('SELECT id, name FROM games').fetchall())
+        game_id = None
+        if game:
+            game_id = next((gid for gid, name in names.items() if name == game), -1)
+        for rows in archived_rows(db, start_ts, end_ts, game_id, EXPORT_CHUNK_ROWS):
+            yield [(r[0], r[1], names.get(r[2]), r[3]) for r in rows]
+    finally:
+        db.close()
+
+
+def _export_rows(chunks, columns: tuple, fmt: str):
+    """Generator: each chunk of rows encoded as NDJSON or CSV."""
+    buf = io.StringIO()
+    writer = csv.writer(buf) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(columns)
+    for rows in chunks:
+        if writer:
+            writer.writerows(rows)
+        else:
+            for r in rows:
+                buf.write(json.dumps(dict(zip(columns, r)), separators=(',', ':')))
+                buf.write('\n')
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def _gzip_stream(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def _time_ago(ts: int, now: int = None) -> str:
+    diff = (now or int(time.time())) - ts
     if diff < 60:
         return f'{diff}s ago'
     elif diff < 3600:
@@ -239,6 +857,574 @@ def log_referral(room_code: str = Query(...)):
     return {'ok': True}
 
 
+class RatingWriter:
+    """
+    Buffers incoming ratings and writes them in batches from one thread.
+    Each batch inserts the rows and folds their stars into rating_aggregates
+    in the same transaction, so averages never need a scan of ratings. A
+    batch the database refuses is retried, not dropped, while up to
+    RATING_QUEUE_MAX ratings wait behind it; /health reports failures, and a
+    full queue or a writer thread that died turns ratings away with 503.
+    A row whose rating_key is already stored updates it instead (the widget
+    beacons the stars, then posts them again with the text), moving its
+    stars from the old count to the new one.
+    """
+
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue(maxsize=RATING_QUEUE_MAX)
+        self.stopping = threading.Event()
+        self.thread = None
+        self.written = 0
+        self.failures = 0        # flush attempts that raised
+        self.retrying = False    # the current batch has failed at least once
+        self.last_error = None   # (unix time, message) of the latest failure
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='rating-writer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join(RATING_STOP_SECONDS)
+        if self.thread.is_alive():
+            print(f'rating writer: still busy after {RATING_STOP_SECONDS:g}s, '
+                  f'leaving {self.queue.qsize()} queued ratings behind')
+
+    def submit(self, row: tuple) -> bool:
+        """Queue a rating; False when the backlog is full (the database has been refusing writes)."""
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            return False
+        return True
+
+    def alive(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def health(self) -> dict:
+        return {
+            'alive': self.alive(),
+            'retrying': self.retrying,
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'failures': self.failures,
+            'last_error': self.last_error and {'ts': self.last_error[0], 'error': self.last_error[1]},
+        }
+
+    def _run(self):
+        try:
+            self._loop()
+        except BaseException as e:
+            self.last_error = (int(time.time()), f'writer stopped: {e!r}')
+            raise
+
+    def _loop(self):
+        db = sqlite3.connect(DB_FILE, timeout=30)
+        while not (self.stopping.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=RATING_FLUSH_SECONDS)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + RATING_FLUSH_SECONDS
+            while len(batch) < RATING_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if not self._write(db, batch):
+                print(f'rating writer: {len(batch) + self.queue.qsize()} ratings dropped at shutdown')
+                break
+        db.close()
+
+    def _write(self, db, batch: list) -> bool:
+        """
+        Flush the batch, retrying with backoff while the database refuses it
+        (locked, disk full); the batch is kept, new ratings queue up behind it
+        until the queue is full. Once stop() is called it gives up after
+        RATING_STOP_ATTEMPTS tries and returns False.
+        """
+        delay = RATING_RETRY_SECONDS
+        attempts = 0
+        while True:
+            try:
+                self._flush(db, batch)
+                self.retrying = False
+                return True
+            except sqlite3.Error as e:
+                attempts += 1
+                self.failures += 1
+                self.last_error = (int(time.time()), repr(e))
+                self.retrying = True
+                if self.stopping.is_set() and attempts >= RATING_STOP_ATTEMPTS:
+                    return False
+                print(f'rating writer: {e!r}, keeping {len(batch)} ratings, retry in {delay:g}s')
+                self.stopping.wait(delay)   # stop() cuts the wait short
+                delay = min(delay * 2, RATING_RETRY_MAX_SECONDS)
+
+    def _flush(self, db, batch: list):
+        deltas = {}
+
+        def count(game, stars, n):
+            d = deltas.setdefault(game, [0, 0, 0, 0, 0, 0, 0])
+            d[0] += n
+            d[1] += n * stars
+            d[1 + stars] += n
+
+        with db:
+            for ts, game, stars, category, text, key in batch:
+                old = key and db.execute(
+                    'SELECT id, game, stars FROM ratings WHERE rating_key = ?', (key,)
+                ).fetchone()
+                if old:
+                    rid, game, old_stars = old
+                    if stars is None:
+                        stars = old_stars
+                    db.execute(
+                        '''UPDATE ratings SET stars = ?, category = COALESCE(?, category),
+                               text = COALESCE(?, text) WHERE id = ?''',
+                        (stars, category, text, rid)
+                    )
+                    if old_stars is not None:
+                        count(game, old_stars, -1)
+                else:
+                    db.execute(
+                        'INSERT INTO ratings (ts, game, stars, category, text, rating_key) VALUES (?, ?, ?, ?, ?, ?)',
+                        (ts, game, stars, category, text, key)
+                    )
+                if stars is not None:
+                    count(game, stars, 1)
+            db.executemany(
+                '''INSERT INTO rating_aggregates (game, count, sum, s1, s2, s3, s4, s5)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (game) DO UPDATE SET
+                       count = count + excluded.count, sum = sum + excluded.sum,
+                       s1 = s1 + excluded.s1, s2 = s2 + excluded.s2, s3 = s3 + excluded.s3,
+                       s4 = s4 + excluded.s4, s5 = s5 + excluded.s5''',
+                [(game, *d) for game, d in deltas.items() if any(d)]
+            )
+        self.written += len(batch)
+
+
+rating_writer = RatingWriter()
+
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time. Callers arriving while it
+    runs wait for it and share its result instead of repeating the query;
+    a result also answers later callers for fresh_seconds after it finished.
+    Errors reach every waiter and are not kept.
+    """
+
+    def __init__(self, fresh_seconds: float):
+        self.fresh_seconds = fresh_seconds
+        self.lock = threading.Lock()
+        self.in_flight: dict = {}   # key → [Event, result, error]
+        self.finished: dict = {}    # key → (monotonic time, result)
+        self.stats = {'requests': 0, 'executed': 0, 'coalesced': 0, 'fresh_hits': 0, 'errors': 0}
+
+    def do(self, key, fn):
+        with self.lock:
+            self.stats['requests'] += 1
+            done = self.finished.get(key)
+            if done and time.monotonic() - done[0] < self.fresh_seconds:
+                self.stats['fresh_hits'] += 1
+                return done[1]
+            call = self.in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self.in_flight[key] = [threading.Event(), None, None]
+                self.stats['executed'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+
+        try:
+            call[1] = fn()
+        except Exception as e:
+            call[2] = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+                if call[2] is None:
+                    self.finished[key] = (time.monotonic(), call[1])
+                else:
+                    self.stats['errors'] += 1
+            call[0].set()
+        return call[1]
+
+
+coalescer = SingleFlight(COALESCE_FRESH_SECONDS)
+
+
+@app.get('/health')
+def health():
+    """Schema and rating writer state; 503 until the schema is current or when the writer has died."""
+    writer = rating_writer.health()
+    ok = schema.ready and writer['alive']
+    return json_response({'ok': ok, 'schema_ready': schema.ready, 'rating_writer': writer},
+                         status_code=200 if ok else 503)
+
+
+@app.get('/coalescing')
+def coalescing_stats():
+    """How many /summary and /games requests shared another one's query."""
+    with coalescer.lock:
+        stats = dict(coalescer.stats)
+        stats['in_flight'] = len(coalescer.in_flight)
+    stats['saved'] = stats['coalesced'] + stats['fresh_hits']
+    stats['fresh_seconds'] = coalescer.fresh_seconds
+    return stats
+
+
+if METRICS:
+    @app.get('/metrics')
+    def metrics():
+        """Per-route latency histograms, per-statement SQL timings, recent slow queries."""
+        return metrics_registry.snapshot()
+
+
+class LiveFeed:
+    """
+    The single producer behind /live. While anyone is connected it checks
+    PRAGMA data_version every LIVE_POLL_SECONDS (free when nothing committed);
+    after a commit it reads only the page_views rows past its high-water id,
+    folds them into today's visitor set and hands one pre-encoded event to
+    every subscriber queue. The cost does not depend on the viewer count.
+    """
+
+    def __init__(self):
+        self.subscribers: set = set()
+        self.task = None
+        self.db = None
+        self.data_version = None
+        self.high_water = 0
+        self.day = None
+        self.today_visitors: set = set()
+        self.stats = {'checks': 0, 'queries': 0, 'events': 0, 'dropped': 0}
+
+    def subscribe(self) -> asyncio.Queue:
+        q = asyncio.Queue(LIVE_QUEUE_EVENTS)
+        self.subscribers.add(q)
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        elif self.day is not None:
+            q.put_nowait(self.encode(self.snapshot()))
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        self.subscribers.discard(q)
+
+    def _sync(self, day: int):
+        """(Re)load today's visitors and the high-water mark; no event."""
+        self.day = day
+        self.high_water = self.db.execute('SELECT COALESCE(MAX(id), 0) FROM page_views').fetchone()[0]
+        self.today_visitors = {r[0] for r in self.db.execute(
+            'SELECT DISTINCT visitor_id FROM page_views WHERE ts >= ?', (day * 86400,))}
+
+    def poll(self):
+        """Blocking; the delta since the last call, or None. Runs in the threadpool."""
+        if self.db is None:
+            self.db = sqlite3.connect(DB_FILE, check_same_thread=False)
+        self.stats['checks'] += 1
+        version = self.db.execute('PRAGMA data_version').fetchone()[0]
+        day = int(time.time()) // 86400
+        if self.data_version is None or day != self.day:
+            self.data_version = version
+            self._sync(day)
+            return self.snapshot()
+        if version == self.data_version:
+            return None
+        self.data_version = version
+        self.stats['queries'] += 1
+        rows = self.db.execute(
+            '''SELECT p.id, p.ts, g.name, p.visitor_id FROM page_views p
+               JOIN games g ON g.id = p.game_id WHERE p.id > ? ORDER BY p.id''',
+            (self.high_water,)
+        ).fetchall()
+        if not rows:
+            return None   # a commit that added no page views (ratings, referrals)
+        self.high_water = rows[-1][0]
+        before = len(self.today_visitors)
+        views = {}
+        for _, ts, game, visitor_id in rows:
+            if ts >= day * 86400:
+                views[game] = views.get(game, 0) + 1
+                self.today_visitors.add(visitor_id)
+        return {
+            'date': day_str(day),
+            'views': views,
+            'dau': len(self.today_visitors),
+            'new_visitors': len(self.today_visitors) - before,
+        }
+
+    def snapshot(self) -> dict:
+        return {'date': day_str(self.day), 'views': {}, 'dau': len(self.today_visitors), 'new_visitors': 0}
+
+    def encode(self, delta: dict) -> bytes:
+        return f'id: {self.high_water}\nevent: delta\ndata: {json.dumps(delta, separators=(",", ":"))}\n\n'.encode()
+
+    def publish(self, delta: dict):
+        msg = self.encode(delta)
+        self.stats['events'] += 1
+        for q in list(self.subscribers):
+            try:
+                q.put_nowait(msg)
+            except asyncio.QueueFull:
+                # Too far behind to be useful: make room for the close marker
+                self.subscribers.discard(q)
+                self.stats['dropped'] += 1
+                q.get_nowait()
+                q.put_nowait(None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.subscribers:
+                try:
+                    delta = await loop.run_in_executor(None, self.poll)
+                except sqlite3.Error as e:
+                    print(f'live feed: {e}')
+                    delta = None
+                if delta is not None:
+                    self.publish(delta)
+                await asyncio.sleep(LIVE_POLL_SECONDS)
+        finally:
+            # Idle: resync from scratch when the next viewer arrives
+            self.task = None
+            self.data_version = None
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+
+live_feed = LiveFeed()
+
+
+@app.get('/live')
+async def live(request: Request):
+    """
+    Server-sent events for the stats dashboard. The first `delta` event
+    carries today's DAU (and so does the first after UTC midnight); each
+    later one the page views per game added since
+    the previous event (today's only) and the new DAU.
+    """
+    q = live_feed.subscribe()
+
+    async def stream():
+        try:
+            yield b'retry: 5000\n\n'
+            while not await request.is_disconnected():
+                try:
+                    msg = await asyncio.wait_for(q.get(), LIVE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    msg = b': keepalive\n\n'
+                if msg is None:
+                    break
+                yield msg
+        finally:
+            live_feed.unsubscribe(q)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',   # let nginx pass events through unbuffered
+    })
+
+
+column_store = None
+
+
+class SchemaState:
+    """
+    Whether arcade.db has the current schema. While page_views still has the
+    legacy layout (until the collector's next run sets it aside) the API
+    serves nothing but /health and checks again every SCHEMA_RECHECK_SECONDS;
+    the rating writer and the column store start once it is in place.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.checked = None
+        self.lock = threading.Lock()
+
+    def check(self) -> bool:
+        with self.lock:
+            if self.ready or (self.checked is not None
+                              and time.monotonic() - self.checked < SCHEMA_RECHECK_SECONDS):
+                return self.ready
+            self.checked = time.monotonic()
+            db = get_db()
+            try:
+                self.ready = init_schema(db)   # migrations and backfills are the collector's
+            finally:
+                db.close()
+            if self.ready:
+                _start_writers()
+            return self.ready
+
+
+schema = SchemaState()
+
+
+class SchemaGate:
+    """ASGI middleware: 503 for every route but /health until schema.ready."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] == 'http' and not schema.ready and scope['path'] != '/health'
+                and not await asyncio.to_thread(schema.check)):
+            response = json_response(
+                {'detail': 'page_views still has the legacy layout; waiting for collect.py to set it aside'},
+                status_code=503)
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(SchemaGate)
+
+
+def _start_writers():
+    global column_store
+    rating_writer.start()
+    if COLUMNAR:
+        from columnar import ColumnStore
+        column_store = ColumnStore(DB_FILE)
+        column_store.refresh(force=True)
+
+
+@app.on_event('startup')
+def startup():
+    if not schema.check():
+        print('page_views still has the legacy layout; serving 503 until collect.py sets it aside')
+
+
+@app.on_event('shutdown')
+def shutdown():
+    rating_writer.stop()
+
+
+@app.post('/ingest/logs')
+async def ingest_logs(request: Request):
+    """
+    Pre-parsed access log batch from a shipper.py agent: gzip JSON
+    {node, start, end, rows: [[ts, ip_hash, path, ua], ...]}, where start and
+    end are byte offsets in the node's log. Idempotent on (node, start): a
+    batch already stored is acknowledged again, one starting inside a stored
+    range gets 409 with the node's next offset. collect.py counts the rows.
+    Closed (503) until ARCADE_SHIP_TOKEN is set: the route is public
+    through /stats-api/.
+    """
+    if not SHIP_TOKEN:
+        raise HTTPException(503, 'log shipping is off: ARCADE_SHIP_TOKEN is not set')
+    if not hmac.compare_digest(request.headers.get('authorization', '').encode(), f'Bearer {SHIP_TOKEN}'.encode()):
+        raise HTTPException(401, 'bad token')
+    too_big = HTTPException(413, f'batch over {SHIP_MAX_BYTES} bytes')
+    try:
+        if int(request.headers.get('content-length', 0)) > SHIP_MAX_BYTES:
+            raise too_big
+    except ValueError:
+        raise HTTPException(400, 'bad Content-Length')
+    chunks, size = [], 0
+    async for chunk in request.stream():   # a chunked body has no length to check up front
+        size += len(chunk)
+        if size > SHIP_MAX_BYTES:
+            raise too_big
+        chunks.append(chunk)
+    body = b''.join(chunks)
+    try:
+        inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        batch = json.loads(inflate.decompress(body, SHIP_MAX_RAW_BYTES))
+        if inflate.unconsumed_tail:
+            raise HTTPException(413, f'batch over {SHIP_MAX_RAW_BYTES} bytes decompressed')
+        node, start, end, rows = batch['node'], int(batch['start']), int(batch['end']), batch['rows']
+        if not (isinstance(node, str) and NODE_RE.match(node) and 0 <= start < end and isinstance(rows, list)):
+            raise ValueError('bad batch header')
+        for r in rows:
+            if not (isinstance(r, list) and len(r) == 4 and isinstance(r[0], int)
+                    and isinstance(r[1], str) and isinstance(r[2], str)):
+                raise ValueError('bad row')
+    except (zlib.error, ValueError, KeyError, TypeError) as e:
+        raise HTTPException(400, f'bad batch: {e}')
+    status, next_offset = await asyncio.to_thread(_store_log_batch, node, start, end, len(rows), body)
+    if status == 'conflict':
+        return json_response({'status': status, 'next_offset': next_offset}, status_code=409)
+    return {'status': status, 'rows': len(rows), 'next_offset': next_offset}
+
+
+def _store_log_batch(node: str, start: int, end: int, rows: int, payload: bytes) -> tuple:
+    """('stored' | 'duplicate' | 'conflict', node's next offset)."""
+    db = get_db(None)
+    try:
+        db.execute('BEGIN IMMEDIATE')   # check and insert as one, against concurrent retries
+        known = db.execute(
+            'SELECT end_offset FROM log_batches WHERE node = ? AND start_offset = ?', (node, start)
+        ).fetchone()
+        high = db.execute(
+            'SELECT COALESCE(MAX(end_offset), 0) FROM log_batches WHERE node = ?', (node,)
+        ).fetchone()[0]
+        if known is not None:
+            return ('duplicate' if known[0] == end else 'conflict'), high
+        if start < high:
+            return 'conflict', high
+        db.execute(
+            '''INSERT INTO log_batches (node, start_offset, end_offset, rows, received_at, payload)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            (node, start, end, rows, int(time.time()), payload)
+        )
+        db.commit()
+        return 'stored', end
+    finally:
+        db.rollback()
+        db.close()
+
+
+@app.post('/events/rating')
+async def rating_event(request: Request):
+    """
+    Rating widget beacon (rating.js, proxied from /api/events/rating).
+    Body is JSON; sendBeacon posts it as text/plain, so it is read raw.
+    """
+    try:
+        evt = json.loads(await request.body())
+    except ValueError:
+        return {'ok': False, 'error': 'invalid json'}
+    if not isinstance(evt, dict) or not evt.get('game'):
+        return {'ok': False, 'error': 'missing game'}
+    if not rating_writer.alive():
+        raise HTTPException(503, 'rating writer is down')
+
+    try:
+        stars = int(evt.get('rating', evt.get('stars')))
+    except (TypeError, ValueError):
+        stars = None
+    if stars is not None and not 1 <= stars <= 5:
+        stars = None
+    category = evt.get('category') or evt.get('classification')
+    if category not in RATING_CATEGORIES:
+        category = None
+    text = str(evt.get('feedback') or evt.get('text') or '')[:500] or None
+    # One row per widget showing: its star beacon and its text post share a rating_id
+    rating_id = evt.get('rating_id')
+    key = None
+    if isinstance(rating_id, str) and rating_id:
+        key = f"{str(evt.get('visitor_id') or '')[:64]}:{rating_id[:32]}"
+
+    if not rating_writer.submit((int(time.time()), str(evt['game'])[:64], stars, category, text, key)):
+        raise HTTPException(503, 'rating backlog is full')
+    return {'ok': True}
+
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=8093)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+OpenArcade access log shipper, for web nodes other than the analytics box.
+
+Tails the node's nginx log, keeps the GET 200/304 lines that are not static
+assets, pre-parses them to [ts, ip_hash, path, ua] rows (raw IPs never leave
+the node), and POSTs them gzip-compressed to the analytics API, which stores
+each batch once per (node, byte offset); collect.py counts them on its next
+run. Stdlib only.
+
+Offsets run on across log rotations (the rotated file's tail is shipped
+from access.log.1 first), so they only ever grow for a node. A batch is
+retried with exponential backoff until the API acknowledges it; the saved
+offset moves only then, so a crash or an outage never loses or doubles a
+line: re-sent batches come back as duplicates.
+
+Cron entry (one pass per minute; --follow runs as a daemon instead):
+  * * * * * ARCADE_NODE=edge-2 ARCADE_SHIP_TOKEN=... /usr/bin/python3 /ssd/openarcade/arcade-analytics/shipper.py >> /tmp/arcade-shipper.log 2>&1
+
+Local run against a dev server:
+  ARCADE_SHIP_URL=http://localhost:8093/ingest/logs ARCADE_SHIP_TOKEN=dev python3 shipper.py --log access.log --node edge-2
+(the API must run with the same ARCADE_SHIP_TOKEN; it refuses batches without one)
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import socket
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from collect import hash_ip, parse_line, parse_ts
+
+LOG_FILE = '/var/log/nginx/access.log'
+STATE_FILE = os.path.join(os.path.dirname(__file__), 'shipper.state')
+SHIP_URL = os.environ.get('ARCADE_SHIP_URL', 'http://analytics.openarcade.internal/stats-api/ingest/logs')
+SHIP_TOKEN = os.environ.get('ARCADE_SHIP_TOKEN', '')
+NODE = os.environ.get('ARCADE_NODE', socket.gethostname().split('.')[0])
+
+BATCH_LINES = 20000        # log lines read per batch
+BATCH_BYTES = 4 << 20      # ... or this much log, whichever comes first
+RETRIES = 8                # attempts per batch before a pass gives up
+RETRY_BASE_SECONDS = 0.5   # backoff doubles from here, capped at RETRY_MAX_SECONDS
+RETRY_MAX_SECONDS = 30
+TIMEOUT_SECONDS = 30
+POLL_SECONDS = 5           # --follow: wait for new lines this long
+
+ASSET_EXTENSIONS = ('.js', '.css', '.png', '.jpg', '.jpeg', '.webp', '.gif', '.svg', '.ico',
+                    '.mp3', '.mp4', '.ogg', '.wav', '.json', '.woff', '.woff2', '.ttf', '.map', '.txt')
+
+
+def pre_parse(line: bytes):
+    """[ts, ip_hash, path, ua] for a line the collector might count, else None."""
+    hit = parse_line(line.decode('utf-8', errors='replace').strip())
+    if hit is None:
+        return None
+    ip, ts_str, path, ua = hit
+    if path.partition('?')[0].lower().endswith(ASSET_EXTENSIONS):
+        return None
+    ts = parse_ts(ts_str)
+    if ts is None:
+        return None
+    return [ts, hash_ip(ip), path, ua]
+
+
+class Shipper:
+
+    def __init__(self, node: str = NODE, log_file: str = LOG_FILE, state_file: str = STATE_FILE,
+                 url: str = SHIP_URL, token: str = SHIP_TOKEN):
+        self.node = node
+        self.log_file = log_file
+        self.state_file = state_file
+        self.url = url
+        self.token = token
+        # inode of the file being read, position in it, bytes shipped from earlier files
+        self.state = {'inode': None, 'pos': 0, 'base': 0}
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                self.state.update(json.load(f))
+        self.stats = {'batches': 0, 'rows': 0, 'duplicates': 0, 'retries': 0, 'resyncs': 0}
+
+    def save(self):
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_file)
+
+    def _current(self):
+        """Open file to read next: the rotated log's unread tail first, then the live log."""
+        st = os.stat(self.log_file)
+        if self.state['inode'] is None:
+            self.state['inode'] = st.st_ino
+        if st.st_ino == self.state['inode']:
+            if st.st_size < self.state['pos']:   # truncated in place
+                self.state['base'] += self.state['pos']
+                self.state['pos'] = 0
+            return open(self.log_file, 'rb')
+        rotated = self.log_file + '.1'
+        if os.path.exists(rotated) and os.stat(rotated).st_ino == self.state['inode']:
+            f = open(rotated, 'rb')
+            if self.state['pos'] < os.fstat(f.fileno()).st_size:
+                return f
+            f.close()
+        # Done with the old file (or it is gone): continue at the start of the new one
+        self.state['base'] += self.state['pos']
+        self.state.update(inode=st.st_ino, pos=0)
+        self.save()
+        return open(self.log_file, 'rb')
+
+    def read_batch(self):
+        """(start offset, end offset, rows) of the next complete lines; end == start when idle."""
+        with self._current() as f:
+            f.seek(self.state['pos'])
+            rows, size = [], 0
+            for _ in range(BATCH_LINES):
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break   # a line nginx is still writing
+                size += len(line)
+                row = pre_parse(line)
+                if row is not None:
+                    rows.append(row)
+                if size >= BATCH_BYTES:
+                    break
+        start = self.state['base'] + self.state['pos']
+        return start, start + size, rows
+
+    def post(self, start: int, end: int, rows: list) -> dict:
+        """POST one batch, retrying until the API answers; returns its reply."""
+        body = gzip.compress(json.dumps(
+            {'node': self.node, 'start': start, 'end': end, 'rows': rows}, separators=(',', ':')
+        ).encode(), 6)
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip',
+                   'Authorization': f'Bearer {self.token}'}
+        for attempt in range(RETRIES):
+            req = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+            try:
+                with urllib.request.urlopen(req, timeout=TIMEOUT_SECONDS) as resp:
+                    return json.load(resp)
+            except urllib.error.HTTPError as e:
+                if e.code == 409:
+                    return json.load(e)
+                if e.code < 500 and e.code != 429:
+                    raise RuntimeError(f'{self.url} refused the batch: {e.code} {e.read()[:200]!r}')
+                error = f'HTTP {e.code}'
+            except (urllib.error.URLError, OSError) as e:
+                error = str(e)
+            delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1)
+            print(f'{self.node}: batch {start}-{end} failed ({error}), retry in {delay:.1f}s')
+            self.stats['retries'] += 1
+            time.sleep(delay)
+        raise RuntimeError(f'{self.node}: gave up on batch {start}-{end} after {RETRIES} attempts')
+
+    def ship_once(self) -> int:
+        """Ship everything written so far. Returns log bytes shipped."""
+        shipped = 0
+        while True:
+            start, end, rows = self.read_batch()
+            if end == start:
+                return shipped
+            if rows:
+                reply = self.post(start, end, rows)
+                if reply['status'] == 'conflict':
+                    # Our state is behind the API's (restored backup, lost state file): skip ahead
+                    self.stats['resyncs'] += 1
+                    print(f'{self.node}: API is at offset {reply["next_offset"]}, skipping ahead from {start}')
+                    end = reply['next_offset']
+                elif reply['status'] == 'duplicate':
+                    self.stats['duplicates'] += 1
+                self.stats['batches'] += 1
+                self.stats['rows'] += len(rows)
+            self.state['pos'] = end - self.state['base']
+            self.save()
+            shipped += end - start
+
+    def follow(self):
+        while True:
+            try:
+                self.ship_once()
+            except (OSError, RuntimeError) as e:
+                print(e)
+            time.sleep(POLL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--log', default=LOG_FILE)
+    parser.add_argument('--state', default=STATE_FILE)
+    parser.add_argument('--node', default=NODE)
+    parser.add_argument('--url', default=SHIP_URL)
+    parser.add_argument('--follow', action='store_true', help='keep tailing instead of one pass')
+    args = parser.parse_args()
+    if not os.path.exists(args.log):
+        print(f'Log file not found: {args.log}')
+        sys.exit(1)
+    if not SHIP_TOKEN:
+        print('ARCADE_SHIP_TOKEN is not set')
+        sys.exit(1)
+
+    shipper = Shipper(args.node, args.log, args.state, args.url)
+    if args.follow:
+        shipper.follow()
+    t0 = time.perf_counter()
+    try:
+        shipped = shipper.ship_once()
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    print(f'[{time.strftime("%Y-%m-%dT%H:%M:%S")}] {args.node}: shipped {shipped} log bytes, '
+          f'{shipper.stats["rows"]} rows in {shipper.stats["batches"]} batches '
+          f'({time.perf_counter() - t0:.1f}s, {shipper.stats["retries"]} retries)')
+
+
+if __name__ == '__main__':
+    main()
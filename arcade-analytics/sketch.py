@@ -0,0 +1,110 @@
+"""
+Space-Saving heavy-hitter sketches (Metwally et al.), mergeable.
+
+A sketch keeps at most `capacity` counters. A key that is not tracked while
+the sketch is full takes over the smallest counter, inheriting its count as
+its error bound, so every estimate is an overcount by at most its `error`,
+and by at most total / capacity overall. With no more distinct keys than
+counters the counts are exact.
+
+Two sketches merge by adding counts key by key; a key missing from a full
+sketch is charged that sketch's minimum count (the most it can have had)
+as both count and error. The merged sketch keeps the `capacity` largest, so
+a top-N over any span is a merge of that span's sketches in bounded memory.
+
+Serialized: zlib-compressed JSON {k, n, items: [[key, count, error], ...]}.
+"""
+
+import heapq
+import json
+import zlib
+
+
+class SpaceSaving:
+    __slots__ = ('capacity', 'counts', 'errors', 'total', '_heap')
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self.counts: dict = {}
+        self.errors: dict = {}
+        self.total = 0
+        self._heap = None   # [(count when pushed, key)], built on the first eviction
+
+    def add(self, key, n: int = 1):
+        self.total += n
+        c = self.counts.get(key)
+        if c is not None:
+            self.counts[key] = c + n
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = n
+            self.errors[key] = 0
+            if self._heap is not None:
+                heapq.heappush(self._heap, (n, key))
+            return
+        floor, victim = self._pop_min()
+        del self.counts[victim], self.errors[victim]
+        self.counts[key] = floor + n
+        self.errors[key] = floor
+        heapq.heappush(self._heap, (floor + n, key))
+
+    def _pop_min(self) -> tuple:
+        # One heap entry per key, possibly below its count (increments do
+        # not touch the heap): refresh stale ones until the top is current
+        if self._heap is None:
+            self._heap = [(c, k) for k, c in self.counts.items()]
+            heapq.heapify(self._heap)
+        while True:
+            c, k = heapq.heappop(self._heap)
+            if self.counts[k] == c:
+                return c, k
+            heapq.heappush(self._heap, (self.counts[k], k))
+
+    def min_count(self) -> int:
+        """Most a key this sketch does not track can have been seen."""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other: 'SpaceSaving') -> 'SpaceSaving':
+        """New sketch of both streams, with this one's capacity."""
+        out = SpaceSaving(self.capacity)
+        out.total = self.total + other.total
+        m1, m2 = self.min_count(), other.min_count()
+        counts, errors = {}, {}
+        for k in self.counts.keys() | other.counts.keys():
+            c1, c2 = self.counts.get(k), other.counts.get(k)
+            counts[k] = (m1 if c1 is None else c1) + (m2 if c2 is None else c2)
+            errors[k] = (m1 if c1 is None else self.errors[k]) + (m2 if c2 is None else other.errors[k])
+        if len(counts) > out.capacity:
+            counts = dict(heapq.nlargest(out.capacity, counts.items(), key=lambda kv: kv[1]))
+        out.counts = counts
+        out.errors = {k: errors[k] for k in counts}
+        return out
+
+    def top(self, n: int = 10) -> list:
+        """[(key, count, error)] by count, largest first."""
+        best = heapq.nlargest(n, self.counts.items(), key=lambda kv: kv[1])
+        return [(k, c, self.errors[k]) for k, c in best]
+
+    def to_bytes(self) -> bytes:
+        items = [[k, c, self.errors[k]] for k, c in self.counts.items()]
+        return zlib.compress(json.dumps({'k': self.capacity, 'n': self.total, 'items': items},
+                                        separators=(',', ':')).encode())
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> 'SpaceSaving':
+        data = json.loads(zlib.decompress(blob))
+        out = cls(data['k'])
+        out.total = data['n']
+        for k, c, e in data['items']:
+            out.counts[k] = c
+            out.errors[k] = e
+        return out
+
+    @classmethod
+    def merge_all(cls, sketches, capacity: int = 256) -> 'SpaceSaving':
+        out = cls(capacity)
+        for s in sketches:
+            out = out.merge(s)
+        return out
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+OpenArcade arcade.db snapshots: online backups and the API's read replica.
+
+Copies the live database with SQLite's backup API, PAGES_PER_STEP pages at a
+time with a short pause between steps, inside one read transaction on the
+source. In WAL mode a reader never blocks the collector or the API's writer,
+and the held transaction pins the copy to a single commit: writes made while
+it runs land in the WAL and are simply not in this snapshot (without it the
+backup starts over after every commit and may never finish on a busy db).
+
+Each snapshot is written to a .tmp file, synced step by step (one burst of
+writeback at the end stalls the writers' own fsyncs), switched to a plain
+rollback journal (one self-contained file), quick_check'ed and renamed to
+arcade-YYYYmmddTHHMMSSZ.db in SNAPSHOT_DIR. replica.db, a symlink, then
+moves to it; server.py opens that read-only for its long reads when
+ARCADE_REPLICA=1.
+
+Retention: the newest KEEP_RECENT snapshots, plus the newest of each UTC
+day for KEEP_DAYS days. The replica's target is never pruned.
+
+Cron entry (every 15 minutes, between collector runs):
+  7-59/15 * * * * /usr/bin/python3 /ssd/openarcade/arcade-analytics/snapshot.py >> /tmp/arcade-snapshot.log 2>&1
+
+Restore: stop the services, copy a snapshot over arcade.db, remove
+arcade.db-wal and arcade.db-shm, start them again.
+"""
+
+import os
+import re
+import sys
+import sqlite3
+import time
+import argparse
+from datetime import datetime, timezone
+
+from collect import DB_FILE
+
+SNAPSHOT_DIR = os.environ.get('ARCADE_SNAPSHOT_DIR', os.path.join(os.path.dirname(__file__), 'snapshots'))
+REPLICA_NAME = 'replica.db'
+
+PAGES_PER_STEP = 1024    # pages copied per backup step (4 MB at the default page size)
+STEP_PAUSE = 0.005       # seconds between steps, to leave the disk to the writers
+KEEP_RECENT = 8          # newest snapshots always kept (two hours at the cron interval)
+KEEP_DAYS = 14           # ... plus the newest snapshot of each of the last N days
+REPLICA_MAX_AGE = 3600   # server.py falls back to arcade.db when the replica is older
+
+SNAPSHOT_RE = re.compile(r'^arcade-(\d{8}T\d{6}Z)\.db$')
+
+
+def snapshot_name(ts: float) -> str:
+    return f'arcade-{datetime.fromtimestamp(ts, timezone.utc):%Y%m%dT%H%M%SZ}.db'
+
+
+def snapshots(snapshot_dir: str = SNAPSHOT_DIR) -> list:
+    """Snapshot file names, oldest first."""
+    try:
+        return sorted(n for n in os.listdir(snapshot_dir) if SNAPSHOT_RE.match(n))
+    except FileNotFoundError:
+        return []
+
+
+def replica_path(snapshot_dir: str = SNAPSHOT_DIR, max_age: int = REPLICA_MAX_AGE):
+    """Path of the current replica snapshot, or None when there is none fresh enough."""
+    try:
+        path = os.path.realpath(os.path.join(snapshot_dir, REPLICA_NAME), strict=True)
+        if time.time() - os.stat(path).st_mtime > max_age:
+            return None
+    except OSError:
+        return None
+    return path
+
+
+def take(db_file: str = DB_FILE, snapshot_dir: str = SNAPSHOT_DIR,
+         pages: int = PAGES_PER_STEP, pause: float = STEP_PAUSE) -> dict:
+    """Write one consistent snapshot of db_file; returns its name and stats."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    t0 = time.time()
+    name = snapshot_name(t0)
+    path = os.path.join(snapshot_dir, name)
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    src = sqlite3.connect(db_file, timeout=30, isolation_level=None)
+    dst = sqlite3.connect(tmp)
+    fd = os.open(tmp, os.O_RDONLY)
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        os.fdatasync(fd)
+        if pause and remaining:
+            time.sleep(pause)
+
+    try:
+        if src.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+            src.execute('PRAGMA journal_mode=WAL')   # as collect.py's init_db sets it; readers stop blocking writers
+        src.execute('BEGIN')
+        src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()   # the read snapshot starts here
+        src.backup(dst, pages=pages, progress=progress)
+        src.execute('COMMIT')
+        dst.execute('PRAGMA journal_mode=DELETE')
+        check = dst.execute('PRAGMA quick_check').fetchone()[0]
+        if check != 'ok':
+            raise RuntimeError(f'{name}: quick_check failed: {check}')
+    except BaseException:
+        dst.close()
+        os.remove(tmp)
+        raise
+    finally:
+        src.close()
+        os.close(fd)
+    dst.close()   # journal_mode=DELETE on the copy: its commits already synced it
+
+    os.replace(tmp, path)
+    link = os.path.join(snapshot_dir, REPLICA_NAME + '.tmp')
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(name, link)
+    os.replace(link, os.path.join(snapshot_dir, REPLICA_NAME))
+    dir_fd = os.open(snapshot_dir, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return {'name': name, 'bytes': os.path.getsize(path), 'steps': steps, 'seconds': time.time() - t0}
+
+
+def prune(snapshot_dir: str = SNAPSHOT_DIR, keep_recent: int = KEEP_RECENT, keep_days: int = KEEP_DAYS) -> list:
+    """Delete snapshots outside the retention policy; returns the names removed."""
+    names = snapshots(snapshot_dir)
+    keep = set(names[-keep_recent:]) if keep_recent else set()
+    daily = {}
+    for n in names:
+        daily[n[7:15]] = n   # newest per YYYYmmdd
+    keep.update(daily[d] for d in sorted(daily)[-keep_days:])
+    current = replica_path(snapshot_dir, max_age=1 << 62)
+    if current:
+        keep.add(os.path.basename(current))
+    removed = [n for n in names if n not in keep]
+    for n in removed:
+        os.remove(os.path.join(snapshot_dir, n))
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--no-prune', action='store_true')
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        print(f'Database not found: {args.db}')
+        sys.exit(1)
+
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    try:
+        snap = take(args.db, args.dir)
+    except (sqlite3.Error, RuntimeError, OSError) as e:
+        print(f'[{stamp}] snapshot failed: {e}')
+        sys.exit(1)
+    removed = [] if args.no_prune else prune(args.dir)
+    print(f'[{stamp}] {snap["name"]}: {snap["bytes"] / 1e6:.1f} MB in {snap["seconds"]:.1f}s '
+          f'({snap["steps"]} steps), pruned {len(removed)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,7 @@
   var sessionRated = false;
   var widget = null;
   var currentRating = 0;
+  var ratingId = ''; // new per showing; the server keeps one rating per id
   var widgetVisible = false;
 
   function detectGameName() {
@@ -306,6 +307,7 @@
     widgetVisible = true;
     // Reset state
     currentRating = 0;
+    ratingId = Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
     widget.querySelectorAll('.ar-star').forEach(function (s) { s.classList.remove('ar-active'); });
     widget.querySelector('.ar-feedback').style.display = 'none';
     widget.querySelector('.ar-ai-response').style.display = 'none';
@@ -325,13 +327,15 @@
     setTimeout(function () { widget.classList.add('ar-hidden'); }, 300);
   }
 
-  // Fire-and-forget rating (for initial star click, no text feedback)
+  // Fire-and-forget rating (for initial star click, no text feedback); a
+  // later click or the text post with the same ratingId replaces it
   function sendRatingBeacon(rating, feedback) {
     var payload = {
       event: 'game_rating',
       game: gameName,
       rating: rating,
       feedback: feedback || '',
+      rating_id: ratingId,
       visitor_id: visitorId,
       timestamp: new Date().toISOString(),
       url: window.location.href,
@@ -349,6 +353,7 @@
       game: gameName,
       rating: rating,
       feedback: feedback,
+      rating_id: ratingId,
       visitor_id: visitorId,
       timestamp: new Date().toISOString(),
       url: window.location.href,
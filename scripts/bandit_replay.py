@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Offline replay evaluation of landing page bandit policies.
+
+Replays the logged pageview/card_click events against candidate policies
+before one is deployed. Each policy is simulated RUNS times at once: its
+Beta posteriors are an (runs, arms) array, and every block of BATCH events
+draws all the samples it needs in one NumPy call. The state is frozen
+within a block, as the deployed bandit's is between state refreshes.
+Policies run in parallel in a process pool.
+
+Estimators, per run (reported as mean and spread across runs; the spread
+is the policy's own randomness, not the sampling noise of the log itself):
+  replay  Li et al.: an event counts, and the policy learns from it, only
+          where the policy picked the logged arm. CTR = clicks / matches.
+          Unbiased when the logging policy was uniform; under the
+          logged Thompson Sampling it favours arms the logger liked.
+  ips     Inverse propensity: sum(match * click / p) / events, where p is
+          the logging policy's probability of the logged arm, computed
+          from the arm_params each pageview recorded (P(its Beta sample
+          was the largest), integrated on a grid). p is clipped at --min-p.
+  snips   Self-normalised IPS: sum(match * click / p) / sum(match / p).
+          Lower variance, slightly biased.
+Pageviews without arm_params (the page's fallback when the state fetch
+failed) have no known propensity; they count for replay only.
+
+Policies (name[:parameter]):
+  thompson          Beta(1 + clicks, 1 + misses) per arm, as deployed
+  discounted:0.999  thompson with all counts decayed by this per event
+  top_two:0.5       top-two Thompson: the leader with this probability,
+                    else the best of a second sample with the leader masked
+  greedy            highest posterior mean
+  epsilon:0.1       greedy, random arm with this probability
+  uniform           random arm
+  fixed:<arm>       always the same arm (its ips is that arm's CTR)
+
+Usage:
+    python bandit_replay.py thompson discounted:0.999 top_two:0.5 uniform
+    python bandit_replay.py --synthetic 50000 thompson top_two:0.5 fixed:classics
+
+Install: pip install numpy
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from update_bandit import EVENTS_PATH, load_current_state
+
+RUNS = 1000          # simulated runs per policy
+BATCH = 50           # events per block with a frozen policy state
+MIN_PROPENSITY = 0.01
+PROPENSITY_GRID = 8192     # integration points for the logging policy's arm probabilities
+SYNTHETIC_CTR = {"default": 0.10, "classics": 0.14, "casual": 0.12, "action": 0.11, "random": 0.08}
+
+
+def load_log(arms):
+    """(arm index, clicked, logged arm_params) per pageview in time order, from the event log."""
+    index = {name: i for i, name in enumerate(arms)}
+    pageviews = {}
+    clicked = set()
+    with open(EVENTS_PATH) as f:
+        for line in f:
+            try:
+                evt = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            pid = evt.get("pageview_id")
+            if not pid:
+                continue
+            etype = evt.get("event")
+            if etype == "pageview":
+                params = evt.get("arm_params") or None
+                if params:
+                    by_name = {p["name"]: (p["alpha"], p["beta"]) for p in params}
+                    params = tuple(by_name.get(name, (1, 1)) for name in arms)
+                pageviews[pid] = (evt.get("timestamp") or "", evt.get("arm", "default"), params)
+            elif etype == "card_click":
+                clicked.add(pid)
+
+    # By timestamp only (stable: ties keep log order); params may be None or tuples
+    rows = sorted(((ts, index[arm], pid in clicked, params)
+                   for pid, (ts, arm, params) in pageviews.items() if arm in index),
+                  key=lambda r: r[0])
+    skipped = len(pageviews) - len(rows)
+    if skipped:
+        print(f"Skipped {skipped} pageviews with arms not in the state")
+    arm = np.array([r[1] for r in rows], dtype=np.int64)
+    reward = np.array([r[2] for r in rows], dtype=np.float64)
+    return arm, reward, [r[3] for r in rows]
+
+
+def thompson_probs(ab, grid=PROPENSITY_GRID):
+    """P(each arm's sample is the largest) for Beta(alpha, beta) rows of `ab`, by integration on a grid."""
+    x = (np.arange(grid) + 0.5) / grid
+    a, b = ab[:, 0, None], ab[:, 1, None]
+    logpdf = (a - 1) * np.log(x) + (b - 1) * np.log1p(-x)
+    mass = np.exp(logpdf - logpdf.max(1, keepdims=True))
+    mass /= mass.sum(1, keepdims=True)                 # per arm, probability of each cell
+    below = np.maximum(np.cumsum(mass, 1) - mass / 2, 1e-300)
+    log_below = np.log(below)
+    # P(arm k wins) = sum over x of mass_k(x) * prod over j != k of P(sample_j < x)
+    probs = (mass * np.exp(log_below.sum(0) - log_below)).sum(1)
+    return probs / probs.sum()
+
+
+def logging_propensity(arm, params, min_p=MIN_PROPENSITY):
+    """P(logged arm) under Thompson Sampling with each pageview's arm_params; NaN where unknown."""
+    out = np.full(len(arm), np.nan)
+    cache = {}
+    for i, p in enumerate(params):
+        if p is None:
+            continue
+        probs = cache.get(p)
+        if probs is None:
+            probs = cache[p] = thompson_probs(np.array(p, dtype=np.float64))
+        out[i] = probs[arm[i]]
+    return np.maximum(out, min_p)
+
+
+def synthetic_log(n, arms, rng, batch=BATCH):
+    """A log as deployed Thompson Sampling would write it, with known per-arm CTRs."""
+    ctr = np.array([SYNTHETIC_CTR.get(name, 0.1) for name in arms])
+    k = len(arms)
+    s, f = np.zeros(k), np.zeros(k)
+    arm = np.empty(n, dtype=np.int64)
+    reward = np.empty(n)
+    params = []
+    for start in range(0, n, batch):
+        m = min(batch, n - start)
+        p = tuple((1 + int(a), 1 + int(b)) for a, b in zip(s, f))
+        chosen = rng.beta(1 + s, 1 + f, (m, k)).argmax(1)
+        clicks = (rng.random(m) < ctr[chosen]).astype(np.float64)
+        arm[start:start + m] = chosen
+        reward[start:start + m] = clicks
+        params += [p] * m
+        s += np.bincount(chosen, clicks, minlength=k)
+        f += np.bincount(chosen, 1 - clicks, minlength=k)
+    return arm, reward, params
+
+
+def parse_policy(spec, arms):
+    name, _, param = spec.partition(":")
+    defaults = {"discounted": "0.999", "top_two": "0.5", "epsilon": "0.1"}
+    if name not in ("thompson", "discounted", "top_two", "greedy", "epsilon", "uniform", "fixed"):
+        raise ValueError(f"unknown policy {spec!r}")
+    if name == "fixed":
+        if param not in arms:
+            raise ValueError(f"fixed: needs one of {', '.join(arms)}")
+        return name, arms.index(param)
+    return name, float(param or defaults.get(name, 0))
+
+
+def choose(name, param, a, b, m, rng):
+    """(runs, m) arm choices for the next m events, from posteriors a, b of shape (runs, arms)."""
+    runs, k = a.shape
+    if name == "uniform":
+        return rng.integers(0, k, (runs, m))
+    if name == "fixed":
+        return np.full((runs, m), int(param))
+    if name in ("greedy", "epsilon"):
+        best = np.broadcast_to((a / (a + b)).argmax(1)[:, None], (runs, m))
+        if name == "greedy":
+            return best
+        explore = rng.random((runs, m)) < param
+        return np.where(explore, rng.integers(0, k, (runs, m)), best)
+    theta = rng.beta(a[:, None, :], b[:, None, :], (runs, m, k))
+    leader = theta.argmax(2)
+    if name != "top_two":
+        return leader
+    theta = rng.beta(a[:, None, :], b[:, None, :], (runs, m, k))
+    np.put_along_axis(theta, leader[:, :, None], -1.0, axis=2)
+    return np.where(rng.random((runs, m)) < param, leader, theta.argmax(2))
+
+
+def evaluate(spec, arms, arm, reward, propensity, runs=RUNS, batch=BATCH, seed=0):
+    """Replay one policy over the log in `runs` parallel simulations; returns its estimates."""
+    name, param = parse_policy(spec, arms)
+    rng = np.random.default_rng(seed)
+    n, k = len(arm), len(arms)
+    t0 = time.perf_counter()
+    s, f = np.zeros((runs, k)), np.zeros((runs, k))
+    matches, clicks = np.zeros(runs), np.zeros(runs)
+    ips, ips_norm = np.zeros(runs), np.zeros(runs)
+    picks = np.zeros(k)
+    known = ~np.isnan(propensity)
+    weight = np.where(known, 1 / np.where(known, propensity, 1), 0)
+    for start in range(0, n, batch):
+        end = min(n, start + batch)
+        logged, r, w = arm[start:end], reward[start:end], weight[start:end]
+        chosen = choose(name, param, 1 + s, 1 + f, end - start, rng)
+        hit = (chosen == logged).astype(np.float64)   # (runs, m)
+        picks += np.bincount(chosen.ravel(), minlength=k)
+        matches += hit.sum(1)
+        clicks += hit @ r
+        ips += hit @ (r * w)
+        ips_norm += hit @ w
+        if name == "discounted":
+            s *= param ** (end - start)
+            f *= param ** (end - start)
+        onehot = np.eye(k)[logged]                     # (m, arms)
+        s += hit @ (onehot * r[:, None])
+        f += hit @ (onehot * (1 - r)[:, None])
+
+    replay = clicks / np.maximum(matches, 1)
+    ips_value = ips / max(1, known.sum())
+    snips = ips / np.maximum(ips_norm, 1e-12)
+    return {
+        "policy": spec,
+        "replay": (replay.mean(), replay.std()),
+        "ips": (ips_value.mean(), ips_value.std()),
+        "snips": (snips.mean(), snips.std()),
+        "matched": matches.mean() / max(1, n),
+        "share": (picks / picks.sum()).tolist(),
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("policies", nargs="+", help="e.g. thompson discounted:0.999 top_two:0.5")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--batch", type=int, default=BATCH, help="events per frozen-state block")
+    parser.add_argument("--min-p", type=float, default=MIN_PROPENSITY, help="propensity clip for ips")
+    parser.add_argument("--synthetic", type=int, default=0, help="replay N generated pageviews instead of the log")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    arms = [a["name"] for a in load_current_state()["arms"]]
+    for spec in args.policies:
+        try:
+            parse_policy(spec, arms)
+        except ValueError as e:
+            print(e)
+            sys.exit(2)
+
+    rng = np.random.default_rng(args.seed)
+    if args.synthetic:
+        arm, reward, params = synthetic_log(args.synthetic, arms, rng, args.batch)
+        print("Synthetic CTRs: " + ", ".join(f"{a} {SYNTHETIC_CTR.get(a, 0.1):.1%}" for a in arms))
+    elif not EVENTS_PATH.exists():
+        print(f"No event log at {EVENTS_PATH}")
+        sys.exit(1)
+    else:
+        arm, reward, params = load_log(arms)
+    if not len(arm):
+        print("No pageviews to replay")
+        sys.exit(1)
+    t0 = time.perf_counter()
+    propensity = logging_propensity(arm, params, args.min_p)
+    print(f"{len(arm)} pageviews, {int(reward.sum())} clicks (logged CTR {reward.mean():.2%}), "
+          f"{int(np.isnan(propensity).sum())} without propensity; propensities in {time.perf_counter() - t0:.1f}s")
+
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(args.policies))) as pool:
+        futures = [pool.submit(evaluate, spec, arms, arm, reward, propensity, args.runs, args.batch, args.seed + i)
+                   for i, spec in enumerate(args.policies)]
+        results = [fut.result() for fut in futures]
+
+    print(f"\n{'policy':18s} {'replay':>16s} {'ips':>16s} {'snips':>16s} {'matched':>8s} {'time':>6s}  arm share")
+    for res in results:
+        cols = "".join(f" {res[k][0]:8.2%} ±{res[k][1]:6.2%}" for k in ("replay", "ips", "snips"))
+        share = " ".join(f"{name} {x:.0%}" for name, x in zip(arms, res["share"]))
+        print(f"{res['policy']:18s}{cols} {res['matched']:8.1%} {res['seconds']:5.1f}s  {share}")
+    print(f"\n{len(results)} policies x {args.runs} runs in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
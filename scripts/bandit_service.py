@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Real-time Thompson Sampling bandit service for the OpenArcade landing page.
+FastAPI server on port 8096; replaces the hourly update_bandit.py cron.
+
+Tails landing_events.jsonl (every TAIL_SECONDS) and folds each new event
+into the arm counts as it arrives, with update_bandit.py's Checkpoint: O(1)
+per event, and the same counts a full recompute gives as long as clicks
+come within OPEN_EVENTS events of their pageview. Serves the current
+state at /bandit_state.json with an ETag (a poll that finds nothing new
+is a 304), rewrites bandit_state.json atomically within WRITE_SECONDS of a
+change for the static path, and appends the hourly blog report as the cron
+did. Checkpoint and state are saved in that order, so a restart resumes
+at the last saved offset without counting a line twice.
+
+While the service runs it holds the checkpoint lock; update_bandit.py
+refuses to run alongside it (--verify still works).
+
+Install: pip install fastapi uvicorn
+Run:     uvicorn bandit_service:app --host 127.0.0.1 --port 8096
+
+Systemd service: arcade-bandit (and drop the update_bandit.py cron entry)
+Nginx (falls back to the static file when the service is down):
+  location = /bandit_state.json {
+      proxy_pass http://localhost:8096/bandit_state.json;
+      proxy_intercept_errors on;
+      error_page 502 503 504 = @bandit_static;
+  }
+  location @bandit_static {
+      root /ssd/openarcade;
+  }
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request, Response
+
+from update_bandit import (Checkpoint, checkpoint_lock, load_current_state, set_arm_params,
+                           write_report, write_state)
+
+TAIL_SECONDS = 1        # how often the event log is checked for new lines
+WRITE_SECONDS = 10      # bandit_state.json and the checkpoint are saved at most this often
+REPORT_SECONDS = 3600   # blog report line, as the hourly cron wrote
+
+app = FastAPI(title="OpenArcade Bandit")
+
+
+class Bandit:
+    """Arm counts kept current from the event log, plus the encoded state to serve."""
+
+    def __init__(self):
+        self.ckpt = None
+        self.state = None
+        self.current = (b"", "")   # (encoded state, ETag), replaced as one
+        self.seq = None        # ckpt.seq the body was built at
+        self.saved_seq = None
+        self.events = 0
+        self.updated = 0.0
+        self.lock_file = None
+        self.task = None
+        self.mutex = threading.Lock()   # catch_up and save run in worker threads
+
+    def start(self):
+        self.lock_file = checkpoint_lock()
+        if self.lock_file is None:
+            raise RuntimeError("update_bandit.py or another bandit service holds the checkpoint lock")
+        self.ckpt = Checkpoint.load()
+        self.state = load_current_state()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        if self.ckpt is not None:
+            await asyncio.to_thread(self.save)
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def catch_up(self):
+        """Apply the lines written since the last call. Runs in a worker thread."""
+        with self.mutex:
+            self._catch_up()
+
+    def _catch_up(self):
+        self.events += self.ckpt.apply(self.ckpt.read_new_events())
+        if self.ckpt.seq == self.seq:
+            return
+        set_arm_params(self.state, self.ckpt.arm_stats)
+        self.state["updated_at"] = datetime.now(timezone.utc).isoformat()
+        self.state["total_pageviews"] = sum(s["total"] for s in self.ckpt.arm_stats.values())
+        body = json.dumps(self.state, indent=2).encode()
+        self.current = (body, '"' + hashlib.sha1(body).hexdigest()[:20] + '"')
+        self.seq = self.ckpt.seq
+        self.updated = time.time()
+
+    def save(self):
+        with self.mutex:
+            if self.saved_seq == self.ckpt.seq:
+                return
+            self.ckpt.save()
+            write_state(self.state)
+            self.saved_seq = self.ckpt.seq
+
+    async def run(self):
+        last_write = last_report = time.monotonic()
+        while True:
+            try:
+                await asyncio.to_thread(self.catch_up)
+                now = time.monotonic()
+                if now - last_write >= WRITE_SECONDS:
+                    last_write = now
+                    await asyncio.to_thread(self.save)
+                if now - last_report >= REPORT_SECONDS:
+                    last_report = now
+                    await asyncio.to_thread(write_report, self.ckpt.arm_stats, self.state)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # keep serving the last good state
+                print(f"bandit: {e!r}")
+            await asyncio.sleep(TAIL_SECONDS)
+
+
+bandit = Bandit()
+
+
+@app.get("/bandit_state.json")
+def state(request: Request):
+    """Current arm parameters; 304 when the client's ETag is still current."""
+    body, etag = bandit.current
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@app.get("/status")
+def status():
+    ckpt = bandit.ckpt
+    return {
+        "events": bandit.events,
+        "offset": ckpt.offset,
+        "open_pageviews": len(ckpt.open),
+        "state_age_seconds": round(time.time() - bandit.updated, 1) if bandit.updated else None,
+        "saved": bandit.saved_seq == ckpt.seq,
+    }
+
+
+@app.on_event("startup")
+async def startup():
+    bandit.start()
+    await asyncio.to_thread(bandit.catch_up)   # serve a current state from the first request
+    print(f"bandit: {bandit.events} events caught up, offset {bandit.ckpt.offset}")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await bandit.stop()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=8096)
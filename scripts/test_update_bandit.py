@@ -0,0 +1,94 @@
+"""
+update_bandit.py: incremental runs over a growing log give the posteriors
+a --rebuild (and a full recompute) gives.
+
+Run: python -m pytest scripts/test_update_bandit.py
+"""
+
+import json
+import random
+import sys
+
+import pytest
+
+import update_bandit
+
+ARMS = ["default", "classics", "casual", "action", "random"]
+
+
+def synthetic_log(n_events=40_000, seed=7):
+    """
+    Landing page events with the awkward cases: clicks long after the
+    page_exit beacon, clicks logged before their pageview, repeat clicks,
+    pageviews sent twice with different arms, blank and garbled lines.
+    """
+    rng = random.Random(seed)
+    lines, pids, early = [], [], []
+    for i in range(n_events):
+        r = rng.random()
+        if r < 0.45 or not pids:
+            pid = early.pop() if early and rng.random() < 0.5 else f"pv{i}"
+            pids.append(pid)
+            lines.append({"event": "pageview", "pageview_id": pid, "arm": rng.choice(ARMS)})
+        elif r < 0.70:
+            lines.append({"event": "page_exit", "pageview_id": rng.choice(pids[-200:])})
+        elif r < 0.85:
+            # Mostly recent pageviews, some thousands of events back
+            back = rng.choice((50, 500, 5_000, 15_000))
+            lines.append({"event": "card_click", "pageview_id": rng.choice(pids[-back:]), "game": "tetris"})
+        elif r < 0.88:
+            early.append(f"early{i}")
+            lines.append({"event": "card_click", "pageview_id": early[-1], "game": "pong"})
+        elif r < 0.90:
+            lines.append({"event": "pageview", "pageview_id": rng.choice(pids[-1_000:]), "arm": rng.choice(ARMS)})
+        elif r < 0.91:
+            lines.append({"event": "card_click"})
+        else:
+            lines.append({"event": "scroll", "pageview_id": rng.choice(pids[-50:])})
+    text = "".join(json.dumps(e) + "\n" for e in lines)
+    return (text + "\n{not json\n").encode()
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    for name in ("EVENTS_PATH", "STATE_PATH", "REPORT_PATH", "CHECKPOINT_PATH"):
+        monkeypatch.setattr(update_bandit, name, tmp_path / name.lower().replace("_path", ".json"))
+    return tmp_path
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["update_bandit.py", *args])
+    update_bandit.main()
+    state = json.loads(update_bandit.STATE_PATH.read_text())
+    return {a["name"]: (a["alpha"], a["beta"]) for a in state["arms"]}
+
+
+def test_incremental_runs_match_rebuild(paths, monkeypatch):
+    log = synthetic_log()
+    rng = random.Random(1)
+    cuts = sorted(rng.sample(range(1, len(log)), 9)) + [len(log)]   # mid-line, mostly
+    start = 0
+    for end in cuts:
+        with open(update_bandit.EVENTS_PATH, "ab") as f:
+            f.write(log[start:end])
+        start = end
+        incremental = run(monkeypatch)
+
+    update_bandit.CHECKPOINT_PATH.unlink()
+    assert run(monkeypatch, "--rebuild") == incremental
+
+    full = update_bandit.update_state(update_bandit.load_current_state(),
+                                      update_bandit.compute_rewards(update_bandit.load_events()))
+    ckpt = update_bandit.Checkpoint.load()
+    assert {k: dict(v) for k, v in ckpt.arm_stats.items() if v["total"]} == {k: dict(v) for k, v in full.items()}
+    assert sum(a + b - 2 for a, b in incremental.values()) == sum(s["total"] for s in full.values())
+
+
+def test_click_after_exit_counts(paths, monkeypatch):
+    # A click thousands of events after its pageview's page_exit still counts
+    events = [{"event": "pageview", "pageview_id": "a", "arm": "casual"},
+              {"event": "page_exit", "pageview_id": "a"}]
+    events += [{"event": "pageview", "pageview_id": f"f{i}", "arm": "default"} for i in range(3_000)]
+    events += [{"event": "card_click", "pageview_id": "a"}]
+    update_bandit.EVENTS_PATH.write_text("".join(json.dumps(e) + "\n" for e in events))
+    assert run(monkeypatch)["casual"] == (2, 1)
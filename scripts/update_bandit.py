@@ -5,25 +5,45 @@ Thompson Sampling bandit updater for OpenArcade landing page.
 Reads landing page events from JSONL log, computes alpha/beta parameters
 per arm, and writes updated bandit_state.json. Run via cron hourly.
 
+Incremental: each run reads only the lines appended since the last one. The
+checkpoint keeps the byte offset reached, per-arm successes/failures, every
+pageview of the last OPEN_EVENTS events (clicked or not, exited or not: a
+click may still follow a page_exit beacon, a pageview may be sent twice)
+and clicks that arrived before their pageview. A pageview counts as a
+failure until its click arrives. The result equals a full recompute unless
+a click or a repeated pageview comes more than OPEN_EVENTS events after
+the pageview; --verify checks that.
+
+Superseded by bandit_service.py, which keeps the state current as events
+arrive; this script refuses to run while the service holds the checkpoint.
+
 Usage:
-    python update_bandit.py
+    python update_bandit.py            # incremental run
+    python update_bandit.py --rebuild  # drop the checkpoint, reread the whole log
+    python update_bandit.py --verify   # compare the checkpoint with a full recompute
 
 Files:
     Input:  /ssd/ssd-data/landing_events.jsonl
     Output: /ssd/openarcade/bandit_state.json (served statically by nginx)
     Report: /ssd/ssd-data/bandit_report.jsonl (append-only, for blog post)
+    State:  /ssd/ssd-data/bandit_checkpoint.json (offset, arm counts, open pageviews)
 """
 
+import argparse
+import fcntl
 import json
 import os
 import sys
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timezone
 from pathlib import Path
 
 EVENTS_PATH = Path("/ssd/ssd-data/landing_events.jsonl")
 STATE_PATH = Path("/ssd/openarcade/bandit_state.json")
 REPORT_PATH = Path("/ssd/ssd-data/bandit_report.jsonl")
+CHECKPOINT_PATH = Path("/ssd/ssd-data/bandit_checkpoint.json")
+
+OPEN_EVENTS = 200_000   # a pageview is remembered this many later events, then its count is final
 
 # Also look for play sessions to compute composite reward
 BROWSER_STATS_PATH = Path("/ssd/browser_stats.json")
@@ -124,17 +144,14 @@ def compute_rewards(events):
     return rewards
 
 
-def update_state(state, rewards):
-    """Update arm alpha/beta from reward data."""
-    arm_map = {a["name"]: a for a in state["arms"]}
+def new_arm_stats():
+    return defaultdict(lambda: {"successes": 0, "failures": 0, "total": 0})
 
-    # Reset to priors (1, 1) and recompute from all data
-    for arm in state["arms"]:
-        arm["alpha"] = 1
-        arm["beta"] = 1
 
+def update_state(state, rewards):
+    """Full recompute of the arm counts from reward data."""
     # Count successes (clicks) and failures (no click) per arm
-    arm_stats = defaultdict(lambda: {"successes": 0, "failures": 0, "total": 0})
+    arm_stats = new_arm_stats()
     for pid, r in rewards.items():
         arm_name = r["arm"]
         arm_stats[arm_name]["total"] += 1
@@ -143,21 +160,138 @@ def update_state(state, rewards):
         else:
             arm_stats[arm_name]["failures"] += 1
 
-    # Update alpha/beta: alpha = 1 + successes, beta = 1 + failures
-    for arm in state["arms"]:
-        s = arm_stats.get(arm["name"])
-        if s:
-            arm["alpha"] = 1 + s["successes"]
-            arm["beta"] = 1 + s["failures"]
-
+    set_arm_params(state, arm_stats)
     return arm_stats
 
 
-def write_report(arm_stats, rewards, state):
+def set_arm_params(state, arm_stats):
+    """alpha = 1 + successes, beta = 1 + failures (priors (1, 1))."""
+    for arm in state["arms"]:
+        s = arm_stats.get(arm["name"])
+        arm["alpha"] = 1 + (s["successes"] if s else 0)
+        arm["beta"] = 1 + (s["failures"] if s else 0)
+
+
+class Checkpoint:
+    """Per-arm counts plus what the next run needs to continue where this one stopped."""
+
+    def __init__(self):
+        self.inode = None
+        self.offset = 0     # bytes of EVENTS_PATH already applied
+        self.seq = 0        # events applied so far
+        self.arm_stats = new_arm_stats()
+        self.open = OrderedDict()      # pageview_id -> [arm, seq of the pageview, clicked]
+        self.orphans = OrderedDict()   # pageview_id -> seq of a click seen before its pageview
+
+    @classmethod
+    def load(cls):
+        ckpt = cls()
+        if not CHECKPOINT_PATH.exists():
+            return ckpt
+        try:
+            data = json.loads(CHECKPOINT_PATH.read_text())
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Checkpoint unreadable ({e}), rereading the whole log")
+            return ckpt
+        ckpt.inode = data["inode"]
+        ckpt.offset = data["offset"]
+        ckpt.seq = data["seq"]
+        for name, s in data["arms"].items():
+            ckpt.arm_stats[name] = s
+        ckpt.open = OrderedDict((pid, [arm, seq, clicked]) for pid, arm, seq, clicked in data["open"])
+        ckpt.orphans = OrderedDict(data["orphans"])
+        return ckpt
+
+    def save(self):
+        data = {
+            "inode": self.inode,
+            "offset": self.offset,
+            "seq": self.seq,
+            "arms": self.arm_stats,
+            "open": [[pid] + pv for pid, pv in self.open.items()],
+            "orphans": list(self.orphans.items()),
+        }
+        CHECKPOINT_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = CHECKPOINT_PATH.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, separators=(",", ":")))
+        tmp.rename(CHECKPOINT_PATH)
+
+    def read_new_events(self):
+        """Yield the events appended since the last run, advancing the offset."""
+        if not EVENTS_PATH.exists():
+            return
+        with open(EVENTS_PATH, "rb") as f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != self.inode or st.st_size < self.offset:
+                # New or truncated log: its lines are all new; the counts carry on
+                if self.inode is not None:
+                    print(f"{EVENTS_PATH} was replaced, reading it from the start")
+                self.inode = st.st_ino
+                self.offset = 0
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # still being written; picked up next run
+                self.offset += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def _count(self, arm, clicked, n):
+        s = self.arm_stats[arm]
+        s["total"] += n
+        s["successes" if clicked else "failures"] += n
+
+    def apply(self, events):
+        """Fold events into the arm counts, as compute_rewards/update_state would."""
+        n = 0
+        for evt in events:
+            n += 1
+            pid = evt.get("pageview_id")
+            if not pid:
+                continue
+            self.seq += 1
+            etype = evt.get("event")
+            if etype == "pageview":
+                arm = evt.get("arm", "default")
+                pv = self.open.get(pid)
+                if pv is None:
+                    clicked = self.orphans.pop(pid, None) is not None
+                    self.open[pid] = [arm, self.seq, clicked]
+                    self._count(arm, clicked, 1)
+                elif pv[0] != arm:
+                    # Sent twice with different arms: the last one counts, as in a full recompute
+                    self._count(pv[0], pv[2], -1)
+                    self._count(arm, pv[2], 1)
+                    pv[0] = arm
+            elif etype == "card_click":
+                pv = self.open.get(pid)
+                if pv is None:
+                    self.orphans.setdefault(pid, self.seq)
+                elif not pv[2]:
+                    pv[2] = True
+                    self._count(pv[0], False, -1)
+                    self._count(pv[0], True, 1)
+            self._expire()
+        return n
+
+    def _expire(self):
+        cutoff = self.seq - OPEN_EVENTS
+        while self.open and next(iter(self.open.values()))[1] < cutoff:
+            self.open.popitem(last=False)
+        while self.orphans and next(iter(self.orphans.values())) < cutoff:
+            self.orphans.popitem(last=False)
+
+
+def write_report(arm_stats, state):
     """Append a timestamped report line for blog post analysis."""
     now = datetime.now(timezone.utc).isoformat()
-    total_pageviews = len(rewards)
-    total_clicks = sum(1 for r in rewards.values() if r["clicked"])
+    total_pageviews = sum(s["total"] for s in arm_stats.values())
+    total_clicks = sum(s["successes"] for s in arm_stats.values())
 
     report = {
         "timestamp": now,
@@ -184,35 +318,83 @@ def write_report(arm_stats, rewards, state):
     return report
 
 
+def write_state(state):
+    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2))
+    tmp.rename(STATE_PATH)
+
+
+def checkpoint_lock():
+    """Exclusive lock on the checkpoint (held open by the caller), or None if another process has it."""
+    CHECKPOINT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    f = open(CHECKPOINT_PATH.with_suffix(".lock"), "w")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def verify(ckpt):
+    """Compare the checkpoint's counts with a full recompute of the log. True if equal."""
+    full = update_state(load_current_state(), compute_rewards(load_events()))
+    ok = True
+    for name in sorted(set(full) | set(ckpt.arm_stats)):
+        want = full.get(name, {"successes": 0, "failures": 0, "total": 0})
+        got = ckpt.arm_stats.get(name, {"successes": 0, "failures": 0, "total": 0})
+        same = dict(want) == dict(got)
+        ok = ok and same
+        print(f"  {name}: full {want['successes']}/{want['total']}, "
+              f"incremental {got['successes']}/{got['total']}{'' if same else '  MISMATCH'}")
+    print(f"Open pageviews: {len(ckpt.open)}, early clicks: {len(ckpt.orphans)}")
+    return ok
+
+
 def main():
-    events = load_events()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="ignore the checkpoint, reread the whole log")
+    parser.add_argument("--verify", action="store_true", help="check the checkpoint against a full recompute")
+    args = parser.parse_args()
+
+    ckpt = Checkpoint() if args.rebuild else Checkpoint.load()
+    if args.verify:
+        # Catch up first so both sides have read the same lines
+        ckpt.apply(ckpt.read_new_events())
+        ok = verify(ckpt)
+        print("Incremental counts match a full recompute" if ok else "Incremental counts DIFFER from a full recompute")
+        sys.exit(0 if ok else 1)
+
+    lock = checkpoint_lock()
+    if lock is None:
+        print("The bandit service (or another run) holds the checkpoint; nothing to do.")
+        return
+
+    events = ckpt.apply(ckpt.read_new_events())
+    # Checkpoint first: the state is derived from it, so a crash in between
+    # only leaves bandit_state.json an hour behind, never counts a line twice
+    ckpt.save()
     state = load_current_state()
 
-    if not events:
+    if not ckpt.arm_stats:
         print("No events found. Writing default state.")
-        STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
-        tmp = STATE_PATH.with_suffix(".tmp")
-        tmp.write_text(json.dumps(state, indent=2))
-        tmp.rename(STATE_PATH)
+        write_state(state)
         return
 
-    rewards = compute_rewards(events)
-    arm_stats = update_state(state, rewards)
+    set_arm_params(state, ckpt.arm_stats)
 
     # Write updated state atomically
     state["updated_at"] = datetime.now(timezone.utc).isoformat()
-    state["total_pageviews"] = len(rewards)
-    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    tmp = STATE_PATH.with_suffix(".tmp")
-    tmp.write_text(json.dumps(state, indent=2))
-    tmp.rename(STATE_PATH)
+    state["total_pageviews"] = sum(s["total"] for s in ckpt.arm_stats.values())
+    write_state(state)
 
     # Write report for blog post data
-    report = write_report(arm_stats, rewards, state)
+    report = write_report(ckpt.arm_stats, state)
 
     # Print summary
-    print(f"Updated bandit state: {len(rewards)} pageviews, "
-          f"{sum(1 for r in rewards.values() if r['clicked'])} clicks")
+    print(f"Updated bandit state: {events} new events, {report['total_pageviews']} pageviews, "
+          f"{report['total_clicks']} clicks, {len(ckpt.open)} pageviews still open")
     for name, stats in report["arms"].items():
         print(f"  {name}: {stats['impressions']} impressions, "
               f"{stats['clicks']} clicks, CTR={stats['ctr']:.1%}, "